@@ -0,0 +1,58 @@
+"""
+Catalog ingestion rate and lookup latency.
+
+    python -m benchmarks.bench_catalog [n_backups] [files_per_backup]
+
+Every backup holds the same files, a tenth of them with changed content, like a
+series of backups of one tree.
+"""
+import sys
+import tempfile
+import time
+
+from raschel import catalog
+from raschel.db import db
+
+
+def _records(backup: int, n_files: int):
+    for i in range(n_files):
+        version = backup if i % 10 == 0 else 0
+        yield f"/home/user/dir{i // 100}", {
+            "filename": f"file{i}.txt",
+            "hash": f"{i:032x}{version:032x}",
+            "last_modified": "2024-04-01T08:30:00.654321",
+        }
+
+
+def main() -> None:
+    n_backups = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_files = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    with tempfile.TemporaryDirectory(prefix="raschel_bench_") as root:
+        db.init_database(f"{root}/catalog.db")
+        elapsed = 0.0
+        for b in range(n_backups):
+            # only the ingestion is timed, not generating the records
+            records = list(_records(b, n_files))
+            start = time.perf_counter()
+            with db.DATABASE.atomic():
+                catalog.register_backup(
+                    f"backup{b}", f"/backups/{b}.zip", "[]", catalog.FULL
+                )
+                catalog.add_versions(f"backup{b}", records)
+            elapsed += time.perf_counter() - start
+        rows = n_backups * n_files
+        print(f"ingested {rows} versions in {elapsed:.2f}s, {rows / elapsed:.0f} rows/s")
+
+        for name, query in (
+            ("file_history", lambda: catalog.file_history("/home/user/dir5/file500.txt")),
+            ("find_hash", lambda: catalog.find_hash(f"{777:032x}{0:032x}")),
+        ):
+            start = time.perf_counter()
+            found = query()
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{name}: {len(found)} versions in {elapsed:.2f}ms")
+        db.DATABASE.close()
+
+
+if __name__ == "__main__":
+    main()
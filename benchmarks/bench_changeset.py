@@ -0,0 +1,61 @@
+"""
+Scaling of the change detection used by `get_archive_file_diffs` and incremental
+backups, from 10k files upwards. 1% of the files are modified between the scans.
+
+Run with `python -m benchmarks.bench_changeset [N ...]`, e.g. `... 10000 100000 1000000`.
+"""
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from raschel import backup, file_util
+
+from .synthetic import make_tree
+
+
+def known_records(src: str) -> dict[tuple[str, str], dict[str, str]]:
+    known = {}
+    for dir, _, files in os.walk(src):
+        for name in files:
+            filename = (Path(dir) / name).as_posix()
+            known[(Path(dir).as_posix(), name)] = {
+                "hash": file_util.get_file_hash(filename),
+                "last_modified": datetime.datetime.fromtimestamp(
+                    os.path.getmtime(filename)
+                ).isoformat(),
+            }
+    return known
+
+
+def main(sizes: list[int]) -> None:
+    for n_files in sizes:
+        root = tempfile.mkdtemp(prefix="raschel_bench_")
+        try:
+            src = Path(f"{root}/in").absolute().as_posix()
+            make_tree(src, n_files, 16, files_per_dir=1000)
+            known = known_records(src)
+            for i in range(0, n_files, 100):
+                filename = f"{src}/dir{i // 1000}/file{i}.txt"
+                with open(filename, "ab") as file:
+                    file.write(b"changed")
+                st = os.stat(filename)
+                os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+            start = time.perf_counter()
+            changes = backup.compute_changeset(known, backup.backup_files([src]))
+            elapsed = time.perf_counter() - start
+            print(
+                f"{n_files:>8} files: {elapsed:7.2f}s, {n_files / elapsed:9.0f} files/s,"
+                f" {len(changes.modified)} modified"
+            )
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10_000, 100_000])
@@ -0,0 +1,49 @@
+"""
+Compare matching a tree against many exclusion patterns with the compiled matcher to
+the old linear scan over `fnmatch` patterns.
+
+    python -m benchmarks.bench_exclude [n_files] [n_patterns]
+"""
+import fnmatch
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from raschel import backup
+from raschel.exclude import ExclusionMatcher
+
+from .synthetic import make_tree
+
+
+def main() -> None:
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    n_patterns = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    with tempfile.TemporaryDirectory(prefix="raschel_bench_") as root:
+        src = Path(root) / "src"
+        make_tree(src, n_files, 16)
+        files = [p.as_posix() for p in src.rglob("*") if p.is_file()]
+        patterns = [f"*.ext{i}" for i in range(n_patterns // 2)]
+        patterns += [f"{src.as_posix()}/dir{i}/file{i}" for i in range(n_patterns // 2)]
+
+        start = time.perf_counter()
+        naive = [f for f in files if not any(fnmatch.fnmatch(f, p) for p in patterns)]
+        naive_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matcher = ExclusionMatcher(patterns)
+        compiled = [f for f in files if not matcher.is_excluded(f)]
+        compiled_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        walked = sum(1 for _ in backup.backup_files([src], patterns))
+        walk_time = time.perf_counter() - start
+
+        print(f"{len(files)} files, {len(patterns)} patterns")
+        print(f"fnmatch scan:     {naive_time:.3f}s ({len(naive)} kept)")
+        print(f"compiled matcher: {compiled_time:.3f}s ({len(compiled)} kept)")
+        print(f"pruned walk:      {walk_time:.3f}s ({walked} kept)")
+
+
+if __name__ == "__main__":
+    main()
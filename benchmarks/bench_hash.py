@@ -0,0 +1,41 @@
+"""
+Throughput of the hash algorithms of `file_util`, in memory and through
+`file_util.get_file_hash` for a file in the page cache.
+
+Run with `python -m benchmarks.bench_hash [MiB]`. blake3 and xxh3_128 are only
+measured if the `blake3` and `xxhash` packages are installed.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from raschel import file_util
+
+
+def _best(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    mib = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    data = os.urandom(mib * 2**20)
+    with tempfile.NamedTemporaryFile(prefix="raschel_bench_") as file:
+        file.write(data)
+        file.flush()
+        print(f"{mib} MiB, available: {', '.join(file_util.hashers())}")
+        print(f"{'algorithm':<10} {'memory MiB/s':>13} {'file MiB/s':>11}")
+        for algorithm in file_util.hashers():
+            memory = _best(lambda: file_util.new_hasher(algorithm).update(data))
+            on_disk = _best(lambda: file_util.get_file_hash(file.name, algorithm))
+            print(f"{algorithm:<10} {mib / memory:13.1f} {mib / on_disk:11.1f}")
+
+
+if __name__ == "__main__":
+    main()
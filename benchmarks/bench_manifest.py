@@ -0,0 +1,66 @@
+"""
+Size, load time and single file lookup of the binary manifest against the json
+meta info of older versions.
+
+    python -m benchmarks.bench_manifest [n_files]
+"""
+import json
+import random
+import sys
+import time
+
+from raschel import manifest
+
+
+def _dirs(n: int) -> dict[str, list[dict]]:
+    rng = random.Random(0)
+    dirs: dict[str, list[dict]] = {}
+    for i in range(n):
+        dirs.setdefault(f"/home/user/project{i % 10}", []).append(
+            {
+                "filename": f"src/module{i // 1000}/sub{i % 7}/file{i}.py",
+                "hash": rng.randbytes(32).hex(),
+                "timestamp": f"2024-05-01T12:00:{i % 60:02d}.{i % 999999:06d}",
+                "last_modified": f"2024-04-01T08:30:{i % 60:02d}.{i % 999983:06d}",
+                "compression": "max",
+            }
+        )
+    return dirs
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    dirs = _dirs(n)
+    attributes = {"id": "bench", "parent": None, "diff_backup": False, "deleted": {}}
+    as_json, dump_time = _timed(
+        lambda: json.dumps({**attributes, "dirs": dirs}, indent=4).encode()
+    )
+    binary, encode_time = _timed(lambda: manifest.encode(dirs, attributes))
+    root, record = "/home/user/project3", dirs["/home/user/project3"][n // 20]
+
+    _, json_load = _timed(lambda: json.loads(as_json))
+    data, open_time = _timed(lambda: manifest.Manifest(binary))
+    found, lookup_time = _timed(lambda: data.lookup(root, record["filename"]))
+    assert found == record
+    count, iter_time = _timed(lambda: sum(1 for _ in data))
+
+    print(f"{n} files")
+    print(
+        f"json:     {len(as_json) / 2**20:8.1f} MiB, encode {dump_time:.3f}s,"
+        f" parse {json_load:.3f}s"
+    )
+    print(
+        f"manifest: {len(binary) / 2**20:8.1f} MiB, encode {encode_time:.3f}s,"
+        f" open {open_time * 1000:.2f}ms, lookup {lookup_time * 1000:.3f}ms,"
+        f" iterate {count} in {iter_time:.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
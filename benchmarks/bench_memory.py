@@ -0,0 +1,85 @@
+"""
+Peak traced memory of building the manifest, guarding that it stays flat as the
+number of files grows.
+
+    python -m benchmarks.bench_memory [n_records ...]
+
+The first table feeds synthetic records to a `ManifestWriter` and, for comparison,
+collects them in a `MetaInfo` like backups did before. The second one runs full
+backups of synthetic trees of `BACKUP_FILES` files, which are past
+`manifest.SPILL_RECORDS`, so the writer spills sorted runs to disk.
+
+The backups don't stay entirely flat: `zipfile` keeps a `ZipInfo` per member in
+the `filelist` of the open archive (to write the central directory at the end),
+so their peak still grows by roughly half a KiB per file.
+"""
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from raschel import backup, manifest
+
+from .synthetic import make_tree
+
+BACKUP_FILES = (2 * manifest.SPILL_RECORDS, 8 * manifest.SPILL_RECORDS)
+
+
+def _record(i: int) -> dict:
+    return {
+        "filename": f"file{i}.txt",
+        "hash": f"{i:064x}",
+        "timestamp": "2024-05-01T12:00:00.123456",
+        "last_modified": "2024-04-01T08:30:00.654321",
+        "compression": "max",
+    }
+
+
+def _peak(fn) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def _streamed(n: int, out: str) -> None:
+    import zipfile
+
+    writer = manifest.ManifestWriter()
+    for i in range(n):
+        writer.add(f"/data/dir{i // 100}", _record(i))
+    with zipfile.ZipFile(out, "w") as archive:
+        writer.write(archive, {"id": "bench"})
+
+
+def _in_memory(n: int) -> None:
+    meta = backup.MetaInfo()
+    for i in range(n):
+        meta.add(f"/data/dir{i // 100}", _record(i))
+    meta.to_bytes()
+
+
+def main() -> None:
+    sizes = [int(n) for n in sys.argv[1:]] or [50_000, 200_000, 800_000]
+    with tempfile.TemporaryDirectory(prefix="raschel_bench_") as root:
+        print(f"{'records':>10} {'streamed MiB':>13} {'in memory MiB':>14}")
+        for n in sizes:
+            streamed = _peak(lambda: _streamed(n, f"{root}/m.zip"))
+            in_memory = _peak(lambda: _in_memory(n))
+            print(f"{n:>10} {streamed:>13.1f} {in_memory:>14.1f}")
+
+        print(f"\n{'files':>10} {'do_backup MiB':>13}")
+        for n in BACKUP_FILES:
+            src = Path(root) / f"src{n}"
+            make_tree(src, n, 64)
+            peak = _peak(lambda: backup.do_backup([src], f"{root}/out"))  # type: ignore
+            print(f"{n:>10} {peak:>13.1f}")
+            shutil.rmtree(src)
+            shutil.rmtree(f"{root}/out")
+
+
+if __name__ == "__main__":
+    main()
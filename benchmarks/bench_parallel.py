@@ -0,0 +1,37 @@
+"""
+Throughput of `do_backup` with 1, 2, 4 and 8 compression workers.
+
+Run with `python -m benchmarks.bench_parallel`.
+"""
+
+import shutil
+import tempfile
+import time
+
+from raschel import backup
+
+from .synthetic import make_tree
+
+
+def main(n_files: int = 400, file_size: int = 512 * 1024) -> None:
+    root = tempfile.mkdtemp(prefix="raschel_bench_")
+    try:
+        src = f"{root}/in"
+        total = make_tree(src, n_files, file_size)
+        print(f"tree: {n_files} files, {total / 2**20:.1f} MiB")
+        base = None
+        for workers in (1, 2, 4, 8):
+            start = time.perf_counter()
+            backup.do_backup([src], f"{root}/out{workers}", workers=workers)  # type: ignore
+            elapsed = time.perf_counter() - start
+            base = base or elapsed
+            print(
+                f"{workers} workers: {elapsed:6.2f}s, {total / 2**20 / elapsed:7.1f} MiB/s,"
+                f" speedup {base / elapsed:.2f}x"
+            )
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare the bytes read from disk by `do_backup` against the old two pass approach
+(`ZipFile.write` followed by `file_util.get_file_hash`).
+
+Run with `python -m benchmarks.bench_single_pass`, the numbers come from
+`/proc/self/io` and are therefore only available on Linux.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+from raschel import backup, file_util
+
+from .synthetic import make_tree
+
+
+def read_bytes() -> int | None:
+    try:
+        with open("/proc/self/io") as file:
+            for line in file:
+                key, value = line.split(":")
+                if key == "rchar":
+                    return int(value)
+    except OSError:
+        pass
+    return None
+
+
+def two_pass_backup(src: str, target: str) -> None:
+    with zipfile.ZipFile(
+        target, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9
+    ) as archive:
+        for dir, _, files in os.walk(src):
+            for file in files:
+                filename = (Path(dir) / file).as_posix()
+                archive.write(filename, arcname=Path(Path(dir).name) / file)
+                file_util.get_file_hash(filename)
+
+
+def measure(fn) -> tuple[float, int | None]:
+    before = read_bytes()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    after = read_bytes()
+    if before is None or after is None:
+        return elapsed, None
+    return elapsed, after - before
+
+
+def main(n_files: int = 200, file_size: int = 256 * 1024) -> None:
+    root = tempfile.mkdtemp(prefix="raschel_bench_")
+    try:
+        src = f"{root}/in"
+        total = make_tree(src, n_files, file_size)
+        results = {
+            "two pass": measure(lambda: two_pass_backup(src, f"{root}/two_pass.zip")),
+            "do_backup": measure(lambda: backup.do_backup([src], f"{root}/out")),  # type: ignore
+        }
+        print(f"tree: {n_files} files, {total / 2**20:.1f} MiB")
+        for name, (elapsed, n_read) in results.items():
+            ratio = f"{n_read / total:.2f}x" if n_read is not None else "n/a"
+            print(f"{name:>10}: {elapsed:6.2f}s, read {ratio} of the tree size")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Timings of the backup, diff and list paths on synthetic trees, saved as json so
+runs of different commits can be compared.
+
+    python -m benchmarks.bench_suite [--scale 0.5] [--scenario small ...]
+        [--output results.json] [--compare old.json]
+
+Every scenario builds a deterministic tree and times `do_backup`,
+`MetaInfo.from_path`, `get_backup_files`, `get_archive_file_diffs` and
+`do_diff_backup` after changing a tenth of the files. Each operation runs in a
+fresh process, so its peak RSS isn't hidden by the ones before. The results are
+written to `benchmarks/results/<commit>.json` by default.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable
+
+from raschel import backup
+
+from . import synthetic
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+SCENARIOS: dict[str, Callable[[str, float], int]] = {
+    "small": lambda root, scale: synthetic.make_tree(root, int(5000 * scale), 1024),
+    "huge": lambda root, scale: synthetic.make_huge_files(
+        root, 2, int(32 * 2**20 * scale)
+    ),
+    "deep": lambda root, scale: synthetic.make_deep_tree(
+        root, 10, 2, max(1, int(4 * scale)), 2048
+    ),
+    "text": lambda root, scale: synthetic.make_tree(root, int(500 * scale), 64 * 1024),
+    "binary": lambda root, scale: synthetic.make_tree(
+        root, int(500 * scale), 64 * 1024, binary=True
+    ),
+}
+
+
+def _peak_rss() -> float | None:
+    """Peak resident set size of this process in MiB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def _backup(src: str, out: str, _: str) -> Any:
+    return backup.do_backup([src], out)  # type: ignore
+
+
+def _from_path(_: str, __: str, archive: str) -> Any:
+    return backup.MetaInfo.from_path(archive)
+
+
+def _backup_files(_: str, __: str, archive: str) -> Any:
+    return backup.get_backup_files(backup.MetaInfo.from_path(archive))
+
+
+def _file_diffs(_: str, __: str, archive: str) -> Any:
+    with zipfile.ZipFile(archive) as zip:
+        return backup.get_archive_file_diffs(zip)
+
+
+def _diff_backup(src: str, out: str, archive: str) -> Any:
+    return backup.do_diff_backup(archive, src, out)  # type: ignore
+
+
+OPERATIONS: dict[str, Callable[[str, str, str], Any]] = {
+    "do_backup": _backup,
+    "MetaInfo.from_path": _from_path,
+    "get_backup_files": _backup_files,
+    "get_archive_file_diffs": _file_diffs,
+    "do_diff_backup": _diff_backup,
+}
+
+
+def _run(
+    operation: str, src: str, out: str, archive: str
+) -> tuple[float, float | None]:
+    """Run `operation` in this process, returns the seconds and the peak RSS."""
+    start = time.perf_counter()
+    OPERATIONS[operation](src, out, archive)
+    return time.perf_counter() - start, _peak_rss()
+
+
+def _measure(operation: str, src: str, out: str, archive: str = "") -> dict[str, Any]:
+    # a fresh interpreter per operation, forked ones would inherit the parent's peak
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+        seconds, rss = pool.submit(_run, operation, src, out, archive).result()
+    return {"operation": operation, "seconds": seconds, "peak_rss_mib": rss}
+
+
+def _tree_size(root: str) -> tuple[int, int]:
+    files = [p for p in Path(root).rglob("*") if p.is_file()]
+    return len(files), sum(p.stat().st_size for p in files)
+
+
+def run_scenario(name: str, scale: float, root: str) -> list[dict[str, Any]]:
+    src = f"{root}/{name}"
+    SCENARIOS[name](src, scale)
+    n_files, n_bytes = _tree_size(src)
+    out = f"{root}/{name}_out"
+
+    results = [_measure("do_backup", src, out)]
+    (archive,) = [p.as_posix() for p in Path(out).glob("*.zip")]
+    for operation in ("MetaInfo.from_path", "get_backup_files"):
+        results.append(_measure(operation, src, out, archive))
+    changed = synthetic.mutate_tree(src, 0.1)
+    for operation in ("get_archive_file_diffs", "do_diff_backup"):
+        results.append(_measure(operation, src, f"{root}/{name}_diff", archive))
+
+    for result in results:
+        seconds = result["seconds"]
+        result.update(
+            scenario=name,
+            files=n_files,
+            bytes=n_bytes,
+            changed=changed,
+            mib_per_s=n_bytes / 2**20 / seconds if seconds else None,
+            files_per_s=n_files / seconds if seconds else None,
+        )
+    return results
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _key(result: dict[str, Any]) -> tuple[str, str]:
+    return result["scenario"], result["operation"]
+
+
+def _print(results: list[dict[str, Any]], baseline: dict[tuple[str, str], Any]) -> None:
+    print(
+        f"{'scenario':<8} {'operation':<24} {'seconds':>8} {'MiB/s':>8}"
+        f" {'files/s':>9} {'RSS MiB':>8} {'change':>7}"
+    )
+    for result in results:
+        rss = result["peak_rss_mib"]
+        old = baseline.get(_key(result))
+        change = f"{result['seconds'] / old['seconds'] - 1:+7.1%}" if old else ""
+        print(
+            f"{result['scenario']:<8} {result['operation']:<24}"
+            f" {result['seconds']:8.3f} {result['mib_per_s']:8.1f}"
+            f" {result['files_per_s']:9.0f} {rss if rss is not None else 0:8.1f}"
+            f" {change:>7}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_suite")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size of the trees")
+    parser.add_argument(
+        "--scenario", action="append", choices=sorted(SCENARIOS), dest="scenarios"
+    )
+    parser.add_argument("--output", help="Json file to write, default by commit")
+    parser.add_argument("--compare", help="Json file of an earlier run")
+    args = parser.parse_args()
+
+    commit = _commit()
+    results: list[dict[str, Any]] = []
+    root = tempfile.mkdtemp(prefix="raschel_bench_")
+    try:
+        for name in args.scenarios or list(SCENARIOS):
+            results.extend(run_scenario(name, args.scale, root))
+    finally:
+        shutil.rmtree(root)
+
+    baseline: dict[tuple[str, str], Any] = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = {_key(r): r for r in json.load(file)["results"]}
+    _print(results, baseline)
+
+    output = Path(args.output or RESULTS_DIR / f"{commit}.json")
+    os.makedirs(output.parent, exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(
+            {
+                "commit": commit,
+                "created": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "scale": args.scale,
+                "results": results,
+            },
+            file,
+            indent=4,
+        )
+    print(f"\nResults written to '{output}'")
+
+
+if __name__ == "__main__":
+    main()
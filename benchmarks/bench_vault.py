@@ -0,0 +1,49 @@
+"""
+Dedup ratio and ingest throughput of the chunk vault on near-identical files, like
+VM images or rotated logs.
+
+Run with `python -m benchmarks.bench_vault`.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from raschel import vault
+
+
+def make_versions(root: str, n_versions: int, size: int, edits: int, seed: int = 0) -> int:
+    """
+    Write `n_versions` copies of a random blob, each with `edits` small insertions.
+    """
+    rng = random.Random(seed)
+    data = bytearray(rng.randbytes(size))
+    os.makedirs(root, exist_ok=True)
+    for i in range(n_versions):
+        for _ in range(edits):
+            pos = rng.randrange(len(data))
+            data[pos:pos] = rng.randbytes(rng.randint(1, 64))
+        with open(f"{root}/image{i}.bin", "wb") as file:
+            file.write(data)
+    return n_versions * size
+
+
+def main(n_versions: int = 8, size: int = 4 * 1024 * 1024, edits: int = 4) -> None:
+    root = tempfile.mkdtemp(prefix="raschel_bench_")
+    try:
+        make_versions(f"{root}/in", n_versions, size, edits)
+        store = vault.Vault(f"{root}/vault")
+        start = time.perf_counter()
+        _, stats = store.backup([f"{root}/in"])  # type: ignore
+        elapsed = time.perf_counter() - start
+        print(f"{stats.files} files, {stats.bytes / 2**20:.1f} MiB, {stats.chunks} chunks")
+        print(f"ingest: {stats.bytes / 2**20 / elapsed:.1f} MiB/s")
+        print(f"dedup ratio: {stats.dedup_ratio:.2f}, stored {stats.stored_bytes / 2**20:.1f} MiB")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Files per second of listing a synthetic tree: `os.walk` with a `Path` and a
+`getmtime` call per file (the old backup walk) against `walker.walk`.
+
+    python -m benchmarks.bench_walker [n_files]
+
+The request this answers asked for a 1M entry tree, pass `1000000` for that, the
+default is smaller so the tree is created in reasonable time.
+"""
+import os
+import sys
+import tempfile
+import time
+from os import path
+from pathlib import Path
+
+from raschel import walker
+
+from .synthetic import make_tree
+
+
+def _os_walk(root: Path) -> int:
+    n = 0
+    for dir, _, files in os.walk(path.abspath(root)):
+        for file in files:
+            p = Path(dir) / file
+            p.absolute().as_posix()
+            path.getmtime(p)
+            n += 1
+    return n
+
+
+def main() -> None:
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with tempfile.TemporaryDirectory(prefix="raschel_bench_") as root:
+        src = Path(root) / "src"
+        make_tree(src, n_files, 0)
+        runs = [("os.walk + getmtime", lambda: _os_walk(src))]
+        for workers in (1, 4, 8):
+            runs.append(
+                (
+                    f"walker, {workers} threads",
+                    lambda w=workers: sum(1 for _ in walker.walk([src], workers=w)),
+                )
+            )
+        print(f"{n_files} files, {os.cpu_count()} cpus")
+        for name, run in runs:
+            start = time.perf_counter()
+            n = run()
+            elapsed = time.perf_counter() - start
+            print(f"{name:22} {elapsed:7.3f}s {n / elapsed:12.0f} files/s")
+
+
+if __name__ == "__main__":
+    main()
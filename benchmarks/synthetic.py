@@ -0,0 +1,125 @@
+"""
+Deterministic synthetic file trees for the benchmarks.
+"""
+
+import os
+import random
+from pathlib import Path
+
+
+def make_tree(
+    root: str | Path,
+    n_files: int,
+    file_size: int,
+    files_per_dir: int = 100,
+    binary: bool = False,
+    seed: int = 0,
+) -> int:
+    """
+    Create `n_files` files of `file_size` bytes below `root`, `files_per_dir` per directory.
+
+    Returns the total number of bytes written.
+    """
+    rng = random.Random(seed)
+    alpha = b"abcdefghijklmnopqrstuvwxyz0123456789 \n"
+    total = 0
+    for i in range(n_files):
+        dir = Path(root) / f"dir{i // files_per_dir}"
+        if i % files_per_dir == 0:
+            os.makedirs(dir, exist_ok=True)
+        if binary:
+            data = rng.randbytes(file_size)
+        else:
+            data = bytes(rng.choices(alpha, k=file_size))
+        with open(dir / f"file{i}.{'bin' if binary else 'txt'}", "wb") as file:
+            file.write(data)
+        total += file_size
+    return total
+
+
+_TEXT = bytes(b"abcdefghijklmnopqrstuvwxyz0123456789 \n"[i % 38] for i in range(256))
+_CHUNK = 1024 * 1024
+
+
+def write_file(
+    filename: str | Path, size: int, binary: bool, rng: random.Random
+) -> None:
+    """
+    Write `size` bytes of random (`binary`) or text content to `filename`, in chunks
+    so huge files don't have to fit in memory.
+    """
+    with open(filename, "wb") as file:
+        left = size
+        while left:
+            data = rng.randbytes(min(left, _CHUNK))
+            file.write(data if binary else data.translate(_TEXT))
+            left -= len(data)
+
+
+def make_huge_files(
+    root: str | Path, n_files: int, file_size: int, binary: bool = False, seed: int = 0
+) -> int:
+    """
+    Create `n_files` files of `file_size` bytes directly below `root`.
+
+    Returns the total number of bytes written.
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    for i in range(n_files):
+        name = f"huge{i}.{'bin' if binary else 'txt'}"
+        write_file(Path(root) / name, file_size, binary, rng)
+    return n_files * file_size
+
+
+def make_deep_tree(
+    root: str | Path,
+    depth: int,
+    fanout: int,
+    files_per_dir: int,
+    file_size: int,
+    seed: int = 0,
+) -> int:
+    """
+    Create a tree `depth` directories deep, every directory has `fanout` sub
+    directories and `files_per_dir` text files of `file_size` bytes. The directory
+    names are unique, so the members of every directory are stored below its name
+    and no record needs a `member_dir` (directories of the same name would get their
+    full path, see `backup.record_member`).
+
+    Returns the total number of bytes written.
+    """
+    rng = random.Random(seed)
+    total = 0
+    dirs = [Path(root)]
+    for level in range(depth):
+        next_dirs = []
+        for dir in dirs:
+            os.makedirs(dir, exist_ok=True)
+            for i in range(files_per_dir):
+                write_file(dir / f"file{i}.txt", file_size, False, rng)
+                total += file_size
+            if level + 1 < depth:
+                for _ in range(fanout):
+                    next_dirs.append(dir / f"l{level + 1}d{len(next_dirs)}")
+        dirs = next_dirs
+    return total
+
+
+def mutate_tree(root: str | Path, fraction: float, seed: int = 0) -> int:
+    """
+    Overwrite the start of every `1 / fraction`-th file below `root` (in sorted
+    order) and append a line to it, the same files change for the same `seed`.
+
+    Returns the number of changed files.
+    """
+    rng = random.Random(seed)
+    files = sorted(p for p in Path(root).rglob("*") if p.is_file())
+    step = max(1, round(1 / fraction)) if fraction else 0
+    changed = files[::step] if step else []
+    for filename in changed:
+        with open(filename, "r+b") as file:
+            file.write(rng.randbytes(16).hex().encode())
+        with open(filename, "ab") as file:
+            file.write(b"changed\n")
+    return len(changed)
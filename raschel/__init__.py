@@ -1 +1 @@
-from . import config, file_util, diff, db, backup  # type: ignore
+from . import config, fileio, file_util, diff, db, compress, exclude, walker, pipeline, stats, volumes, checkpoint, manifest, index, catalog, backup, restore, vault, verify, watch  # type: ignore
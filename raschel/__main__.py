@@ -1,9 +1,29 @@
+import json
 import logging
 import re as re
+import signal
+import sys
+import threading
+import zipfile
+from pathlib import Path
 from argparse import ArgumentParser
 
 from raschel import backup
+from raschel import catalog
+from raschel import checkpoint
+from raschel import compress
 from raschel import config
+from raschel import file_util
+from raschel import manifest
+from raschel import restore
+from raschel import vault
+from raschel import verify
+from raschel import volumes
+from raschel import watch
+from raschel.db import db
+from raschel.index import FileIndex
+from raschel.pipeline import PipelineSettings
+from raschel.stats import BackupStats
 
 log = logging.getLogger(__name__)
 logging.basicConfig(
@@ -39,7 +59,7 @@ def main():
         action="extend",
         nargs="+",
         type=str,
-        help="Exclude listed paths from the backup"
+        help="Exclude listed paths or gitignore style patterns (like '*.tmp' or 'node_modules/') from the backup"
     )
 
     parser.add_argument(
@@ -51,19 +71,322 @@ def main():
         metavar="BACKUP_FILE"
     )
 
+    parser.add_argument(
+        "--vault",
+        action="store",
+        nargs="?",
+        const="",
+        type=str,
+        help="Store the backup in a deduplicating chunk vault (default: vault_path of the config)",
+        metavar="DIR",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--restore",
+        action="store",
+        type=str,
+        help="Restore the files of a backup, following its parent backups",
+        metavar="BACKUP_FILE",
+    )
+
+    parser.add_argument(
+        "--to",
+        action="store",
+        type=str,
+        help="Restore below this directory instead of the original locations",
+        metavar="DIR",
+    )
+
+    parser.add_argument(
+        "--only",
+        action="store",
+        type=str,
+        help="Only restore files whose original path matches the glob pattern",
+        metavar="GLOB",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=1,
+        help="Number of threads per stage reading, compressing or extracting files in parallel",
+    )
+
+    parser.add_argument(
+        "--db",
+        action="store",
+        type=str,
+        help="Database holding the file index and the backup catalog (default: backup.db in --target, or in DIR with --backfill)",
+        metavar="DB",
+    )
+
+    parser.add_argument(
+        "-i",
+        "--index",
+        action="store_true",
+        help="Keep the hashes of backed up files in the database to skip unchanged files",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only back up files changed since the newest backup of the same directories",
+    )
+
+    parser.add_argument(
+        "--parent",
+        action="store",
+        type=str,
+        help="Id of the backup an incremental backup should be based on",
+        metavar="BACKUP_ID",
+    )
+
+    parser.add_argument(
+        "--consolidate",
+        action="store",
+        type=str,
+        help="Merge the backup chain ending in BACKUP_ID into a new full backup",
+        metavar="BACKUP_ID",
+    )
+
+    parser.add_argument(
+        "--hash",
+        action="store",
+        type=str,
+        choices=file_util.hashers(),
+        help="Algorithm hashing the backed up files (default: hash_algorithm of the config, sha256)",
+        metavar="ALGORITHM",
+    )
+
+    parser.add_argument(
+        "--volume-size",
+        action="store",
+        type=volumes.parse_size,
+        help="Split the backup archive into volumes of at most SIZE bytes, e.g. 700M or 4G",
+        metavar="SIZE",
+    )
+
+    parser.add_argument(
+        "--stats",
+        action="store",
+        nargs="?",
+        const="",
+        type=str,
+        help="Print the time spent per stage and the slowest files after the backup, and write them as json to JSON_FILE if given",
+        metavar="JSON_FILE",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store",
+        type=str,
+        help="Continue the full backup of --dir whose partial archive is ARCHIVE, keeping the files it already holds",
+        metavar="ARCHIVE",
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep watching --dir, or the directories matching backup_from_patterns of the config, and back up the changed files incrementally",
+    )
+
+    parser.add_argument(
+        "--interval",
+        action="store",
+        type=float,
+        help="With --watch, seconds between the incremental backups (default: interval of the watch section of the config, 60)",
+        metavar="SECONDS",
+    )
+
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="With --watch, find changes by walking the directories instead of using inotify",
+    )
+
+    parser.add_argument(
+        "--history",
+        action="store",
+        type=str,
+        help="List the backed up versions of PATH from the catalog",
+        metavar="PATH",
+    )
+
+    parser.add_argument(
+        "--find-hash",
+        action="store",
+        type=str,
+        help="List the backed up files whose content has the hash HASH",
+        metavar="HASH",
+    )
+
+    parser.add_argument(
+        "--backfill",
+        action="store",
+        type=str,
+        help="Add the backup archives below DIR which are missing to the catalog",
+        metavar="DIR",
+    )
+
+    parser.add_argument(
+        "--verify",
+        action="store",
+        type=str,
+        help="Check the CRCs and the manifest of ARCHIVE, or of every archive below a directory, and print a json report",
+        metavar="ARCHIVE",
+    )
+
+    parser.add_argument(
+        "--deep",
+        action="store_true",
+        help="With --verify, also compare the hash of every file with the manifest",
+    )
+
     args = parser.parse_args()
+    db_path = args.db or db.database_path(args.backfill or args.target)
 
     if args.list:
-        meta = backup.MetaInfo.from_path(args.list)
-        backup_files = sorted(backup.get_backup_files(meta))
-        for file in backup_files:
-            print(file)
+        # stream the manifest, the records are never all in memory
+        with zipfile.ZipFile(args.list) as archive, manifest.read(archive) as meta:
+            for root_dir, record in meta:
+                print((Path(root_dir) / record["filename"]).as_posix())
         return
 
-    if not args.dir:
+    if args.verify:
+        reports = verify.verify(
+            verify.find_archives(args.verify), args.deep, workers=args.jobs
+        )
+        print(json.dumps([report.to_dict() for report in reports], indent=4))
+        if not all(report.ok for report in reports):
+            sys.exit(1)
+        return
+
+    if args.backfill:
+        db.init_database(db_path)
+        print(f"Added {catalog.backfill(args.backfill)} backups to the catalog")
+        return
+
+    if args.history or args.find_hash:
+        db.init_database(db_path)
+        if args.history:
+            versions = catalog.file_history(args.history)
+        else:
+            versions = catalog.find_hash(args.find_hash)
+        for version in versions:
+            print(
+                f"{version.backup.created.isoformat(' ', 'seconds')}"
+                f"  {version.backup.id}  {version.backup.kind:<11}"
+                f"  {version.hash.value}  {version.file.path}  ({version.backup.path})"
+            )
+        return
+
+    if args.restore:
+        if args.restore.endswith((vault.SNAPSHOT_SUFFIX, ".json")):
+            # snapshots are stored in <vault>/snapshots/
+            store = vault.Vault(Path(args.restore).absolute().parent.parent)
+            report = store.restore(args.restore, args.to, args.only, workers=args.jobs)
+        else:
+            report = restore.restore(
+                args.restore, args.to, args.only, workers=args.jobs
+            )
+        print(
+            f"Restored {report.restored} files ({report.bytes} bytes),"
+            f" {len(report.failed)} failed"
+        )
+        for failed in report.failed:
+            print(f"failed: {failed}")
+        if report.failed:
+            sys.exit(1)
+        return
+
+    if args.consolidate:
+        db.init_database(db_path)
+        backup.consolidate_chain(args.consolidate, args.target)
+        return
+
+    if not args.dir and not args.watch:
         parser.error("the following arguments are required: -d/--dir")
     
-    backup.do_backup(args.dir, args.target, args.exclude)
+    cfg = config.load_config()
+    hash_algorithm = args.hash or (cfg.hash_algorithm if cfg else file_util.DEFAULT_HASH)
+    if args.vault is not None:
+        vault_path = args.vault or (cfg.vault_path if cfg else None)
+        if not vault_path:
+            parser.error("--vault requires a directory or a vault_path in the config")
+        vault.Vault(vault_path, hash_algorithm).backup(args.dir, args.exclude)
+        return
+
+    policy = compress.CompressionPolicy.from_config(cfg)
+    settings = PipelineSettings.from_config(cfg, args.jobs)
+    index = None
+    # every backup is added to the catalog
+    db.init_database(db_path)
+    if args.index:
+        index = FileIndex()
+    stats = BackupStats() if args.stats is not None else None
+    if args.resume and (args.incremental or args.watch):
+        parser.error("--resume only continues full backups")
+    if args.watch:
+        roots = args.dir or watch.watched_roots(cfg.backup_from_patterns if cfg else [])
+        if not roots:
+            parser.error("--watch requires --dir or backup_from_patterns in the config")
+        watch_settings = watch.WatchSettings.from_config(cfg)
+        if args.interval is not None:
+            watch_settings.interval = args.interval
+        watch_settings.poll = watch_settings.poll or args.poll
+        stop = threading.Event()
+        # a daemon is stopped with SIGTERM
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        watch.watch(
+            roots,
+            args.target,
+            args.exclude,
+            watch_settings,
+            stop,
+            workers=settings,
+            policy=policy,
+            index=index,
+            hash_algorithm=hash_algorithm,
+            volume_size=args.volume_size,
+        )
+        return
+    if args.incremental:
+        out = backup.do_incremental_backup(
+            args.dir,
+            args.target,
+            args.parent,
+            args.exclude,
+            workers=settings,
+            policy=policy,
+            index=index,
+            hash_algorithm=hash_algorithm,
+            volume_size=args.volume_size,
+            stats=stats,
+        )
+    else:
+        out = backup.do_backup(
+            args.dir,
+            args.target,
+            args.exclude,
+            workers=settings,
+            policy=policy,
+            index=index,
+            hash_algorithm=hash_algorithm,
+            volume_size=args.volume_size,
+            stats=stats,
+            # a killed or failed backup can be continued with --resume
+            checkpoint_every=checkpoint.CHECKPOINT_FILES,
+            resume=args.resume,
+        )
+    if stats:
+        print(stats.summary())
+        if args.stats:
+            stats.dump(args.stats)
+    if out is None:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,73 @@
-from codecs import utf_8_decode
+import codecs
+import contextlib
 import datetime
+import io
+import itertools
 import json
 import logging as log
 import os
 from pathlib import Path
 import re as re
+import threading
+import time
 import uuid
 import zipfile
+from dataclasses import dataclass, field
 from os import PathLike, path
-from typing import Any, Optional
+from typing import IO, Any, Iterable, Iterator, Optional
 
-from raschel import file_util
-from raschel.diff import diff_text1
+from raschel import (
+    catalog,
+    checkpoint,
+    compress,
+    file_util,
+    fileio,
+    manifest,
+    pipeline,
+    walker,
+)
+from raschel.checkpoint import Checkpoint
+from raschel.exclude import ExclusionMatcher
+from raschel.index import FileIndex
+from raschel.pipeline import PipelineSettings
+from raschel.stats import (
+    CHANGESET,
+    COMPRESS,
+    MANIFEST,
+    READ,
+    WALK,
+    WRITE,
+    BackupStats,
+)
+from raschel.volumes import (
+    VOLUME_KEY,
+    VolumeReader,
+    VolumeWriter,
+    record_volume,
+    volume_path,
+)
+from raschel.walker import FileEntry
+from raschel.diff import diff_text1, write_delta
+
+
+PATCH_TEXT = "text"
+"""Marks a diff backup record whose member is a `diff_match_patch` text patch."""
+PATCH_DELTA = "delta"
+"""Marks a diff backup record whose member is a binary delta, see `diff.make_delta`."""
+TEXT_DIFF_LIMIT = 1024 * 1024
+"""Files larger than this are always stored as binary deltas."""
+CHANGE_RETRIES = 2
+"""How often a file that changed while it was read is read again during a backup."""
+UNSTABLE_KEY = "unstable"
+"""
+Set in the record of a file that kept changing while it was read, its member holds
+the content of the last read.
+"""
+MEMBER_DIR_KEY = "member_dir"
+"""
+Set in the records of a directory whose name is taken by another directory of the
+same archive, its members are stored below this path instead, see `record_member`.
+"""
 
 
 class MetaInfo:
@@ -19,10 +75,24 @@ class MetaInfo:
         self,
         files: dict[str, list[dict[str, Any]]] | None = None,
         diff_backup: bool = False,
+        parent: str | None = None,
+        deleted: dict[str, list[str]] | None = None,
+        roots: list[str] | None = None,
     ):
+        """
+        Parameters:
+        - `files`: file records per backed up directory
+        - `diff_backup`: whether the archive holds diffs against a full backup
+        - `parent`: id of the backup an incremental backup is based on
+        - `deleted`: names of the files per directory which were removed since the parent backup
+        - `roots`: the directories that were backed up, see `catalog.roots_key`
+        """
         self.diff_backup = diff_backup
         self.dirs = files or {}
         self.id = uuid.uuid4()
+        self.parent = parent
+        self.deleted = deleted or {}
+        self.roots = roots
 
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> "MetaInfo":
@@ -30,29 +100,77 @@ class MetaInfo:
             raise ValueError
         if not isinstance(files := data.get("dirs", {}), dict):
             raise ValueError
+        if not isinstance(deleted := data.get("deleted", {}), dict):
+            raise ValueError
 
-        ret = cls(files, diff_backup)  # type: ignore
+        ret = cls(
+            files, diff_backup, data.get("parent"), deleted, data.get("backup_roots")  # type: ignore
+        )
         _id = data.get("id", uuid.uuid4())
         ret.id = _id
         return ret
 
     @classmethod
-    def from_path(cls, path: str) -> "MetaInfo":
+    def from_manifest(cls, data: manifest.Manifest) -> "MetaInfo":
+        return cls.from_dict({**data.attributes, "dirs": data.to_dirs()})
+
+    @classmethod
+    def from_path(cls, path: str, with_files: bool = True) -> "MetaInfo":
+        """
+        Read the meta info of the archive at `path`, the binary manifest as well as
+        the json of older versions. With `with_files=False` only the attributes of
+        the backup are read and `dirs` stays empty.
+        """
         if not zipfile.is_zipfile(path):
             raise ValueError
         with zipfile.ZipFile(path) as archive:
-            return cls.from_dict(json.loads(archive.read("meta.info")))
+            if not with_files:
+                return cls.from_dict(manifest.read_attributes(archive))
+            with manifest.read(archive) as data:
+                return cls.from_manifest(data)
 
     def to_dict(self) -> dict[str, Any]:
         return {
             "diff_backup": self.diff_backup,
             "dirs": self.dirs,
             "id": str(self.id),
+            "parent": self.parent,
+            "deleted": self.deleted,
+            "backup_roots": self.roots,
         }
 
     def to_json(self) -> str:
         return json.dumps(self.to_dict(), indent=4)
 
+    def attributes(self) -> dict[str, Any]:
+        """Everything but the file records."""
+        attributes = self.to_dict()
+        del attributes["dirs"]
+        return attributes
+
+    def add(self, root_dir: str, record: dict[str, Any]) -> None:
+        self.dirs.setdefault(root_dir, []).append(record)
+
+    def to_bytes(self) -> bytes:
+        """Encode the meta info as binary manifest, see `manifest`."""
+        return manifest.encode(self.dirs, self.attributes())
+
+    def write(
+        self,
+        archive: zipfile.ZipFile,
+        records: Optional[manifest.ManifestWriter] = None,
+    ) -> None:
+        """
+        Store the meta info as manifest in `archive`. If the file records were
+        collected in `records` instead of `dirs`, they are streamed from there.
+        """
+        if records is None:
+            records = manifest.ManifestWriter()
+            for root_dir, files in self.dirs.items():
+                for record in files:
+                    records.add(root_dir, record)
+        records.write(archive, self.attributes())
+
 
 def get_backup_files(meta: MetaInfo) -> Optional[list[PathLike[str]]]:
     file_list: list[PathLike[str]] = []
@@ -62,6 +180,67 @@ def get_backup_files(meta: MetaInfo) -> Optional[list[PathLike[str]]]:
     return file_list
 
 
+def member_name(root_dir: str, filename: str) -> str:
+    """
+    Name of the zip member holding `filename` of the backed up directory `root_dir`,
+    unless its record says otherwise, see `record_member`.
+    """
+    return (Path(Path(root_dir).name) / filename).as_posix()
+
+
+def record_member(root_dir: str, record: dict[str, Any]) -> str:
+    """Name of the zip member holding the file of `record` in `root_dir`."""
+    if (member_dir := record.get(MEMBER_DIR_KEY)) is not None:
+        return (Path(member_dir) / record["filename"]).as_posix()
+    return member_name(root_dir, record["filename"])
+
+
+def _member_dirs(root_dir: str) -> Iterator[str]:
+    """Candidates for the directory the members of `root_dir` are stored below."""
+    yield Path(root_dir).name
+    drive, rest = path.splitdrive(root_dir)
+    full = (Path(drive.replace(":", "").lower()) / rest.lstrip("/\\")).as_posix()
+    yield full
+    for i in itertools.count(1):
+        yield f"{full}~{i}"
+
+
+class _MemberDirs:
+    """
+    The directory the members of every backed up directory of an archive are stored
+    below. That is the name of the directory, like `member_name`, unless another
+    directory of the same name came first, then it is the full path. So no two files
+    share a member, not even across the volumes of a backup.
+    """
+
+    def __init__(self) -> None:
+        self._dirs: dict[str, str] = {}
+        self._taken: set[str] = set()
+        self._lock = threading.Lock()
+
+    def claim(self, root_dir: str, member_dir: str) -> None:
+        """Record that the members of `root_dir` are stored below `member_dir`."""
+        with self._lock:
+            self._dirs[root_dir] = member_dir
+            self._taken.add(member_dir)
+
+    def get(self, root_dir: str) -> str:
+        with self._lock:
+            if (member_dir := self._dirs.get(root_dir)) is None:
+                member_dir = next(
+                    d for d in _member_dirs(root_dir) if d not in self._taken
+                )
+                self._dirs[root_dir] = member_dir
+                self._taken.add(member_dir)
+            return member_dir
+
+    def tag(self, root_dir: str, record: dict[str, Any]) -> dict[str, Any]:
+        """Set `MEMBER_DIR_KEY` in `record` if `member_name` doesn't name its member."""
+        if (member_dir := self.get(root_dir)) != Path(root_dir).name:
+            record[MEMBER_DIR_KEY] = member_dir
+        return record
+
+
 def to_zip_path(p: str | Path) -> Optional[Path]:
     """
     We want to keep the path information of a file tied to its location in the original file system, so we have to remove the drive letters. returns None if the path was invalid
@@ -76,12 +255,413 @@ def to_zip_path(p: str | Path) -> Optional[Path]:
     return Path(p)
 
 
+def _zip_info(
+    file: FileEntry,
+    arcname: str | Path,
+    mode: int,
+    compress_type: int,
+    compresslevel: int | None,
+) -> zipfile.ZipInfo:
+    """
+    Build the `ZipInfo` that `ZipFile.write` would use for `file`, so the entry can be
+    written through `ZipFile.open(zinfo, "w")` instead. Unlike `ZipInfo.from_file`
+    it takes the size and mtime found by the walk instead of calling `stat` again,
+    `mode` is the `st_mode` of the opened file.
+    """
+    date_time = time.localtime(file.mtime_ns / 1e9)[:6]
+    zinfo = zipfile.ZipInfo(os.fspath(arcname), date_time)
+    zinfo.external_attr = (mode & 0xFFFF) << 16
+    zinfo.file_size = file.size
+    zinfo.compress_type = compress_type
+    zinfo._compresslevel = compresslevel  # type: ignore
+    return zinfo
+
+
+def _walk_workers(workers: int | PipelineSettings) -> int:
+    if isinstance(workers, PipelineSettings):
+        return workers.walk_workers
+    return workers
+
+
+def backup_files(
+    paths_to_backup: list[PathLike[str]],
+    excluded_paths: Optional[list[PathLike[str]]] = None,
+    workers: int = 1,
+) -> Iterator[FileEntry]:
+    """
+    Yields every file below `paths_to_backup` which is not excluded.
+
+    `excluded_paths` are absolute paths or gitignore style patterns, see
+    `exclude.ExclusionMatcher`. Excluded directories are pruned from the walk, so
+    nothing below them is listed. See `walker.walk` for `workers`.
+    """
+    matcher = ExclusionMatcher(excluded_paths or [])
+    return walker.walk(paths_to_backup, matcher or None, workers)
+
+
+def archive_names(
+    filename: str, members: Optional[_MemberDirs] = None
+) -> tuple[str, Path, Path]:
+    """
+    Returns the meta info root dir of `filename`, its name inside the archive and the
+    path relative to the root dir which is stored in the meta info. The name inside
+    the archive is taken from `members` if given.
+    """
+    dir = Path(filename).parent
+    root_dir = Path(dir).absolute().as_posix()
+    if members:
+        root_dir_base = Path(members.get(root_dir))
+    else:
+        root_dir_base = Path(Path(dir).absolute().name)
+    file_archive_path = Path(filename).relative_to(root_dir)
+    if not file_archive_path:
+        log.error(f"Could not convert '{filename}' to a zip friendly path")
+        raise ValueError
+    return root_dir, root_dir_base / file_archive_path, file_archive_path
+
+
+def last_modified(mtime_ns: int) -> str:
+    """The `last_modified` field of a file record of a file modified at `mtime_ns`."""
+    return datetime.datetime.fromtimestamp(mtime_ns / 1e9).isoformat()
+
+
+def _file_record(
+    file_archive_path: Path,
+    file_hash: str,
+    compression: str,
+    mtime_ns: int,
+    algorithm: str = file_util.DEFAULT_HASH,
+    volume: int = 0,
+) -> dict[str, Any]:
+    record = {
+        "filename": file_archive_path.as_posix(),
+        "hash": file_hash,
+        file_util.HASH_KEY: algorithm,
+        "timestamp": datetime.datetime.now().isoformat(),
+        "last_modified": last_modified(mtime_ns),
+        "compression": compression,
+    }
+    if volume:
+        record[VOLUME_KEY] = volume
+    return record
+
+
+@dataclass
+class _Source:
+    """A file opened by the read stage of the backup pipeline."""
+
+    root_dir: str
+    file_archive_path: Path
+    zinfo: zipfile.ZipInfo
+    method: str
+    stat: os.stat_result
+    handle: io.BufferedReader | None
+    """Open file if it was too large to be read ahead, `data` is empty then."""
+    data: bytes = b""
+    changed: bool = False
+    """Whether the file changed while it was read, set once it was read completely."""
+
+    def chunks(self) -> Iterator[bytes]:
+        if self.handle is None:
+            yield self.data
+            return
+        with self.handle:
+            yield from fileio.iter_views(self.handle, self.stat.st_size)
+            self.changed = _changed(self.stat, os.fstat(self.handle.fileno()))
+
+    def close(self) -> None:
+        if self.handle is not None:
+            self.handle.close()
+
+
+def _close(value: Any) -> None:
+    if isinstance(value, (_Source, compress.CompressedEntry)):
+        value.close()
+
+
+def _changed(before: os.stat_result, after: os.stat_result) -> bool:
+    """Whether a file was modified between the two stats of it."""
+    return (before.st_size, before.st_mtime_ns, before.st_ctime_ns) != (
+        after.st_size,
+        after.st_mtime_ns,
+        after.st_ctime_ns,
+    )
+
+
+def _write_files(
+    archive: zipfile.ZipFile | VolumeWriter,
+    files: Iterable[FileEntry],
+    records: MetaInfo | manifest.ManifestWriter,
+    workers: int | PipelineSettings,
+    policy: compress.CompressionPolicy,
+    index: Optional[FileIndex],
+    algorithm: str = file_util.DEFAULT_HASH,
+    stats: Optional[BackupStats] = None,
+    progress: Optional[Checkpoint] = None,
+    members: Optional[_MemberDirs] = None,
+) -> list[str]:
+    """
+    Compress `files` into `archive` and add their records to `records`, the files
+    are hashed with `algorithm`. If `archive` is a `VolumeWriter`, the records of
+    members written to another volume than the first carry its number. The time
+    spent per file and stage is recorded in `stats` if given, the written files are
+    added to the checkpoint `progress` if given. `members` holds the member names of
+    the files already in the archive.
+
+    With more than one worker in one of the stages of `workers`, reading, hashing and
+    compressing run in a `pipeline.Pipeline` and this thread only writes the
+    finished entries, in the order of `files`.
+
+    Every file is stat'ed before and after it is read. A file that changed in
+    between is dropped and read again once the other files are written, at most
+    `CHANGE_RETRIES` times. If it still changes, the last read is kept and its
+    record is marked with `UNSTABLE_KEY`. The recorded modification time is always
+    the one from before the read, so the next incremental backup picks the file up
+    again.
+
+    Returns the files which could not be written.
+    """
+    settings = (
+        workers
+        if isinstance(workers, PipelineSettings)
+        else PipelineSettings.for_workers(workers)
+    )
+    volumes = archive if isinstance(archive, VolumeWriter) else VolumeWriter(archive)
+    members = members or _MemberDirs()
+    failed_list: list[str] = []
+
+    def add_record(
+        root_dir: str,
+        filename: str,
+        st: os.stat_result,
+        value: dict[str, Any],
+        changed: bool,
+        zinfo: zipfile.ZipInfo,
+        volume: int,
+    ) -> None:
+        members.tag(root_dir, value)
+        if changed:
+            log.warning(f"'{filename}' kept changing while it was read")
+            value[UNSTABLE_KEY] = True
+        elif index:
+            index.update(filename, st, value["hash"], algorithm)
+        records.add(root_dir, value)
+        if progress:
+            progress.add(root_dir, value, zinfo, volume)
+
+    def read(file: FileEntry) -> _Source:
+        start = time.perf_counter()
+        source = _read(file)
+        if stats:
+            stats.observe(
+                READ, time.perf_counter() - start, len(source.data), file.path
+            )
+        return source
+
+    def _read(file: FileEntry) -> _Source:
+        root_dir, arcname, file_archive_path = archive_names(file.path, members)
+        src, method = compress.open_source(file.path, policy)
+        try:
+            st = os.fstat(src.fileno())
+            zinfo = _zip_info(file, arcname, st.st_mode, *compress.METHODS[method])
+            if st.st_size > settings.read_ahead:
+                return _Source(root_dir, file_archive_path, zinfo, method, st, src)
+            # small files are read in one go, the compress stage doesn't wait on
+            # the disk for them
+            with src:
+                data = src.read()
+                changed = _changed(st, os.fstat(src.fileno()))
+        except BaseException:
+            src.close()
+            raise
+        return _Source(
+            root_dir, file_archive_path, zinfo, method, st, None, data, changed
+        )
+
+    def compress_source(source: _Source) -> tuple[_Source, compress.CompressedEntry]:
+        start = time.perf_counter()
+        try:
+            entry = compress.compress_chunks(
+                source.zinfo, source.chunks(), source.method, source.stat, algorithm
+            )
+        finally:
+            source.close()
+        if stats:
+            stats.observe(
+                COMPRESS,
+                time.perf_counter() - start,
+                source.stat.st_size,
+                (Path(source.root_dir) / source.file_archive_path).as_posix(),
+            )
+        return source, entry
+
+    stages = pipeline.Pipeline(
+        [(read, settings.read_workers), (compress_source, settings.compress_workers)],
+        settings.max_in_flight,
+        discard=lambda value: _close(value[1] if isinstance(value, tuple) else value),
+    )
+
+    def write_parallel(files: Iterable[FileEntry], last: bool) -> list[FileEntry]:
+        changed: list[FileEntry] = []
+        for file, result, error in stages.run(files):
+            log.debug(file.path)
+            filename = file.path
+            try:
+                if error is not None:
+                    raise error
+                source, entry = result
+                if source.changed and not last:
+                    # nothing was written yet, the entry is only dropped
+                    entry.close()
+                    changed.append(file)
+                    continue
+                start = time.perf_counter()
+                try:
+                    dst, volume = volumes.archive_for(entry.zinfo.compress_size)
+                    compress.write_compressed(dst, entry.zinfo, entry.data)
+                finally:
+                    entry.close()
+                if stats:
+                    size = entry.zinfo.compress_size
+                    stats.observe(WRITE, time.perf_counter() - start, size, filename)
+                    stats.file_done(entry.stat.st_size, size)
+                value = _file_record(
+                    source.file_archive_path,
+                    entry.hash,
+                    entry.method,
+                    entry.stat.st_mtime_ns,
+                    algorithm,
+                    volume,
+                )
+                add_record(
+                    source.root_dir,
+                    filename,
+                    entry.stat,
+                    value,
+                    source.changed,
+                    entry.zinfo,
+                    volume,
+                )
+            except Exception as e:
+                failed_list.append(filename)
+                log.error(e)
+                if stats:
+                    stats.file_failed()
+        return changed
+
+    def write_sequential(files: Iterable[FileEntry], last: bool) -> list[FileEntry]:
+        changed: list[FileEntry] = []
+        for file in files:
+            log.debug(file.path)
+            filename = file.path
+            start = time.perf_counter()
+            try:
+                root_dir, arcname, file_archive_path = archive_names(
+                    filename, members
+                )
+                src, method = compress.open_source(filename, policy)
+                with src:
+                    st = os.fstat(src.fileno())
+                    zinfo = _zip_info(
+                        file, arcname, st.st_mode, *compress.METHODS[method]
+                    )
+                    # the compressed size is unknown yet, the file size is an upper
+                    # bound for all but incompressible files
+                    target, volume = volumes.archive_for(st.st_size)
+                    # read the file only once, the hash is computed from the same
+                    # chunks that are handed to the compressor
+                    with target.open(zinfo, "w") as dst:
+                        file_hash = file_util.hash_copy(src, dst, algorithm)
+                    is_changed = _changed(st, os.fstat(src.fileno()))
+                if is_changed and not last:
+                    # the member went straight into the archive, take it out again
+                    volumes.discard(target, zinfo)
+                    changed.append(file)
+                    continue
+                if stats:
+                    # read, hash, compress and write are a single pass here
+                    seconds = time.perf_counter() - start
+                    stats.observe(COMPRESS, seconds, st.st_size, filename)
+                    stats.file_done(st.st_size, zinfo.compress_size)
+                value = _file_record(
+                    file_archive_path,
+                    file_hash,
+                    method,
+                    st.st_mtime_ns,
+                    algorithm,
+                    volume,
+                )
+                add_record(root_dir, filename, st, value, is_changed, zinfo, volume)
+            except Exception as e:
+                failed_list.append(filename)
+                log.error(e)
+                if stats:
+                    stats.file_failed()
+        return changed
+
+    write = write_parallel if settings.parallel else write_sequential
+    pending: Iterable[FileEntry] = files
+    for attempt in range(CHANGE_RETRIES + 1):
+        # files which changed are retried after all others, a busy file doesn't hold
+        # up the rest of the backup and gets some time to settle
+        pending = write(pending, attempt == CHANGE_RETRIES)
+        if not pending:
+            break
+        log.info(f"Reading {len(pending)} files again, they changed while being read")
+    return failed_list
+
+
+def _archive_path(target_dir: PathLike[str], name: Any) -> str:
+    timestamp = datetime.datetime.now()
+    time = timestamp.isoformat("_", "seconds").replace("-", "_").replace(":", "_")
+    return (Path(target_dir) / f"{str(name)}_{time}.zip").resolve().as_posix()
+
+
 def do_backup(
     paths_to_backup: list[PathLike[str]],
     target_dir: PathLike[str],
     excluded_paths: Optional[list[PathLike[str]]] = None,
+    workers: int | PipelineSettings = 1,
+    policy: Optional[compress.CompressionPolicy] = None,
+    index: Optional[FileIndex] = None,
+    hash_algorithm: str = file_util.DEFAULT_HASH,
+    volume_size: Optional[int] = None,
+    stats: Optional[BackupStats] = None,
+    checkpoint_every: Optional[int] = None,
+    resume: Optional[PathLike[str] | str] = None,
+    failed: Optional[list[str]] = None,
 ) -> str | None:
     """
+    Parameters:
+    - `workers`: number of threads per stage of the backup pipeline (walk, read,
+      hash/compress), or `PipelineSettings` to set each stage on its own. With more
+      than one worker, entries are compressed independently and appended to the archive
+      by a single writer in the same order as a sequential backup, while the bounded
+      queues between the stages keep the memory use flat.
+    - `policy`: chooses the compression method per file, the choice is recorded as
+      `compression` in the file's meta info. Defaults to `compress.CompressionPolicy()`.
+    - `index`: if given, the hashes computed during the backup are stored in it.
+    - `hash_algorithm`: algorithm of the file hashes, see `file_util.hashers`. It is
+      recorded per file, so archives made with different algorithms stay verifiable.
+    - `volume_size`: if given, the archive is split into volumes of at most about
+      this many bytes, see `volumes`. The returned archive is the first volume and
+      holds the manifest.
+    - `stats`: if given, the time spent walking, reading, compressing and writing is
+      recorded in it, see `stats.BackupStats`.
+    - `checkpoint_every`: if given, the written files are saved to a checkpoint next
+      to the archive every this many files (or `checkpoint.CHECKPOINT_SECONDS`), see
+      `checkpoint`. A backup with failed files then keeps its partial archive without
+      manifest, so it can be resumed, but `None` is returned all the same.
+    - `resume`: archive of a backup of the same `paths_to_backup` that failed or was
+      killed while checkpointing. It is reopened, the files of its checkpoint are
+      kept and only the others are backed up. `target_dir` isn't used then.
+    - `failed`: if given, a backup with files that couldn't be written is kept
+      without them instead of being removed, as long as it holds any file, and the
+      files are appended to `failed`. Ignored while checkpointing.
+
+    If the catalog database is open (see `db.db.init_database`), the backup and the
+    versions of its files are added to it.
+
     Raises:
         ValueError if one of the file paths could not be converted into a zip friendly path
     Returns:
@@ -93,159 +673,391 @@ def do_backup(
         )
         paths_to_backup = [paths_to_backup]
 
+    file_util.new_hasher(hash_algorithm)  # fail before anything is written
     os.makedirs(target_dir, exist_ok=True)
+    policy = policy or compress.CompressionPolicy()
 
-    failed = False
-    failed_list: list[str] = []
-    timestamp = datetime.datetime.now()
-    time = timestamp.isoformat("_", "seconds").replace("-", "_").replace(":", "_")
-    meta_info = MetaInfo()
-    out_path = (
-        (Path(target_dir) / f"{str(meta_info.id)}_{time}.zip").resolve().as_posix()
-    )
+    roots = catalog.roots_key(paths_to_backup)
+    meta_info = MetaInfo(roots=json.loads(roots))
+    written: list[dict[str, Any]] = []
+    if resume:
+        out_path = Path(resume).absolute().as_posix()
+        meta_info.id, archive, volumes, written = _resume(
+            out_path, meta_info.roots, volume_size  # type: ignore
+        )
+        checkpoint_every = checkpoint_every or checkpoint.CHECKPOINT_FILES
+    else:
+        out_path = _archive_path(target_dir, meta_info.id)
+        archive = zipfile.ZipFile(
+            out_path,
+            "a",
+            compression=zipfile.ZIP_DEFLATED,
+            compresslevel=9,
+        )
+        volumes = VolumeWriter(archive, volume_size)
+    progress = None
+    if checkpoint_every:
+        progress = Checkpoint(
+            out_path,
+            {"id": str(meta_info.id), "roots": meta_info.roots},
+            volumes.sync,
+            checkpoint_every,
+        )
 
-    with zipfile.ZipFile(
-        out_path,
-        "a",
-        compression=zipfile.ZIP_DEFLATED,
-        compresslevel=9,
-    ) as archive:
+    with archive, volumes:
         # now recursively go through the paths
-        for dir in paths_to_backup:
-            if excluded_paths is not None and Path(dir).absolute().as_posix() in excluded_paths:  # type: ignore
-                continue
-
-            def _not_in_excluded_paths(p):
-                if not excluded_paths:
-                    return True
-                return p.as_posix() not in excluded_paths
-
-            _files = (
-                Path(dir) / file
-                for dir, _, files in os.walk(path.abspath(dir))
-                for file in files
+        files = backup_files(paths_to_backup, excluded_paths, _walk_workers(workers))
+        # the records are spilled to disk as they come in, memory stays flat no
+        # matter how many files are backed up
+        records = manifest.ManifestWriter()
+        members = _MemberDirs()
+        if written:
+            done = set()
+            for entry in written:
+                root_dir, record = entry["root_dir"], entry["record"]
+                records.add(root_dir, record)
+                member_dir = record.get(MEMBER_DIR_KEY, Path(root_dir).name)
+                members.claim(root_dir, member_dir)
+                done.add((Path(root_dir) / record["filename"]).as_posix())
+            files = (f for f in files if Path(f.path).absolute().as_posix() not in done)
+        if stats:
+            files = stats.timed(WALK, files)
+        try:
+            failed_list = _write_files(
+                volumes,
+                files,
+                records,
+                workers,
+                policy,
+                index,
+                hash_algorithm,
+                stats,
+                progress,
+                members,
             )
-            _files = filter(_not_in_excluded_paths, _files)
-
-            for file in _files:
-                dir = file.parent
-                log.info(f"{file}")
-                filename = file.as_posix()
-                try:
-                    root_dir = Path(dir).absolute().as_posix()
-                    root_dir_base = Path(Path(dir).absolute().name)
-                    file_archive_path = Path(filename).relative_to(root_dir)
-                    if not file_archive_path:
-                        log.error(
-                            f"Could not convert '{filename}' to a zip friendly path"
-                        )
-                        raise ValueError
-                    archive.write(
-                        filename=filename,
-                        arcname=root_dir_base / file_archive_path,
-                        compress_type=zipfile.ZIP_DEFLATED,
-                        compresslevel=9,
-                    )
-                    value = {
-                        "filename": file_archive_path.as_posix(),
-                        "hash": file_util.get_file_hash(filename),
-                        "timestamp": datetime.datetime.now().isoformat(),
-                        "last_modified": datetime.datetime.fromtimestamp(
-                            path.getmtime(filename)
-                        ).isoformat(),
-                    }
-                    meta_info.dirs.setdefault(root_dir, []).append(value)  # type: ignore
-                except Exception as e:
-                    failed = True
-                    failed_list.append(filename)
-                    log.error(e)
-        """
-            also store that we are making a full backup
-        """
-        archive.writestr("meta.info", meta_info.to_json())
-    if failed:
+        finally:
+            if progress:
+                progress.close()
+        # a partial archive gets no manifest, it must not pass for a complete backup
+        if not (failed_list and progress):
+            """
+                also store that we are making a full backup
+            """
+            start = time.perf_counter()
+            meta_info.write(archive, records)
+            if stats:
+                stats.observe(MANIFEST, time.perf_counter() - start)
+    if stats:
+        stats.finish()
+    if index:
+        index.flush()
+    if failed_list:
         log.error("Backup unsuccesful!")
         for f in failed_list:
             log.error(f"Could not write '{f}' to zip file in'{to_zip_path(f)}'")
-        if path.exists(out_path):
-            os.remove(path=out_path)
+        if progress:
+            log.error(f"The backup can be resumed from '{out_path}'")
+            return None
+        if failed is None or not records.count:
+            if path.exists(out_path):
+                os.remove(path=out_path)
+            volumes.remove()
+            return None
+        failed.extend(failed_list)
+        log.warning(f"Keeping the backup without the {len(failed_list)} failed files")
+    elif progress:
+        progress.remove()
+    catalog.record_backup(out_path, roots, catalog.FULL)
     log.info(f"Backup succesfully written to '{out_path}'")
     return out_path
 
 
+def _resume(
+    archive_path: str, roots: list[str], volume_size: Optional[int]
+) -> tuple[str, zipfile.ZipFile, VolumeWriter, list[dict[str, Any]]]:
+    """
+    Reopen the partial backup `archive_path` of `roots` from its checkpoint.
+
+    Returns the id of the backup, its first volume, a `VolumeWriter` continuing its
+    last volume and the files of the checkpoint.
+    """
+    attributes, written = checkpoint.load(archive_path)
+    if attributes["roots"] != roots:
+        raise ValueError(f"'{archive_path}' is a backup of other directories")
+    members: dict[int, list[dict[str, Any]]] = {}
+    for entry in written:
+        members.setdefault(entry["member"]["volume"], []).append(entry["member"])
+    last = max(members, default=0)
+    for volume in range(1, last):
+        if not zipfile.is_zipfile(volume_path(archive_path, volume)):
+            raise ValueError(f"Volume {volume} of '{archive_path}' is missing")
+
+    archive = checkpoint.reopen(archive_path, members.get(0, []))
+    volumes = VolumeWriter(archive, volume_size)
+    try:
+        if last:
+            current = checkpoint.reopen(volume_path(archive_path, last), members[last])
+            volumes.resume(last, current)
+        else:
+            volumes.resume(0, archive)
+    except BaseException:
+        archive.close()
+        raise
+    log.info(f"Resuming '{archive_path}' after {len(written)} files")
+    return attributes["id"], archive, volumes, written
+
+
+def _get_file_hash(
+    filename: str,
+    index: Optional[FileIndex] = None,
+    st: Optional[os.stat_result | FileEntry] = None,
+    algorithm: str = file_util.DEFAULT_HASH,
+) -> str:
+    if index:
+        return index.get_hash(filename, st, algorithm)
+    return file_util.get_file_hash(filename, algorithm)
+
+
+def _is_text(filename: str, size: int) -> bool:
+    if size > TEXT_DIFF_LIMIT:
+        return False
+    with open(filename, "rb") as file:
+        sample = file.read(8192)
+    if b"\0" in sample:
+        return False
+    try:
+        # the sample may end within a multi byte character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=size <= 8192)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _write_diff(
+    filename: str, archive: zipfile.ZipFile, member: str, out: IO[bytes]
+) -> str:
+    """
+    Write the patch turning the archived `member` into the current `filename` to
+    `out`: a text patch for small text files and a binary delta for everything else.
+
+    Returns the patch format, `PATCH_TEXT` or `PATCH_DELTA`.
+    """
+    zinfo = archive.getinfo(member)
+    if _is_text(filename, max(zinfo.file_size, path.getsize(filename))):
+        contents = archive.read(member)
+        try:
+            out.write(str(diff_text1(filename, contents)).encode())
+            return PATCH_TEXT
+        except UnicodeDecodeError:
+            pass
+    with archive.open(member) as base:
+        write_delta(filename, base, zinfo.file_size, out)
+    return PATCH_DELTA
+
+
+def _diff_file(filename: str, archive: zipfile.ZipFile, member: str) -> str | bytes:
+    """The patch of `_write_diff` in memory, text patches as `str`."""
+    out = io.BytesIO()
+    if _write_diff(filename, archive, member, out) == PATCH_TEXT:
+        return out.getvalue().decode()
+    return out.getvalue()
+
+
+@dataclass
+class Changeset:
+    """
+    Result of comparing the files on disk with the records of a backup, every entry is
+    the absolute path of a file.
+    """
+
+    added: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    unchanged: list[str] = field(default_factory=list)
+    entries: dict[str, FileEntry] = field(default_factory=dict)
+    """What the walk found for the added and modified files."""
+
+
+def _split(filename: str) -> tuple[str, str]:
+    """Splits a posix path into the meta info root dir and filename."""
+    root_dir, _, name = filename.rpartition("/")
+    return root_dir or "/", name
+
+
+def compute_changeset(
+    known: dict[tuple[str, str], dict[str, Any]],
+    files: Iterable[FileEntry],
+    index: Optional[FileIndex] = None,
+) -> Changeset:
+    """
+    Compare the current `files` with the `known` records keyed by `(root dir, filename)`.
+
+    Runs in a single pass over `files` with dictionary and set lookups. The stat
+    results of the walk are used as they are, a file is only hashed if its
+    modification time differs from the recorded one, with the algorithm of the record.
+    """
+    changes = Changeset()
+    seen: set[tuple[str, str]] = set()
+    for file in files:
+        filename = file.path
+        key = _split(filename)
+        seen.add(key)
+        if (record := known.get(key)) is None:
+            changes.added.append(filename)
+            changes.entries[filename] = file
+            continue
+        if (
+            last_modified(file.mtime_ns) == record["last_modified"]
+            or _get_file_hash(filename, index, file, file_util.record_algorithm(record))
+            == record["hash"]
+        ):
+            changes.unchanged.append(filename)
+        else:
+            changes.modified.append(filename)
+            changes.entries[filename] = file
+    for root_dir, name in sorted(known.keys() - seen):
+        changes.deleted.append((Path(root_dir) / name).as_posix())
+    return changes
+
+
+def _touched_files(
+    paths_to_backup: list[PathLike[str]],
+    touched: Iterable[str],
+    excluded_paths: Optional[list[PathLike[str]]] = None,
+) -> tuple[list[FileEntry], set[str]]:
+    """
+    The files at or below the `touched` paths which are backed up from
+    `paths_to_backup` and not excluded, and the touched paths below a backed up
+    directory as absolute posix paths.
+
+    A touched directory is walked completely, a touched path that doesn't exist
+    anymore only yields no files.
+    """
+    matcher = ExclusionMatcher(excluded_paths or [])
+    roots = [Path(os.path.abspath(p)).as_posix() for p in paths_to_backup]
+    scope: set[str] = set()
+    files: dict[str, FileEntry] = {}
+    for p in touched:
+        filename = Path(os.path.abspath(p)).as_posix()
+        root = next(
+            (r for r in roots if filename == r or filename.startswith(f"{r}/")), None
+        )
+        if root is None:
+            continue
+        scope.add(filename)
+        if path.isdir(filename) and not path.islink(filename):
+            for file in walker.walk([filename], matcher or None, base=root):
+                files[file.path] = file
+            continue
+        if not path.isfile(filename):
+            continue
+        if matcher and matcher.is_excluded(filename, filename[len(root) + 1 :]):
+            continue
+        try:
+            st = os.stat(filename)
+        except OSError as e:
+            log.warning(f"Skipping '{filename}': {e}")
+            continue
+        files[filename] = FileEntry(filename, st.st_size, st.st_mtime_ns, st.st_ino)
+    return list(files.values()), scope
+
+
+def _in_scope(
+    known: dict[tuple[str, str], dict[str, Any]], scope: set[str]
+) -> dict[tuple[str, str], dict[str, Any]]:
+    """The `known` records of files at or below one of the paths of `scope`."""
+    dirs: dict[str, bool] = {}
+
+    def dir_in_scope(dir: str) -> bool:
+        if (hit := dirs.get(dir)) is None:
+            parent = dir.rpartition("/")[0]
+            hit = dir in scope or (bool(parent) and dir_in_scope(parent))
+            dirs[dir] = hit
+        return hit
+
+    return {
+        (root_dir, name): record
+        for (root_dir, name), record in known.items()
+        if f"{root_dir.rstrip('/')}/{name}" in scope or dir_in_scope(root_dir)
+    }
+
+
+def get_archive_changeset(
+    archive: zipfile.ZipFile, index: Optional[FileIndex] = None
+) -> Changeset:
+    """
+    Compare the files below the directories backed up in `archive` with its records.
+
+    Archives written before the backed up directories were stored in the manifest
+    are compared below the topmost directories holding files.
+    """
+    with manifest.read(archive) as meta:
+        known = {(root_dir, record["filename"]): record for root_dir, record in meta}
+        roots = meta.attributes.get("backup_roots") or catalog.top_dirs(meta.roots)
+    files = walker.walk(roots)
+    return compute_changeset(known, files, index)
+
+
+def _diff_bases(
+    archive: zipfile.ZipFile, modified: list[str]
+) -> Iterator[tuple[str, zipfile.ZipFile, str]]:
+    """
+    Yields `(file, volume, member)` for the `modified` files, the member of `volume`
+    holds the version of the file in `archive`.
+    """
+    if not modified:
+        return
+    with manifest.read(archive) as meta, VolumeReader(archive) as volumes:
+        for original_file_path in modified:
+            log.debug(f"{original_file_path} has changed.")
+            root_dir, filename = _split(original_file_path)
+            record = meta.lookup(root_dir, filename) or {"filename": filename}
+            yield original_file_path, volumes.archive_of(record), record_member(
+                root_dir, record
+            )
+
+
+def _changeset_diffs(
+    archive: zipfile.ZipFile, changes: Changeset
+) -> list[tuple[str, str | bytes]]:
+    for deleted in changes.deleted:
+        log.warning(f"{deleted} has been moved or deleted.")
+    return [
+        (original_file_path, _diff_file(original_file_path, volume, member))
+        for original_file_path, volume, member in _diff_bases(archive, changes.modified)
+    ]
+
+
 def get_archive_file_diffs(
     archive: zipfile.ZipFile,
-):  # TODO! Respect zip folderstructure, this will be changed soon!
-    """Compare files with the ones referenced in backup."""
-    backup_files: list[dict[str, Any]] = []
-
-    data = archive.read(
-        "meta.info",
-    )
-    data, _ = utf_8_decode(data)
-    meta: MetaInfo = MetaInfo.from_dict(json.loads(data))
-    """
-    Read the backed up files from the meta file in the archive
-    """
-    changed_paths: list[tuple[str, str]] = []
-    for backup_dir, dirs in meta.dirs.items():
-        archive_root = Path(backup_dir).name
-        for file_obj in dirs:
-            original_file_path = (Path(backup_dir) / file_obj["filename"]).as_posix()
-
-            if not path.exists(original_file_path):
-                log.warning(f"{original_file_path} has been moved or deleted.")
-                continue  # TODO handle file removed
-
-            original_timestamp = path.getmtime(original_file_path)
-            backup_timestamp = datetime.datetime.fromisoformat(
-                file_obj["last_modified"]
-            ).timestamp()
-
-            if (
-                original_timestamp > backup_timestamp
-                and file_util.get_file_hash(original_file_path) != file_obj["hash"]
-            ):  # original is newer, FIXME! at the moment on windows this is always true in tests, cannot verify, so we also check the hash
-                log.debug(f"{original_file_path} has changed.")
-                file_archive_path = (
-                    Path(archive_root) / file_obj["filename"]
-                ).as_posix()
-                contents = archive.read(file_archive_path)
-                diff = diff_text1(original_file_path, contents)
-
-                changed_paths.append((original_file_path, str(diff)))
-
-    original_files: list[str] = []
-    for dir_path, meta_files in meta.dirs.items():
-        # for v in meta_files:
-        backup_files.extend(meta_files)
-
-        for file_dir, _, files in os.walk(dir_path):
-            for file in files:
-                original_files.append((Path(file_dir) / file).as_posix())
-
-    for backup_file in backup_files:
-        if (file := backup_file["filename"]) in original_files:
-            if not backup_file["hash"] == (file_util.get_file_hash(file)):
-                file_archive_path = to_zip_path(backup_file["filename"])
-                if not file_archive_path:
-                    log.error(
-                        f"Could not convert '{backup_file['filename']}' to a zip friendly path"
-                    )
-                    raise ValueError
-                contents = archive.read(file_archive_path.as_posix())
-                diff = diff_text1(file, contents)
-                changed_paths.append((file, str(diff)))
+    index: Optional[FileIndex] = None,
+) -> list[tuple[str, str | bytes]]:
+    """
+    Compare files with the ones referenced in backup.
 
-    return changed_paths
+    If `index` is given, files which did not change since they were last hashed are
+    not read again. Returns the changed files with a text patch (`str`) or a binary
+    delta (`bytes`), see `diff.write_delta`.
+    """
+    return _changeset_diffs(archive, get_archive_changeset(archive, index))
 
 
 def do_diff_backup(
-    backup_archive: str, dir_path: PathLike[str], target_dir: PathLike[str]
+    backup_archive: str,
+    dir_path: PathLike[str],
+    target_dir: PathLike[str],
+    index: Optional[FileIndex] = None,
+    hash_algorithm: str = file_util.DEFAULT_HASH,
 ) -> str:
     """
     Do a differential backup based on a given full backup
 
+    Only changed files below `dir_path` are stored, as patches against their version
+    in `backup_archive`. The members are laid out like in a full backup and the meta
+    info points to the full backup through `parent`, every record is marked with the
+    `patch` format needed to apply it. Like `do_backup`, the backup is added to the
+    catalog if the database is open and the new versions are hashed with
+    `hash_algorithm`.
     """
     if not zipfile.is_zipfile(backup_archive):
         raise ValueError(f"Expected '{backup_archive}' to be a '.zip' file.")
@@ -253,32 +1065,21 @@ def do_diff_backup(
     # collect original archive dirs from previous backup
     with zipfile.ZipFile(backup_archive) as archive:  # type: ignore
 
-        diffs: list[tuple[str, str]] = get_archive_file_diffs(archive)
+        changes = get_archive_changeset(archive, index)
+        for deleted in changes.deleted:
+            log.warning(f"{deleted} has been moved or deleted.")
 
-        data = archive.read(
-            "meta.info",
-        )
-        data, _ = utf_8_decode(data)
-        old_meta: MetaInfo = MetaInfo.from_dict(json.loads(data))
+        old_meta = MetaInfo.from_dict(manifest.read_attributes(archive))
         timestamp = datetime.datetime.now()
-        time = timestamp.isoformat("_", "seconds").replace("-", "_").replace(":", "_")
-        out_path = (Path(target_dir) / f"{old_meta.id}_{time}.zip").as_posix()
-
-        files: dict[str, list[dict[str, str]]] = {
-            Path(dir_path).as_posix(): [
-                {
-                    "filename": changed_file,
-                    "hash": file_util.get_file_hash(changed_file),
-                    "timestamp": timestamp.isoformat(),
-                    "last_modified": datetime.datetime.fromtimestamp(
-                        path.getmtime(changed_file)
-                    ).isoformat(),
-                }
-                for changed_file, _ in diffs
-            ]
-        }
-
-        new_meta = MetaInfo(files=files, diff_backup=True)
+        base_dir = Path(dir_path).absolute()
+        roots = catalog.roots_key([dir_path])
+        new_meta = MetaInfo(
+            diff_backup=True, parent=str(old_meta.id), roots=json.loads(roots)
+        )
+        # named after its own id, the full backup may have been written to the same
+        # directory within the same second
+        os.makedirs(target_dir, exist_ok=True)
+        out_path = _archive_path(target_dir, new_meta.id)
 
         with zipfile.ZipFile(
             out_path,
@@ -286,13 +1087,261 @@ def do_diff_backup(
             compression=zipfile.ZIP_DEFLATED,
             compresslevel=9,
         ) as diff_archive:
-            diff_archive.writestr("meta.info", new_meta.to_json())
-            for changed_file, changed_data in diffs:
-                file_archive_path = to_zip_path(changed_file)
-                if not file_archive_path:
-                    log.error(
-                        f"Could not convert '{changed_file}' to a zip friendly path"
+            members = _MemberDirs()
+            modified = [
+                changed_file
+                for changed_file in changes.modified
+                if Path(changed_file).is_relative_to(base_dir)
+            ]
+            # one file at a time, each patch is streamed into its member
+            for changed_file, volume, member in _diff_bases(archive, modified):
+                entry = changes.entries[changed_file]
+                root_dir, arcname, file_archive_path = archive_names(
+                    changed_file, members
+                )
+                with diff_archive.open(
+                    arcname.as_posix(), "w", force_zip64=True
+                ) as out:
+                    patch = _write_diff(changed_file, volume, member, out)
+                record = members.tag(
+                    root_dir,
+                    {
+                        "filename": file_archive_path.as_posix(),
+                        "hash": _get_file_hash(
+                            changed_file, index, entry, hash_algorithm
+                        ),
+                        file_util.HASH_KEY: hash_algorithm,
+                        "timestamp": timestamp.isoformat(),
+                        "last_modified": last_modified(entry.mtime_ns),
+                        "patch": patch,
+                    },
+                )
+                new_meta.dirs.setdefault(root_dir, []).append(record)
+            new_meta.write(diff_archive)
+    if catalog.is_open():
+        # the full backup may predate the catalog
+        parent = old_meta.id if catalog.get_backup(old_meta.id) else None
+        catalog.record_backup(out_path, roots, catalog.DIFF, parent=parent)
+    return out_path
+
+
+def chain_files(
+    chain: list[catalog.Backup],
+) -> dict[tuple[str, str], tuple[str, dict[str, Any]]]:
+    """
+    Resolve a backup chain (full backup first) into the state of its newest link.
+
+    Returns `(archive path, file record)` for every `(root dir, filename)` present
+    in the newest link, only the meta info of the archives is read. The member of a
+    record with a `patch` is not the file's content, see `restore.resolve`.
+    """
+    state: dict[tuple[str, str], tuple[str, dict[str, Any]]] = {}
+    for link in chain:
+        meta = MetaInfo.from_path(link.path)  # type: ignore
+        for root_dir, names in meta.deleted.items():
+            for name in names:
+                state.pop((root_dir, name), None)
+        for root_dir, records in meta.dirs.items():
+            for record in records:
+                state[(root_dir, record["filename"])] = (link.path, record)  # type: ignore
+    return state
+
+
+def do_incremental_backup(
+    paths_to_backup: list[PathLike[str]],
+    target_dir: PathLike[str],
+    parent: Optional[str] = None,
+    excluded_paths: Optional[list[PathLike[str]]] = None,
+    workers: int | PipelineSettings = 1,
+    policy: Optional[compress.CompressionPolicy] = None,
+    index: Optional[FileIndex] = None,
+    hash_algorithm: str = file_util.DEFAULT_HASH,
+    volume_size: Optional[int] = None,
+    stats: Optional[BackupStats] = None,
+    touched: Optional[Iterable[str]] = None,
+    failed: Optional[list[str]] = None,
+) -> str | None:
+    """
+    Back up only the files that changed since the newest backup of `paths_to_backup`.
+
+    The new archive points to its `parent` by id and lists the files deleted since
+    then, the chain is kept in the catalog database (see `db.db.init_database`). A
+    file counts as changed if its modification time differs from the recorded one and
+    its content hash does too, which is computed with the algorithm of the recorded
+    version. If there is no previous backup, a full backup is made.
+
+    Parameters:
+    - `parent`: id of the backup to build on, defaults to the newest backup of the same directories
+    - `excluded_paths`, `workers`, `policy`, `index`, `hash_algorithm`, `volume_size`,
+      `stats`: see `do_backup`, comparing the files with the previous backup is
+      recorded as the `changeset` stage
+    - `touched`: paths of the files and directories changed since the previous backup,
+      e.g. from `watch.ChangeJournal`. If given, only they are compared with the
+      previous backup instead of walking all of `paths_to_backup`, and the other
+      files are taken over from it. Ignored if a full backup is made
+    - `failed`: if given, a backup with files that couldn't be written is kept
+      without them and the files are appended to `failed`, see `do_backup`. Their
+      versions of the previous backup stay in the chain
+
+    Raises:
+        KeyError if `parent` or one of its ancestors is not in the catalog
+    Returns:
+        The name of the archive zip file or `None` if the backup was unsuccesfull
+    """
+    if not isinstance(paths_to_backup, list):  # type: ignore
+        paths_to_backup = [paths_to_backup]
+    roots = catalog.roots_key(paths_to_backup)
+
+    parent_backup = catalog.get_backup(parent) if parent else catalog.latest_backup(roots)
+    if parent and parent_backup is None:
+        raise KeyError(f"Backup '{parent}' is not in the catalog")
+    if parent_backup is None:
+        log.info("No previous backup found, doing a full backup.")
+        # the full backup is added to the catalog by `do_backup`
+        return do_backup(
+            paths_to_backup,
+            target_dir,
+            excluded_paths,
+            workers,
+            policy,
+            index,
+            hash_algorithm,
+            volume_size,
+            stats,
+            failed=failed,
+        )
+
+    state = chain_files(catalog.resolve_chain(parent_backup.id))
+
+    known = {key: record for key, (_, record) in state.items()}
+    files: Iterable[FileEntry]
+    if touched is None:
+        files = backup_files(paths_to_backup, excluded_paths)
+    else:
+        files, scope = _touched_files(paths_to_backup, touched, excluded_paths)
+        # files outside of the touched paths are unchanged, not deleted
+        known = _in_scope(known, scope)
+    start = time.perf_counter()
+    changes = compute_changeset(
+        known,
+        stats.timed(WALK, files) if stats else files,
+        index,
+    )
+    if stats:
+        # includes the walk, which is recorded on its own too
+        stats.observe(CHANGESET, time.perf_counter() - start)
+    changed = [changes.entries[f] for f in changes.added + changes.modified]
+    deleted: dict[str, list[str]] = {}
+    for filename in changes.deleted:
+        root_dir, name = _split(filename)
+        deleted.setdefault(root_dir, []).append(name)
+
+    os.makedirs(target_dir, exist_ok=True)
+    meta_info = MetaInfo(
+        parent=str(parent_backup.id), deleted=deleted, roots=json.loads(roots)
+    )
+    out_path = _archive_path(target_dir, meta_info.id)
+    with zipfile.ZipFile(
+        out_path,
+        "a",
+        compression=zipfile.ZIP_DEFLATED,
+        compresslevel=9,
+    ) as archive, VolumeWriter(archive, volume_size) as volumes:
+        records = manifest.ManifestWriter()
+        failed_list = _write_files(
+            volumes,
+            changed,
+            records,
+            workers,
+            policy or compress.CompressionPolicy(),
+            index,
+            hash_algorithm,
+            stats,
+        )
+        start = time.perf_counter()
+        meta_info.write(archive, records)
+        if stats:
+            stats.observe(MANIFEST, time.perf_counter() - start)
+    if stats:
+        stats.finish()
+    if index:
+        index.flush()
+    if failed_list:
+        log.error("Backup unsuccesful!")
+        for f in failed_list:
+            log.error(f"Could not write '{f}' to zip file in'{to_zip_path(f)}'")
+        if failed is None or not (records.count or deleted):
+            if path.exists(out_path):
+                os.remove(path=out_path)
+            volumes.remove()
+            return None
+        failed.extend(failed_list)
+        log.warning(f"Keeping the backup without the {len(failed_list)} failed files")
+    catalog.record_backup(
+        out_path, roots, catalog.INCREMENTAL, parent=parent_backup.id
+    )
+    log.info(
+        f"Incremental backup with {len(changed)} changed and"
+        f" {sum(map(len, deleted.values()))} deleted files written to '{out_path}'"
+    )
+    return out_path
+
+
+def consolidate_chain(backup_id: str, target_dir: PathLike[str]) -> str:
+    """
+    Merge the chain ending in `backup_id` into a new full backup.
+
+    Members are copied from the chain's archives without recompressing them, the
+    backed up directories are not touched. Files patched by a diff backup are
+    rebuilt and stored as they are. The new archive is a single volume, even if the
+    archives of the chain were split. The new archive is added to the catalog, so
+    following incremental backups are based on it.
+    """
+    # restore imports this module
+    from raschel import restore
+
+    chain = catalog.resolve_chain(backup_id)
+
+    os.makedirs(target_dir, exist_ok=True)
+    meta_info = MetaInfo(roots=json.loads(chain[-1].roots))  # type: ignore
+    out_path = _archive_path(target_dir, meta_info.id)
+    records = manifest.ManifestWriter()
+    members = _MemberDirs()
+    with contextlib.ExitStack() as stack:
+        sources: dict[str, zipfile.ZipFile] = {}
+        archive = stack.enter_context(
+            zipfile.ZipFile(
+                out_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9
+            )
+        )
+        files = stack.enter_context(
+            contextlib.closing(restore.resolve(chain[-1].path))  # type: ignore
+        )
+        for source in files:
+            base: Optional[restore.Source] = source
+            while base is not None:
+                if base.archive not in sources:
+                    sources[base.archive] = stack.enter_context(
+                        zipfile.ZipFile(base.archive)
                     )
-                    raise ValueError
-                diff_archive.write(file_archive_path.as_posix(), changed_data)
+                base = base.base
+            root_dir, record = source.root_dir, source.record
+            # members of directories which were in different archives may collide now
+            name = (Path(members.get(root_dir)) / record["filename"]).as_posix()
+            if source.base is None:
+                compress.copy_member(
+                    sources[source.archive], archive, source.member, name
+                )
+            else:
+                with archive.open(name, "w", force_zip64=True) as out:
+                    restore.write_content(source, out, sources)
+            record = {
+                k: v
+                for k, v in record.items()
+                if k not in (VOLUME_KEY, MEMBER_DIR_KEY, "patch")
+            }
+            records.add(root_dir, members.tag(root_dir, record))
+        meta_info.write(archive, records)
+    catalog.record_backup(out_path, chain[-1].roots, catalog.FULL)  # type: ignore
+    log.info(f"Consolidated {len(chain)} backups into '{out_path}'")
     return out_path
@@ -0,0 +1,258 @@
+import datetime
+import itertools
+import json
+import logging
+import zipfile
+from os import PathLike
+from pathlib import Path
+from typing import Any, Iterable
+
+from raschel import checkpoint, manifest
+from raschel.db.db import DATABASE, Backup, File, Hash, Version, is_open
+from raschel.volumes import is_volume
+
+log = logging.getLogger(__name__)
+
+FULL = "full"
+INCREMENTAL = "incremental"
+DIFF = "diff"
+
+
+def roots_key(paths: Iterable[PathLike[str] | str]) -> str:
+    """
+    Normalized representation of a set of backed up directories, backups of the same
+    directories form a chain.
+    """
+    return json.dumps(sorted({Path(p).absolute().as_posix() for p in paths}))
+
+
+def register_backup(
+    id: Any,
+    archive_path: str,
+    roots: str,
+    kind: str,
+    parent: Any = None,
+    created: datetime.datetime | None = None,
+) -> Backup:
+    """
+    Add a backup archive to the catalog. `roots` is the value of `roots_key` for the
+    backed up directories.
+    """
+    return Backup.create(
+        id=str(id),
+        parent=str(parent) if parent else None,
+        path=archive_path,
+        kind=kind,
+        roots=roots,
+        created=created or datetime.datetime.now(),
+    )
+
+
+def get_backup(id: Any) -> Backup | None:
+    return Backup.get_or_none(Backup.id == str(id))
+
+
+def latest_backup(roots: str) -> Backup | None:
+    """
+    Returns the most recent full or incremental backup of the directories in `roots`,
+    backups which didn't complete (see `checkpoint.is_partial`) are passed over.
+    """
+    backups = (
+        Backup.select()
+        .where((Backup.roots == roots) & (Backup.kind != DIFF))
+        .order_by(Backup.created.desc())
+    )
+    return next((b for b in backups if not checkpoint.is_partial(b.path)), None)
+
+
+def resolve_chain(id: Any) -> list[Backup]:
+    """
+    Returns the backups needed to restore the backup with the given `id`, starting
+    with the full backup the chain is based on.
+
+    Raises `KeyError` if the backup or one of its parents is not in the catalog.
+    """
+    chain: list[Backup] = []
+    seen: set[str] = set()
+    next_id: str | None = str(id)
+    while next_id is not None:
+        if next_id in seen:
+            raise ValueError(f"Backup chain of '{id}' contains a cycle")
+        seen.add(next_id)
+        backup = get_backup(next_id)
+        if backup is None:
+            raise KeyError(f"Backup '{next_id}' is not in the catalog")
+        chain.append(backup)
+        next_id = backup.parent_id  # type: ignore
+    chain.reverse()
+    return chain
+
+
+BATCH_SIZE = 10_000
+"""Records per batch of `add_versions`."""
+
+
+def add_versions(backup_id: Any, records: Iterable[tuple[str, dict[str, Any]]]) -> int:
+    """
+    Add the `(root dir, record)` file records of a backup to the catalog.
+
+    Every batch is inserted into a temporary staging table with `executemany` and
+    moved into the catalog tables with three set based statements, the ids of files
+    and hashes are joined by sqlite instead of round tripping through peewee. Call
+    it inside a transaction, see `record_backup`.
+
+    Returns the number of versions added.
+    """
+    file_table = File._meta.table_name  # type: ignore
+    hash_table = Hash._meta.table_name  # type: ignore
+    version_table = Version._meta.table_name  # type: ignore
+    cursor = DATABASE.cursor()
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS staged_version"
+        " (path TEXT, hash TEXT, last_modified TEXT, patch TEXT)"
+    )
+    backup_id = str(backup_id)
+    count = 0
+    records = iter(records)
+    while batch := list(itertools.islice(records, BATCH_SIZE)):
+        cursor.execute("DELETE FROM staged_version")
+        cursor.executemany(
+            "INSERT INTO staged_version VALUES (?, ?, ?, ?)",
+            [
+                (
+                    f"{root_dir.rstrip('/')}/{record['filename']}",
+                    record["hash"],
+                    record.get("last_modified"),
+                    record.get("patch"),
+                )
+                for root_dir, record in batch
+            ],
+        )
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {file_table} (path) SELECT path FROM staged_version"
+        )
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {hash_table} (value) SELECT hash FROM staged_version"
+        )
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {version_table}"
+            " (backup_id, file_id, hash_id, last_modified, patch)"
+            " SELECT ?, f.id, h.id, s.last_modified, s.patch FROM staged_version s"
+            f" JOIN {file_table} f ON f.path = s.path"
+            f" JOIN {hash_table} h ON h.value = s.hash",
+            (backup_id,),
+        )
+        count += len(batch)
+    return count
+
+
+def record_backup(
+    archive_path: str, roots: str, kind: str, parent: Any = None
+) -> Backup | None:
+    """
+    Register the backup archive at `archive_path` together with the versions of the
+    files it contains, see `register_backup` for the parameters.
+
+    Does nothing if the database is not open, see `db.db.init_database`.
+    """
+    if not is_open():
+        log.debug(f"No catalog database, '{archive_path}' is not recorded")
+        return None
+    with zipfile.ZipFile(archive_path) as archive, manifest.read(archive) as data:
+        return _record(archive_path, data, roots, kind, parent)
+
+
+def _record(
+    archive_path: str,
+    data: manifest.Manifest,
+    roots: str,
+    kind: str,
+    parent: Any,
+    created: datetime.datetime | None = None,
+) -> Backup:
+    with DATABASE.atomic():
+        backup = register_backup(
+            data.attributes["id"], archive_path, roots, kind, parent, created
+        )
+        count = add_versions(backup.id, data)
+    log.info(f"Recorded {count} file versions of backup '{backup.id}'")
+    return backup
+
+
+def top_dirs(dirs: Iterable[str]) -> list[str]:
+    """The dirs which are not below one of the others."""
+    top: list[str] = []
+    for dir in sorted(dirs):
+        if not top or not Path(dir).is_relative_to(top[-1]):
+            top.append(dir)
+    return top
+
+
+def backfill(search_dir: PathLike[str] | str) -> int:
+    """
+    Add the backup archives below `search_dir` which are missing from the catalog,
+    reading their manifests.
+
+    Archives written before the backed up directories were stored in the manifest
+    get the topmost directories holding files as roots. Partial archives of backups
+    which can still be resumed are skipped.
+
+    Returns the number of archives added.
+    """
+    added = 0
+    for archive_path in sorted(Path(search_dir).rglob("*.zip")):
+        if is_volume(archive_path):
+            continue
+        if checkpoint.is_partial(archive_path):
+            log.debug(f"Skipping '{archive_path}': the backup didn't complete")
+            continue
+        try:
+            with zipfile.ZipFile(archive_path) as archive, manifest.read(
+                archive
+            ) as data:
+                attributes = data.attributes
+                if get_backup(attributes["id"]) is not None:
+                    continue
+                if attributes.get("diff_backup"):
+                    kind = DIFF
+                else:
+                    kind = INCREMENTAL if attributes.get("parent") else FULL
+                roots = attributes.get("backup_roots") or top_dirs(data.roots)
+                _record(
+                    Path(archive_path).absolute().as_posix(),
+                    data,
+                    json.dumps(sorted(roots)),
+                    kind,
+                    attributes.get("parent"),
+                    datetime.datetime.fromtimestamp(archive_path.stat().st_mtime),
+                )
+                added += 1
+        except (zipfile.BadZipFile, KeyError, ValueError) as e:
+            log.debug(f"Skipping '{archive_path}': {e}")
+    return added
+
+
+def _versions() -> Any:
+    return (
+        Version.select(Version, Backup, File, Hash)
+        .join(Backup)
+        .switch(Version)
+        .join(File)
+        .switch(Version)
+        .join(Hash)
+    )
+
+
+def file_history(path: PathLike[str] | str) -> list[Version]:
+    """
+    Returns the versions of the file at `path` in all cataloged backups, oldest first.
+    """
+    key = Path(path).absolute().as_posix()
+    return list(_versions().where(File.path == key).order_by(Backup.created))
+
+
+def find_hash(hash: str) -> list[Version]:
+    """
+    Returns the file versions with the content `hash`, oldest first.
+    """
+    return list(_versions().where(Hash.value == hash).order_by(Backup.created, File.path))
@@ -0,0 +1,223 @@
+"""
+Checkpoints of running backups, so a backup that failed or was killed can be
+resumed instead of started again.
+
+A checkpoint lives next to the archive as `<archive>.checkpoint`, one json object
+per line. The first line holds the attributes of the backup, every following line a
+file that is completely written: its root dir, its record and where its member is
+stored. Lines are written in batches, and only after the archive data they refer
+to is on disk, so everything a checkpoint lists can be trusted after a crash.
+"""
+
+import json
+import logging
+import os
+import struct
+import time
+import zipfile
+from os import PathLike
+from pathlib import Path
+from typing import IO, Any, Callable
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+SUFFIX = ".checkpoint"
+CHECKPOINT_FILES = 1000
+"""Written files after which a checkpoint is taken."""
+CHECKPOINT_SECONDS = 30.0
+"""Seconds after which a checkpoint is taken if a file was written since the last."""
+
+
+def checkpoint_path(archive_path: PathLike[str] | str) -> str:
+    return f"{Path(archive_path).as_posix()}{SUFFIX}"
+
+
+def is_partial(archive_path: PathLike[str] | str) -> bool:
+    """Whether `archive_path` is a backup that didn't complete yet, see `load`."""
+    return Path(checkpoint_path(archive_path)).exists()
+
+
+def member_info(zinfo: zipfile.ZipInfo, volume: int) -> dict[str, Any]:
+    """Everything needed to rebuild the central directory entry of `zinfo`."""
+    return {
+        "name": zinfo.filename,
+        "volume": volume,
+        "offset": zinfo.header_offset,
+        "crc": zinfo.CRC,
+        "compress_size": zinfo.compress_size,
+        "file_size": zinfo.file_size,
+        "compress_type": zinfo.compress_type,
+        "date_time": list(zinfo.date_time),
+        "external_attr": zinfo.external_attr,
+    }
+
+
+class Checkpoint:
+    """Appends written files to the checkpoint of a backup."""
+
+    def __init__(
+        self,
+        archive_path: PathLike[str] | str,
+        attributes: dict[str, Any],
+        sync: Callable[[], None],
+        every_files: int = CHECKPOINT_FILES,
+        every_seconds: float = CHECKPOINT_SECONDS,
+    ) -> None:
+        """
+        Start the checkpoint of the backup `archive_path` or continue an existing
+        one. `sync` has to flush the open archives to disk, it is called before
+        every batch of lines is written.
+        """
+        self.path = checkpoint_path(archive_path)
+        self.sync = sync
+        self.every_files = every_files
+        self.every_seconds = every_seconds
+        self._pending: list[str] = []
+        self._last = time.monotonic()
+        exists = Path(self.path).exists()
+        self._file: IO[str] = open(self.path, "a", encoding="utf-8")
+        if not exists:
+            self._write([json.dumps({"version": VERSION, **attributes})])
+
+    def add(
+        self,
+        root_dir: str,
+        record: dict[str, Any],
+        zinfo: zipfile.ZipInfo,
+        volume: int,
+    ) -> None:
+        member = member_info(zinfo, volume)
+        line = json.dumps({"root_dir": root_dir, "record": record, "member": member})
+        self._pending.append(line)
+        if (
+            len(self._pending) >= self.every_files
+            or time.monotonic() - self._last >= self.every_seconds
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        self.sync()
+        self._write(self._pending)
+        log.debug(f"Checkpoint of {len(self._pending)} files written to '{self.path}'")
+        self._pending = []
+        self._last = time.monotonic()
+
+    def _write(self, lines: list[str]) -> None:
+        self._file.write("".join(f"{line}\n" for line in lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+    def remove(self) -> None:
+        """Drop the checkpoint, once the backup is complete."""
+        self._pending = []
+        self._file.close()
+        Path(self.path).unlink(missing_ok=True)
+
+
+def load(
+    archive_path: PathLike[str] | str,
+) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    """
+    Read the checkpoint of the backup `archive_path`.
+
+    Returns the attributes of the backup and the written files, a line cut off by a
+    crash is ignored. Raises `FileNotFoundError` if there is no checkpoint and
+    `ValueError` if it can't be read.
+    """
+    with open(checkpoint_path(archive_path), encoding="utf-8") as file:
+        *lines, tail = file.read().split("\n")
+    try:
+        attributes, *entries = [json.loads(line) for line in lines]
+    except (json.JSONDecodeError, ValueError) as e:
+        raise ValueError(f"Unreadable checkpoint of '{archive_path}': {e}")
+    if attributes.pop("version", None) != VERSION:
+        raise ValueError(f"Unsupported checkpoint version of '{archive_path}'")
+    if tail:
+        # the batch being written when the backup was killed
+        log.warning(f"Ignoring the incomplete last line of '{archive_path}{SUFFIX}'")
+    return attributes, entries
+
+
+def _check_member(file: IO[bytes], member: dict[str, Any]) -> int:
+    """
+    Compare the local header of `member` with the checkpoint, returns the offset
+    of the end of its data.
+    """
+    file.seek(member["offset"])
+    header = file.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader:
+        raise ValueError(f"'{member['name']}' is cut off")
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    if fields[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:  # type: ignore
+        raise ValueError(f"Bad local file header for '{member['name']}'")
+    name_length = fields[zipfile._FH_FILENAME_LENGTH]  # type: ignore
+    extra_length = fields[zipfile._FH_EXTRA_FIELD_LENGTH]  # type: ignore
+    name = file.read(name_length)
+    flags = fields[zipfile._FH_GENERAL_PURPOSE_FLAG_BITS]  # type: ignore
+    name = name.decode("utf-8" if flags & 0x800 else "cp437")
+    if (
+        name != member["name"]
+        or fields[zipfile._FH_COMPRESSION_METHOD] != member["compress_type"]  # type: ignore
+        or fields[zipfile._FH_CRC] != member["crc"]  # type: ignore
+    ):
+        raise ValueError(f"Local file header of '{member['name']}' doesn't match")
+    end = (
+        member["offset"]
+        + zipfile.sizeFileHeader
+        + name_length
+        + extra_length
+        + member["compress_size"]
+    )
+    if file.seek(0, os.SEEK_END) < end:
+        raise ValueError(f"'{member['name']}' is cut off")
+    return end
+
+
+def reopen(
+    archive_path: PathLike[str] | str, members: list[dict[str, Any]]
+) -> zipfile.ZipFile:
+    """
+    Reopen the partial archive `archive_path` for appending, keeping the `members`
+    of the checkpoint and cutting off everything written after them.
+
+    The local header of every member is checked against the checkpoint, raises
+    `ValueError` if one doesn't match.
+    """
+    end = 0
+    with open(archive_path, "r+b") as file:
+        for member in members:
+            end = max(end, _check_member(file, member))
+        file.truncate(end)
+
+    archive = zipfile.ZipFile(
+        archive_path, "a", compression=zipfile.ZIP_DEFLATED, compresslevel=9
+    )
+    try:
+        # the central directory is rebuilt from the checkpoint
+        archive.filelist = []
+        archive.NameToInfo = {}
+        for member in members:
+            zinfo = zipfile.ZipInfo(member["name"], tuple(member["date_time"]))  # type: ignore
+            zinfo.header_offset = member["offset"]
+            zinfo.CRC = member["crc"]
+            zinfo.compress_size = member["compress_size"]
+            zinfo.file_size = member["file_size"]
+            zinfo.compress_type = member["compress_type"]
+            zinfo.external_attr = member["external_attr"]
+            archive.filelist.append(zinfo)
+            archive.NameToInfo[zinfo.filename] = zinfo
+        archive.start_dir = end  # type: ignore
+        archive.fp.seek(end)  # type: ignore
+        archive._didModify = True  # type: ignore
+    except BaseException:
+        archive.close()
+        raise
+    return archive
+
@@ -0,0 +1,330 @@
+import collections
+import io
+import math
+import mimetypes
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Callable, Iterable, Iterator, TypeVar
+
+from raschel import file_util
+from raschel.config import Config
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BUFFER_SIZE = 1024 * 1024
+"""Chunk size used when reading the source files."""
+SPOOL_SIZE = 8 * 1024 * 1024
+"""Compressed entries larger than this are spilled from memory to a temporary file."""
+
+STORED = "stored"
+FAST = "fast"
+MAX = "max"
+METHODS: dict[str, tuple[int, int | None]] = {
+    STORED: (zipfile.ZIP_STORED, None),
+    FAST: (zipfile.ZIP_DEFLATED, 1),
+    MAX: (zipfile.ZIP_DEFLATED, 9),
+}
+"""Compression methods a policy can choose from, as `(compress_type, compresslevel)`."""
+
+DEFAULT_STORED_EXTENSIONS = [
+    # archives and compressed streams
+    ".7z", ".bz2", ".gz", ".jar", ".lz4", ".rar", ".tgz", ".xz", ".zip", ".zst",
+    # images
+    ".avif", ".gif", ".heic", ".jpeg", ".jpg", ".png", ".webp",
+    # audio and video
+    ".aac", ".flac", ".m4a", ".mkv", ".mov", ".mp3", ".mp4", ".ogg", ".opus", ".webm",
+    # documents which are zip containers
+    ".docx", ".epub", ".odt", ".pptx", ".xlsx",
+]  # fmt: skip
+DEFAULT_STORED_MIME_PREFIXES = ["audio/", "video/", "image/jpeg", "image/png"]
+
+
+class CompressionPolicy:
+    """
+    Chooses a compression method (`STORED`, `FAST` or `MAX`) per file.
+
+    The decision is made from the file extension or its guessed MIME type first and
+    falls back to the Shannon entropy of a small sample from the start of the file:
+    random looking data is stored, medium entropy data is compressed quickly and
+    everything else gets the maximum compression level.
+    """
+
+    def __init__(
+        self,
+        stored_extensions: list[str] | None = None,
+        fast_extensions: list[str] | None = None,
+        stored_mime_prefixes: list[str] | None = None,
+        stored_entropy: float = 7.5,
+        fast_entropy: float = 6.5,
+        sample_size: int = 4096,
+        default: str = MAX,
+    ) -> None:
+        """
+        Parameters:
+        - `stored_extensions`, `fast_extensions`: file extensions (including the dot) which are always stored or fast compressed
+        - `stored_mime_prefixes`: guessed MIME types starting with one of these are stored
+        - `stored_entropy`, `fast_entropy`: entropy thresholds in bits per byte for the sample
+        - `sample_size`: number of bytes from the start of the file used to estimate the entropy
+        - `default`: the method for files no other rule applies to
+
+        Raises `ValueError` if `default` is not a known method.
+        """
+        if default not in METHODS:
+            raise ValueError(f"Unknown compression method '{default}'")
+        if stored_extensions is None:
+            stored_extensions = DEFAULT_STORED_EXTENSIONS
+        if stored_mime_prefixes is None:
+            stored_mime_prefixes = DEFAULT_STORED_MIME_PREFIXES
+        self.stored_extensions = {e.lower() for e in stored_extensions}
+        self.fast_extensions = {e.lower() for e in fast_extensions or []}
+        self.stored_mime_prefixes = tuple(stored_mime_prefixes)
+        self.stored_entropy = stored_entropy
+        self.fast_entropy = fast_entropy
+        self.sample_size = sample_size
+        self.default = default
+
+    @classmethod
+    def from_config(cls, config: Config | None) -> "CompressionPolicy":
+        """
+        Build the policy from the `compression` section of `config`, missing keys keep their defaults.
+        """
+        return cls(**(getattr(config, "compression", None) or {}))
+
+    def choose(self, filename: str, sample: bytes = b"") -> str:
+        suffix = Path(filename).suffix.lower()
+        if suffix in self.stored_extensions:
+            return STORED
+        if suffix in self.fast_extensions:
+            return FAST
+        mime, encoding = mimetypes.guess_type(filename, strict=False)
+        if encoding or (mime and mime.startswith(self.stored_mime_prefixes)):
+            return STORED
+        # very small samples can't reach a high entropy, don't judge them
+        if len(sample) >= 512:
+            entropy = sample_entropy(sample)
+            if entropy >= self.stored_entropy:
+                return STORED
+            if entropy >= self.fast_entropy:
+                return FAST
+        return self.default
+
+
+def sample_entropy(sample: bytes) -> float:
+    """Shannon entropy of `sample` in bits per byte."""
+    if not sample:
+        return 0.0
+    n = len(sample)
+    return -sum(c / n * math.log2(c / n) for c in collections.Counter(sample).values())
+
+
+def open_source(
+    filename: str, policy: CompressionPolicy
+) -> tuple[io.BufferedReader, str]:
+    """
+    Open `filename` for reading and choose its compression method.
+
+    The entropy sample is peeked from the read buffer, so it doesn't cost an extra read.
+    """
+    src = open(filename, "rb", buffering=max(BUFFER_SIZE, policy.sample_size))
+    try:
+        sample = src.peek(policy.sample_size)[: policy.sample_size]
+        method = policy.choose(filename, sample)
+    except BaseException:
+        src.close()
+        raise
+    return src, method
+
+
+@dataclass
+class CompressedEntry:
+    """
+    A zip member that has been compressed outside of the archive.
+
+    `zinfo` already carries the final CRC and sizes, `data` holds the raw compressed
+    stream positioned at the start and `stat` is the state of the file before it was read.
+    """
+
+    zinfo: zipfile.ZipInfo
+    data: IO[bytes]
+    hash: str
+    method: str
+    stat: os.stat_result
+    algorithm: str = file_util.DEFAULT_HASH
+
+    def close(self) -> None:
+        self.data.close()
+
+
+def _get_compressor(compress_type: int, compresslevel: int | None) -> Any:
+    if compress_type == zipfile.ZIP_STORED:
+        return None
+    if compress_type == zipfile.ZIP_DEFLATED:
+        if compresslevel is None:
+            compresslevel = zlib.Z_DEFAULT_COMPRESSION
+        return zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    raise NotImplementedError(f"Compression type {compress_type} is not supported")
+
+
+def compress_chunks(
+    zinfo: zipfile.ZipInfo,
+    chunks: Iterable[bytes],
+    method: str,
+    st: os.stat_result,
+    algorithm: str = file_util.DEFAULT_HASH,
+) -> CompressedEntry:
+    """
+    Compress the contents of a file given as `chunks` with `method` and hash them
+    with `algorithm`, see `file_util.new_hasher`. `st` is the state of the file
+    before it was read. The chunks may be views of a reused buffer, they are consumed
+    before the next one is taken.
+    """
+    hash = file_util.new_hasher(algorithm)
+    crc = 0
+    file_size = 0
+    compress_size = 0
+    data = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        zinfo.compress_type, compresslevel = METHODS[method]
+        compressor = _get_compressor(zinfo.compress_type, compresslevel)
+        for chunk in chunks:
+            hash.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            compress_size += len(chunk)
+            data.write(chunk)
+        if compressor:
+            chunk = compressor.flush()
+            compress_size += len(chunk)
+            data.write(chunk)
+    except BaseException:
+        data.close()
+        raise
+    data.seek(0)
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = compress_size
+    return CompressedEntry(zinfo, data, hash.hexdigest(), method, st, algorithm)  # type: ignore
+
+
+def write_compressed(
+    archive: zipfile.ZipFile,
+    zinfo: zipfile.ZipInfo,
+    data: IO[bytes],
+    length: int | None = None,
+) -> None:
+    """
+    Append a pre-compressed member to `archive`, `zinfo` has to carry the final CRC
+    and sizes. Copies `length` bytes of `data` or everything up to its end.
+
+    Mirrors what `ZipFile.open(zinfo, "w")` does on close, but copies the compressed
+    stream verbatim instead of compressing it again.
+    """
+    if archive._writing:  # type: ignore
+        raise ValueError("Can't write to the ZIP file while another write handle is open")
+    zinfo.flag_bits = 0x00
+    if not zinfo.external_attr:
+        zinfo.external_attr = 0o600 << 16
+    fp = archive.fp
+    fp.seek(archive.start_dir)  # type: ignore
+    zinfo.header_offset = fp.tell()  # type: ignore
+    archive._writecheck(zinfo)  # type: ignore
+    archive._didModify = True  # type: ignore
+    fp.write(zinfo.FileHeader())  # type: ignore
+    if length is None:
+        shutil.copyfileobj(data, fp, BUFFER_SIZE)  # type: ignore
+    else:
+        while length > 0:
+            chunk = data.read(min(length, BUFFER_SIZE))
+            if not chunk:
+                raise EOFError(f"Compressed data of '{zinfo.filename}' is truncated")
+            fp.write(chunk)  # type: ignore
+            length -= len(chunk)
+    archive.start_dir = fp.tell()  # type: ignore
+    archive.filelist.append(zinfo)
+    archive.NameToInfo[zinfo.filename] = zinfo
+
+
+def discard_last(archive: zipfile.ZipFile, zinfo: zipfile.ZipInfo) -> None:
+    """
+    Remove `zinfo`, the member written last, from `archive` which is open for
+    writing. Its data is cut off, the next member is written in its place.
+    """
+    last = archive.filelist[-1] if archive.filelist else None
+    if archive._writing or last is not zinfo:  # type: ignore
+        raise ValueError(f"'{zinfo.filename}' is not the last member of the archive")
+    archive.filelist.pop()
+    del archive.NameToInfo[zinfo.filename]
+    archive.start_dir = zinfo.header_offset  # type: ignore
+    archive.fp.seek(zinfo.header_offset)  # type: ignore
+    archive.fp.truncate()  # type: ignore
+
+
+def open_raw(archive: zipfile.ZipFile, zinfo: zipfile.ZipInfo) -> IO[bytes]:
+    """
+    Open the archive file positioned at the start of the compressed data of `zinfo`.
+    """
+    fp = open(archive.filename, "rb")  # type: ignore
+    try:
+        fp.seek(zinfo.header_offset)
+        header = fp.read(zipfile.sizeFileHeader)
+        fields = struct.unpack(zipfile.structFileHeader, header)
+        if fields[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:  # type: ignore
+            raise zipfile.BadZipFile(f"Bad local file header for '{zinfo.filename}'")
+        fp.seek(
+            fields[zipfile._FH_FILENAME_LENGTH]  # type: ignore
+            + fields[zipfile._FH_EXTRA_FIELD_LENGTH],  # type: ignore
+            io.SEEK_CUR,
+        )
+    except BaseException:
+        fp.close()
+        raise
+    return fp
+
+
+def copy_member(
+    src: zipfile.ZipFile, dst: zipfile.ZipFile, name: str, arcname: str | None = None
+) -> None:
+    """
+    Copy the member `name` from `src` to `dst` without decompressing it, as `arcname`
+    if given.
+    """
+    info = src.getinfo(name)
+    zinfo = zipfile.ZipInfo(arcname or info.filename, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.CRC = info.CRC
+    zinfo.file_size = info.file_size
+    zinfo.compress_size = info.compress_size
+    zinfo.external_attr = info.external_attr
+    zinfo.create_system = info.create_system
+    with open_raw(src, info) as raw:
+        write_compressed(dst, zinfo, raw, info.compress_size)
+
+
+def imap_ordered(
+    executor: Executor,
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    window: int,
+) -> Iterator[tuple[T, "Future[R]"]]:
+    """
+    Like `Executor.map`, but keeps at most `window` calls in flight and yields the
+    finished futures in submission order, so that the caller decides how to handle
+    a failing item.
+    """
+    pending: collections.deque[tuple[T, Future[R]]] = collections.deque()
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
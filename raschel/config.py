@@ -2,6 +2,9 @@ import jsonpickle as json  # type: ignore
 from os import PathLike, path
 import datetime
 import logging
+from typing import Any
+
+from raschel.file_util import DEFAULT_HASH
 
 
 json.register(list, json.handlers.ArrayHandler)  # type: ignore
@@ -24,9 +27,13 @@ class Config:
     - `vault_path (PathLike[str] | None)`: Optional path to the configuration vault.
     - `backup_from_patterns (list[str] | None)`: Optional list of glob patterns for files and directories to be backed up.
     - `last_backup (datetime.datetime | str | None)`: Optional timestamp or string representation of a timestamp for the last successful backup.
+    - `compression (dict[str, Any] | None)`: Optional settings for the per-file compression policy, see `compress.CompressionPolicy`.
+    - `pipeline (dict[str, int] | None)`: Optional concurrency per stage of parallel backups, see `pipeline.PipelineSettings`.
+    - `hash_algorithm (str)`: Algorithm of the file hashes of new backups, see `file_util.hashers`. Defaults to `sha256`.
+    - `watch (dict[str, Any] | None)`: Optional settings of the watch mode, see `watch.WatchSettings`.
 
     Methods:
-    - `__init__(self, vault_path: PathLike[str] | None = None, backup_from_patterns: (list[str] | None) = None, last_backup: datetime.datetime | str | None = None) -> None:` Initializes a Config object with the given attributes.
+    - `__init__(self, vault_path: PathLike[str] | None = None, backup_from_patterns: (list[str] | None) = None, last_backup: datetime.datetime | str | None = None, compression: dict[str, Any] | None = None, pipeline: dict[str, int] | None = None, hash_algorithm: str | None = None, watch: dict[str, Any] | None = None) -> None:` Initializes a Config object with the given attributes.
     - `__setstate__(self, state: dict):` Updates the state of the Config object.
 
     """
@@ -38,12 +45,20 @@ class Config:
             list[str] | None
         ) = None,  # glob patterns for files and dirs
         last_backup: datetime.datetime | str | None = None,
+        compression: dict[str, Any] | None = None,
+        pipeline: dict[str, int] | None = None,
+        hash_algorithm: str | None = None,
+        watch: dict[str, Any] | None = None,
     ) -> None:
         """
         Parameters:
         - `vault_path`: Optional path to the configuration vault (`str` or `PathLike[str]`)
         - `backup_from_patterns`: Optional list of glob patterns for files and directories to be backed up (`list[str]` or `None`)
         - `last_backup`: Optional timestamp or string representation of a timestamp for the last successful backup (`datetime.datetime`, `str`, or `None`)
+        - `compression`: Optional keyword arguments for `compress.CompressionPolicy`, e.g. `{"stored_extensions": [".iso"], "default": "fast"}` (`dict` or `None`)
+        - `pipeline`: Optional fields of `pipeline.PipelineSettings`, e.g. `{"read_workers": 2, "compress_workers": 8}`, they override `--jobs` (`dict` or `None`)
+        - `hash_algorithm`: Optional name of the algorithm hashing the files of this vault, e.g. `"blake2b"` (`str` or `None`)
+        - `watch`: Optional fields of `watch.WatchSettings`, e.g. `{"interval": 300, "debounce": 5}` (`dict` or `None`)
 
         Raises `FileNotFoundError` if vault_path does not exist.
         Sets default values for `last_backup` and initializes `self.__dict__` from state dictionary during unpickling.
@@ -54,6 +69,7 @@ class Config:
             raise FileNotFoundError
 
         self.vault_path = vault_path  # TODO check wether the paths exist
+        self.backup_from_patterns = backup_from_patterns or []
 
         if isinstance(last_backup, datetime.datetime):
             self.last_backup = last_backup
@@ -62,10 +78,20 @@ class Config:
         else:
             self.last_backup = datetime.datetime.now()
 
+        self.compression = compression or {}
+        self.pipeline = pipeline or {}
+        self.hash_algorithm = hash_algorithm or DEFAULT_HASH
+        self.watch = watch or {}
+
     def __setstate__(self, state: dict):  # type: ignore
         state.setdefault("vault_path")  # type: ignore
         state.setdefault("last_backup")  # type: ignore
         state.setdefault("backup_from_dirs")  # type: ignore
+        state.setdefault("backup_from_patterns", [])  # type: ignore
+        state.setdefault("compression", {})  # type: ignore
+        state.setdefault("pipeline", {})  # type: ignore
+        state.setdefault("hash_algorithm", DEFAULT_HASH)  # type: ignore
+        state.setdefault("watch", {})  # type: ignore
         self.__dict__.update(state)  # type: ignore
 
 
@@ -1,7 +1,20 @@
+import datetime
+import os
+from os import PathLike, path
+
 import peewee as pw
+from playhouse.migrate import SqliteMigrator, migrate
 
 DB_URL = "backup.db"
-DATABASE = pw.SqliteDatabase(DB_URL)
+PRAGMAS = {
+    # readers don't block the writer and commits only append to the log
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64 * 1024,  # KiB
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+}
+DATABASE = pw.SqliteDatabase(DB_URL, pragmas=PRAGMAS)
 
 
 class BaseModel(pw.Model):
@@ -9,9 +22,113 @@ class BaseModel(pw.Model):
         database = DATABASE
 
 class Store(BaseModel):
-    _id = pw.PrimaryKeyField()
+    _id = pw.AutoField()
     # file_filters = pw.
-    root_path = pw.TextField(null=False, unique=True, ),
+    root_path = pw.TextField(null=False, unique=True, )
+
+
+class FileState(BaseModel):
+    """
+    Last known state of a file on disk, used to skip hashing files that did not change.
+    """
+
+    path = pw.TextField(primary_key=True)
+    size = pw.BigIntegerField()
+    mtime_ns = pw.BigIntegerField()
+    inode = pw.BigIntegerField()
+    hash = pw.CharField(max_length=128)
+    algorithm = pw.CharField(max_length=16, default="sha256")
+
+
+class Backup(BaseModel):
+    """
+    A backup archive, incremental backups point to the backup they are based on.
+    """
+
+    id = pw.CharField(primary_key=True, max_length=36)
+    parent = pw.ForeignKeyField("self", null=True, backref="children")
+    path = pw.TextField()
+    kind = pw.CharField(max_length=16)
+    roots = pw.TextField()  # json list of the backed up directories
+    created = pw.DateTimeField(default=datetime.datetime.now, index=True)
+
+
+class File(BaseModel):
+    """
+    A backed up file, by absolute path.
+    """
+
+    path = pw.TextField(unique=True)
+
+
+class Hash(BaseModel):
+    """
+    A file content hash, versions with the same content share it.
+    """
+
+    value = pw.CharField(max_length=128, unique=True)
+
+
+class Version(BaseModel):
+    """
+    The version of a file contained in a backup.
+    """
+
+    backup = pw.ForeignKeyField(Backup, backref="versions", on_delete="CASCADE")
+    # the unique (file, backup) index serves lookups by file
+    file = pw.ForeignKeyField(File, backref="versions", index=False)
+    hash = pw.ForeignKeyField(Hash, backref="versions", index=True)
+    last_modified = pw.CharField(max_length=32, null=True)
+    patch = pw.CharField(max_length=16, null=True)
+
+    class Meta:  # type: ignore
+        indexes = ((("file", "backup"), True),)
+
+
+MODELS: list[type[BaseModel]] = [Store, FileState, Backup, File, Hash, Version]
+
+
+def database_path(target_dir: PathLike[str] | str) -> str:
+    """
+    Default database of the backups stored in `target_dir`. It is kept next to them,
+    so every run backing up to `target_dir` uses the same catalog and file index,
+    whatever its working directory.
+    """
+    return path.join(target_dir, DB_URL)
+
+
+def init_database(db_path: PathLike[str] | str = DB_URL) -> pw.SqliteDatabase:
+    """
+    Point `DATABASE` to `db_path` and create the missing tables and columns. The
+    directory of `db_path` is created if needed.
+    """
+    os.makedirs(path.dirname(path.abspath(db_path)), exist_ok=True)
+    if not DATABASE.is_closed():
+        DATABASE.close()
+    DATABASE.init(str(db_path), pragmas=PRAGMAS)
+    DATABASE.create_tables(MODELS, safe=True)
+    _add_columns()
+    return DATABASE
+
 
+def _add_columns() -> None:
+    """Add the columns of fields that were added to a model after its table was created."""
+    migrator = SqliteMigrator(DATABASE)
+    operations = []
+    for model in MODELS:
+        table = model._meta.table_name  # type: ignore
+        existing = {column.name for column in DATABASE.get_columns(table)}
+        for field in model._meta.sorted_fields:  # type: ignore
+            if field.column_name not in existing:
+                operations.append(migrator.add_column(table, field.column_name, field))
+    if operations:
+        with DATABASE.atomic():
+            migrate(*operations)
 
 
+def is_open() -> bool:
+    """
+    Whether the database is in use, that is `init_database` was called and the
+    connection was not closed since.
+    """
+    return not DATABASE.is_closed()
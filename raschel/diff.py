@@ -1,7 +1,14 @@
+import hashlib
+import math
+from dataclasses import dataclass, field
+from itertools import accumulate, compress, repeat
+from operator import lshift, or_, sub
 from os import PathLike
-from typing import Iterator
+from typing import IO, Any, Iterator, Optional
 from diff_match_patch import diff_match_patch  # type: ignore
 
+from raschel import fileio
+
 
 def _do_diff(f1: str, f2: str) -> Iterator[str] | None:
     dmp = diff_match_patch()
@@ -12,23 +19,33 @@ def _do_diff(f1: str, f2: str) -> Iterator[str] | None:
 def diff_text_file(
     file_path1: PathLike[str], file_path2: PathLike[str]
 ) -> Iterator[str] | None:
-    with open(file_path1, "r") as file1:
-        with open(file_path2, "r") as file2:
-            file1_gen = file1.read()  # _read_in_chunks(file1, 4096)
-            file2_gen = file2.read()  # _read_in_chunks(file2, 4096)
-            return _do_diff(file1_gen, file2_gen)
-            # return _do_diff(file2_gen, file1_gen)
+    return _do_diff(fileio.read_text(file_path1), fileio.read_text(file_path2))
 
 
 def diff_text1(
-    file_path1: PathLike[str], bytes: bytearray | bytes
+    file_path1: PathLike[str] | str, bytes: bytearray | bytes
 ) -> Iterator[str] | None:
     """
     compare with the second file loaded in memory
+
+    Both sides are decoded as utf-8 with their line endings kept, so the patch
+    applies to the archived bytes and restores the file exactly.
+    """
+    return _do_diff(fileio.read_text(file_path1), str(bytes, "utf-8"))
+
+
+def apply_patch_text(text: str, patch_text: str) -> str:
+    """
+    Apply a patch created by `diff_text1` or `diff_text_file` to `text`.
+
+    Raises `ValueError` if one of the hunks could not be applied.
     """
-    with open(file_path1, "r") as file1:
-        file1_gen = file1.read()  # _read_in_chunks(file1, 4096)
-        return _do_diff(file1_gen, bytes.decode())
+    dmp = diff_match_patch()
+    patches = dmp.patch_fromText(patch_text)  # type: ignore
+    patched, results = dmp.patch_apply(patches, text)  # type: ignore
+    if not all(results):
+        raise ValueError("Patch does not apply")
+    return patched  # type: ignore
 
 
 def apply_patch(
@@ -44,3 +61,248 @@ def apply_patch(
             patch_text, _ = dmp.patch_apply(patches, text)  # type: ignore
             file.seek(0)
             file.write(patch_text)  # type: ignore
+
+
+# Binary deltas
+#
+# rsync style: the base version is cut into fixed size blocks, each described by a
+# weak checksum and a strong hash. The new version is scanned with a sliding window,
+# windows matching a block of the base become copy instructions and everything else
+# is sent as literal bytes. Both versions are streamed, only the block signatures and
+# one chunk of the new version are held in memory.
+#
+# The weak checksum of a window is the byte sum of its two halves, so the checksums
+# of all windows of a chunk are differences of its prefix sums, computed with
+# `itertools` instead of rolling byte by byte in Python. Once a literal run is a few
+# blocks long, only every `_STRIDE`th window is checked. The stride is coprime to the
+# block size, so a run of at least `_STRIDE` matching blocks is still found, the
+# blocks skipped at its start are matched backwards.
+
+DELTA_MAGIC = b"RSDL\x01"
+_OP_COPY = b"C"
+_OP_LITERAL = b"L"
+_OP_END = b"E"
+_READ_SIZE = 1024 * 1024
+_CHUNK_SIZE = 256 * 1024
+_STRIDE = 11
+"""Block sizes divisible by it use `_STRIDE + 2`, both are prime."""
+_STRIDE_AFTER = 8
+"""Blocks of literal after which the scan switches to `_STRIDE`."""
+
+
+def delta_block_size(size: int) -> int:
+    """Block size for a base version of `size` bytes, roughly its square root."""
+    return min(64 * 1024, max(2048, (math.isqrt(size) // 1024) * 1024))
+
+
+def _weak_checksum(block: bytes | bytearray | memoryview) -> int:
+    half = len(block) // 2
+    return sum(block[:half]) | sum(block[half:]) << 24
+
+
+def _strong_hash(block: bytes | bytearray | memoryview) -> bytes:
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+@dataclass
+class Signature:
+    block_size: int
+    blocks: dict[int, dict[bytes, int]]
+    """Block index by strong hash by weak checksum."""
+    hashes: list[bytes] = field(default_factory=list)
+    """Strong hash by block index."""
+
+
+def delta_signature(base: IO[bytes], block_size: int) -> Signature:
+    """Read `base` once and compute the signature of its full blocks."""
+    signature = Signature(block_size, {})
+    index = 0
+    while len(block := base.read(block_size)) == block_size:
+        strong = _strong_hash(block)
+        signature.blocks.setdefault(_weak_checksum(block), {}).setdefault(strong, index)
+        signature.hashes.append(strong)
+        index += 1
+    return signature
+
+
+def _varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _read_varint(src: IO[bytes]) -> int:
+    value = 0
+    shift = 0
+    while True:
+        byte = src.read(1)
+        if not byte:
+            raise ValueError("Truncated delta")
+        value |= (byte[0] & 0x7F) << shift
+        if not byte[0] & 0x80:
+            return value
+        shift += 7
+
+
+def _candidates(
+    sums: list[int], blocks: dict[int, Any], start: int, stop: int, step: int, size: int
+) -> Iterator[int]:
+    """
+    Start of the windows in `range(start, stop, step)` whose weak checksum is in
+    `blocks`, `sums` are the prefix sums of the chunk.
+    """
+    half = size // 2
+    at = sums.__getitem__
+    starts = range(start, stop, step)
+    middles = range(start + half, stop + half, step)
+    first, middle, middle2 = map(at, starts), map(at, middles), map(at, middles)
+    last = map(at, range(start + size, stop + size, step))
+    checksums = map(
+        or_, map(sub, middle, first), map(lshift, map(sub, last, middle2), repeat(24))
+    )
+    return compress(starts, map(blocks.__contains__, checksums))
+
+
+def make_delta(signature: Signature, new: IO[bytes], out: IO[bytes]) -> None:
+    """Write the delta turning the base of `signature` into the content of `new`."""
+    size = signature.block_size
+    blocks = signature.blocks
+    hashes = signature.hashes
+    # opcodes are collected and written together with the next literal
+    ops = bytearray(DELTA_MAGIC + _varint(size))
+    copy: list[int] = []  # pending copy instruction as [first block, count]
+
+    def _flush_copy() -> None:
+        if copy:
+            ops.extend(_OP_COPY + _varint(copy[0]) + _varint(copy[1]))
+            copy.clear()
+
+    def _copy(index: int) -> None:
+        if copy and copy[0] + copy[1] == index:
+            copy[1] += 1
+        else:
+            _flush_copy()
+            copy.extend((index, 1))
+
+    def _literal(data: memoryview) -> None:
+        if data:
+            _flush_copy()
+            ops.extend(_OP_LITERAL + _varint(len(data)))
+            out.write(ops)
+            ops.clear()
+            out.write(data)
+
+    buf = memoryview(b"")
+    sums: Optional[list[int]] = None  # prefix sums of the chunk, computed when needed
+    half = size // 2
+
+    def _sums() -> list[int]:
+        nonlocal sums
+        if sums is None:
+            sums = list(accumulate(buf, initial=0))
+        return sums
+
+    def _checksum(j: int) -> int:
+        p = _sums()
+        return p[j + half] - p[j] | p[j + size] - p[j + half] << 24
+
+    def _match(j: int) -> Optional[int]:
+        if (strong := blocks.get(_checksum(j))) is None:
+            return None
+        return strong.get(_strong_hash(buf[j : j + size]))
+
+    eof = False
+    i = 0  # start of the window
+    lit = 0  # start of the pending literal
+    run = 0  # literal bytes of the current run emitted with earlier chunks
+    stride = _STRIDE if size % _STRIDE else _STRIDE + 2
+    while True:
+        if len(buf) - i < size and not eof:
+            # emit the pending literal and continue with the next chunk
+            _literal(buf[lit:i])
+            run += i - lit
+            data = new.read(max(_CHUNK_SIZE, 2 * size))
+            eof = not data
+            buf = memoryview(bytes(buf[i:]) + data)
+            sums = None
+            i = lit = 0
+            continue
+        last = len(buf) - size  # start of the last full window
+        if i > last:
+            break
+        # unchanged regions continue the pending copy, checked without the checksum
+        following = copy[0] + copy[1] if copy else len(hashes)
+        if (
+            following < len(hashes)
+            and _strong_hash(buf[i : i + size]) == hashes[following]
+        ):
+            index: Optional[int] = following
+        elif (index := _match(i)) is None:
+            # search the next match, with the stride once the literal is long enough
+            strided = run + i - lit >= _STRIDE_AFTER * size
+            stop = last + 1
+            if not strided:
+                stop = min(stop, lit + _STRIDE_AFTER * size - run)
+            step = stride if strided else 1
+            for i in _candidates(_sums(), blocks, i + 1, stop, step, size):
+                if (index := _match(i)) is not None:
+                    break
+            else:
+                i = stop
+                continue
+            # the run of matching blocks may have started before the window found
+            while (
+                strided
+                and index
+                and i - size >= lit
+                and _strong_hash(buf[i - size : i]) == hashes[index - 1]
+            ):
+                i -= size
+                index -= 1
+        _literal(buf[lit:i])
+        _copy(index)
+        i += size
+        lit = i
+        run = 0
+    _literal(buf[lit:])
+    _flush_copy()
+    out.write(ops + _OP_END)
+
+
+def apply_delta(base: IO[bytes], delta: IO[bytes], out: IO[bytes]) -> None:
+    """
+    Rebuild the new version from a seekable `base` and a delta created by `make_delta`.
+    """
+    if delta.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+        raise ValueError("Not a delta")
+    size = _read_varint(delta)
+    while (op := delta.read(1)) != _OP_END:
+        if op == _OP_COPY:
+            base.seek(_read_varint(delta) * size)
+            remaining = _read_varint(delta) * size
+        elif op == _OP_LITERAL:
+            remaining = _read_varint(delta)
+        else:
+            raise ValueError("Corrupted delta")
+        src = base if op == _OP_COPY else delta
+        while remaining > 0:
+            data = src.read(min(remaining, _READ_SIZE))
+            if not data:
+                raise ValueError("Truncated delta")
+            out.write(data)
+            remaining -= len(data)
+
+
+def write_delta(
+    file_path: PathLike[str] | str, base: IO[bytes], base_size: int, out: IO[bytes]
+) -> None:
+    """
+    Write the delta of the file at `file_path` against the `base_size` bytes of
+    `base` to `out`.
+    """
+    signature = delta_signature(base, delta_block_size(base_size))
+    with open(file_path, "rb") as new:
+        make_delta(signature, new, out)
@@ -0,0 +1,200 @@
+import re
+from os import PathLike
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+_TERMINAL = ""
+"""Marks the end of an excluded path in the trie, no path component is empty."""
+
+
+def translate(pattern: str) -> str:
+    """
+    Translate a gitignore style glob into a regular expression.
+
+    Like `fnmatch.translate`, but `*`, `?` and character classes don't match `/`,
+    and `**` matches across directories.
+    """
+    i, n = 0, len(pattern)
+    res: list[str] = []
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            if pattern[i : i + 2] == "*/":
+                res.append("(?:.*/)?")
+                i += 2
+            elif pattern[i : i + 1] == "*":
+                res.append(".*")
+                i += 1
+            else:
+                res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[":
+            j = i
+            if pattern[j : j + 1] in ("!", "^"):
+                j += 1
+            if pattern[j : j + 1] == "]":
+                j += 1
+            j = pattern.find("]", j)
+            if j < 0:
+                res.append("\\[")
+            else:
+                stuff = pattern[i:j].replace("\\", "\\\\")
+                if stuff[:1] == "!":
+                    stuff = "^" + stuff[1:]
+                res.append(f"(?!/)[{stuff}]")
+                i = j + 1
+        else:
+            res.append(re.escape(c))
+    return "".join(res)
+
+
+def _is_glob(pattern: str) -> bool:
+    return any(c in pattern for c in "*?[")
+
+
+def _compile(patterns: list[str], prefix: str) -> Optional[re.Pattern[str]]:
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{prefix}{p})" for p in patterns))
+
+
+class ExclusionMatcher:
+    """
+    Compiled set of exclusion patterns.
+
+    Patterns follow gitignore rules:
+    - a pattern without a `/` (like `node_modules` or `*.log`) matches a file or
+      directory name at any depth
+    - a relative pattern containing a `/` (like `build/*.o`) is matched against the
+      path relative to the backed up directory
+    - an absolute pattern is matched against the absolute path, absolute paths
+      without wildcards are kept in a prefix trie
+    - a trailing `/` only matches directories
+    - a matching directory excludes everything below it
+
+    Plain names and `*.ext` style patterns are set and suffix lookups, the remaining
+    globs of a kind are combined into a single regular expression, so the cost of a
+    lookup hardly depends on the number of patterns. Negated patterns are not
+    supported.
+    """
+
+    def __init__(self, patterns: Iterable[PathLike[str] | str]) -> None:
+        self._trie: dict[str, Any] = {}
+        self._exact: set[str] = set()
+        # index 0 applies to files and directories, index 1 to directories only
+        self._names: tuple[set[str], set[str]] = (set(), set())
+        self._suffixes: tuple[set[str], set[str]] = (set(), set())
+        globs: dict[tuple[str, bool], list[str]] = {}
+        for raw in patterns:
+            pattern = Path(raw).as_posix() if not isinstance(raw, str) else raw
+            if not pattern or pattern.startswith("#"):
+                continue
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/") or "/"
+            if Path(pattern).is_absolute():
+                kind = "abs"
+                pattern = Path(pattern).as_posix()
+            elif "/" in pattern:
+                kind = "rel"
+                pattern = pattern.lstrip("/")
+            else:
+                kind = "name"
+            if kind == "abs" and not _is_glob(pattern) and not dir_only:
+                self._exact.add(pattern)
+                node = self._trie
+                for part in pattern.split("/"):
+                    node = node.setdefault(part or "/", {})
+                node[_TERMINAL] = True
+            elif kind == "name" and not _is_glob(pattern):
+                self._names[dir_only].add(pattern)
+            elif kind == "name" and pattern[:1] == "*" and not _is_glob(pattern[1:]):
+                self._suffixes[dir_only].add(pattern[1:])
+            else:
+                globs.setdefault((kind, dir_only), []).append(translate(pattern))
+        self._name_re = tuple(
+            _compile(globs.get(("name", d), []), "") for d in (False, True)
+        )
+        self._rel_re = _compile(
+            [f"{p}(?:/|$)" for p in globs.get(("rel", False), [])]
+            + [f"{p}/" for p in globs.get(("rel", True), [])],
+            "^",
+        )
+        self._abs_re = _compile(
+            [f"{p}(?:/|$)" for p in globs.get(("abs", False), [])]
+            + [f"{p}/" for p in globs.get(("abs", True), [])],
+            "^",
+        )
+        self._suffix_tuples = tuple(tuple(s) for s in self._suffixes)
+
+    def __bool__(self) -> bool:
+        return bool(
+            self._trie
+            or any(self._names)
+            or any(self._suffixes)
+            or any(self._name_re)
+            or self._rel_re
+            or self._abs_re
+        )
+
+    def _in_trie(self, abs_path: str) -> bool:
+        node = self._trie
+        for part in abs_path.split("/"):
+            node = node.get(part or "/")
+            if node is None:
+                return False
+            if _TERMINAL in node:
+                return True
+        return False
+
+    def _match_name(self, name: str, is_dir: bool) -> bool:
+        for d in (False, True) if is_dir else (False,):
+            if (
+                name in self._names[d]
+                or (self._suffix_tuples[d] and name.endswith(self._suffix_tuples[d]))
+                or (self._name_re[d] and self._name_re[d].fullmatch(name))  # type: ignore
+            ):
+                return True
+        return False
+
+    def _match_path(self, abs_path: str, rel_path: str, is_dir: bool) -> bool:
+        if is_dir:
+            abs_path += "/"
+            rel_path += "/"
+        return bool(
+            (self._rel_re and self._rel_re.match(rel_path))
+            or (self._abs_re and self._abs_re.match(abs_path))
+        )
+
+    def is_excluded(
+        self, abs_path: str, rel_path: Optional[str] = None, is_dir: bool = False
+    ) -> bool:
+        """
+        Whether the file or directory at the absolute posix path `abs_path` is excluded.
+
+        `rel_path` is the path relative to the backed up directory, it defaults to
+        `abs_path` without its leading `/`.
+        """
+        if self._trie and self._in_trie(abs_path):
+            return True
+        if rel_path is None:
+            rel_path = abs_path.lstrip("/")
+        parts = rel_path.split("/")
+        if any(self._match_name(part, True) for part in parts[:-1] if part):
+            return True
+        return self._match_name(parts[-1], is_dir) or self._match_path(
+            abs_path, rel_path, is_dir
+        )
+
+    def excludes_entry(self, abs_path: str, rel_path: str, is_dir: bool = False) -> bool:
+        """
+        Like `is_excluded`, for an entry whose parent directory is known to be
+        included. Only the entry itself is checked, this is what walks use after
+        pruning excluded directories.
+        """
+        return (
+            abs_path in self._exact
+            or self._match_name(abs_path.rpartition("/")[2], is_dir)
+            or self._match_path(abs_path, rel_path, is_dir)
+        )
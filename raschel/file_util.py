@@ -1,27 +1,93 @@
 import datetime
-import fnmatch
-from glob import glob
+from glob import glob, iglob
 import hashlib
 import os
 from io import TextIOWrapper
 from os import PathLike
-import re
-from typing import Any, Generator, Iterator, List
+from pathlib import Path
+from typing import IO, Any, Callable, Generator, Iterator, List
+
+from raschel import fileio
+from raschel.exclude import ExclusionMatcher
 
 
 def get_last_changed(path: PathLike[str] | str) -> datetime.datetime:
     return datetime.datetime.fromtimestamp(os.path.getmtime(path))
 
-def get_file_hash(filename: str):
-    BUFFER_SIZE = 4096
-    hash = hashlib.sha256()
-    with open(filename, "rb") as file:
-        while True:
-            chunk = file.read(BUFFER_SIZE)
-            if not chunk:
-                break
-            hash.update(chunk)
-        return hash.hexdigest()
+DEFAULT_HASH = "sha256"
+"""Hash algorithm of records which don't name one, the only one older versions used."""
+HASH_KEY = "hash_algorithm"
+"""File record field holding the name of the algorithm of `hash`."""
+
+_HASHERS: dict[str, Callable[[], Any]] = {
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+
+try:
+    import blake3  # type: ignore
+
+    _HASHERS["blake3"] = blake3.blake3  # type: ignore
+except ImportError:
+    pass
+
+try:
+    import xxhash  # type: ignore
+
+    _HASHERS["xxh3_128"] = xxhash.xxh3_128  # type: ignore
+except ImportError:
+    pass
+
+
+def register_hasher(name: str, factory: Callable[[], Any]) -> None:
+    """
+    Make a hash algorithm available under `name`. `factory` returns a new object with
+    the `update` and `hexdigest` methods of `hashlib` hashes.
+    """
+    _HASHERS[name] = factory
+
+
+def hashers() -> list[str]:
+    """Names of the available hash algorithms."""
+    return sorted(_HASHERS)
+
+
+def new_hasher(algorithm: str = DEFAULT_HASH) -> Any:
+    """
+    A new hash object of `algorithm`.
+
+    Raises `ValueError` if the algorithm is unknown or its package is not installed.
+    """
+    try:
+        factory = _HASHERS[algorithm]
+    except KeyError:
+        raise ValueError(
+            f"Unknown hash algorithm '{algorithm}', available: {', '.join(hashers())}"
+        ) from None
+    return factory()
+
+
+def record_algorithm(record: dict[str, Any]) -> str:
+    """Hash algorithm of the `hash` of a file record."""
+    return record.get(HASH_KEY) or DEFAULT_HASH
+
+
+def get_file_hash(filename: str, algorithm: str = DEFAULT_HASH):
+    """Hex digest of the contents of `filename`, see `fileio.hash_file`."""
+    return fileio.hash_file(filename, new_hasher(algorithm))
+
+
+def hash_copy(src: IO[bytes], dst: IO[bytes], algorithm: str = DEFAULT_HASH) -> str:
+    """
+    Copy `src` into `dst` and return the hex digest of the copied data.
+    Every chunk is read once into a reused buffer and fed to both the writer and
+    the hasher, see `fileio.iter_views`.
+    """
+    hash = new_hasher(algorithm)
+    for view in fileio.iter_views(src):
+        hash.update(view)
+        dst.write(view)
+    return hash.hexdigest()
 
 
 def _read_lazy_chunks(
@@ -53,7 +119,8 @@ def glob_files(glob_str: str) -> List[str]:
 
 
 def glob_files_iter(glob_str: str, exclusion_list: list[str]) -> Iterator[str]:
-    patterns = [re.compile(fnmatch.translate(x)) for x in exclusion_list]
-    for x in glob.iglob(glob_str, recursive=True):
-        if not any(map(lambda p: p.match(x) is not None, patterns)):
+    matcher = ExclusionMatcher(exclusion_list)
+    for x in iglob(glob_str, recursive=True):
+        abs_path = Path(os.path.abspath(x)).as_posix()
+        if not matcher.is_excluded(abs_path, Path(x).as_posix(), os.path.isdir(x)):
             yield x
@@ -0,0 +1,115 @@
+import contextlib
+import hashlib
+import mmap
+import os
+import threading
+from os import PathLike
+from typing import IO, Any, Iterator
+
+MIN_BUFFER = 64 * 1024
+MAX_BUFFER = 4 * 1024 * 1024
+"""Bounds of the read buffers, see `buffer_size`."""
+MMAP_THRESHOLD = 16 * 1024 * 1024
+"""Files of at least this size are memory mapped instead of read into a buffer."""
+
+_pool = threading.local()
+
+
+def buffer_size(size: int) -> int:
+    """
+    Read buffer size for a file of `size` bytes: the next power of two that holds the
+    whole file, within `MIN_BUFFER` and `MAX_BUFFER`.
+    """
+    return min(MAX_BUFFER, max(MIN_BUFFER, 1 << max(0, size - 1).bit_length()))
+
+
+@contextlib.contextmanager
+def _lease(size: int) -> Iterator[bytearray]:
+    """
+    Borrow a buffer of at least `size` bytes from the pool of the current thread.
+    Buffers are reused across files, nested leases get buffers of their own.
+    """
+    free: list[bytearray] = _pool.__dict__.setdefault("free", [])
+    buf = free.pop() if free else bytearray(size)
+    if len(buf) < size:
+        buf = bytearray(size)
+    try:
+        yield buf
+    finally:
+        free.append(buf)
+
+
+def iter_views(src: IO[bytes], size: int | None = None) -> Iterator[memoryview]:
+    """
+    Read `src` with `readinto` and yield the data as views of a reused buffer, no
+    bytes object is created per chunk.
+
+    A view is only valid until the next one is requested, copy it to keep it.
+    `size` is the expected length of the data and picks the buffer size, see
+    `buffer_size`.
+    """
+    if size is None:
+        with contextlib.suppress(OSError, ValueError):
+            size = os.fstat(src.fileno()).st_size - src.tell()
+    with _lease(buffer_size(size if size is not None else MAX_BUFFER)) as buf:
+        view = memoryview(buf)
+        try:
+            while n := src.readinto(view):  # type: ignore
+                yield view[:n]
+        finally:
+            view.release()
+
+
+@contextlib.contextmanager
+def open_view(filename: PathLike[str] | str) -> Iterator[Any]:
+    """
+    The contents of `filename` as a buffer: a read only memory map for files of at
+    least `MMAP_THRESHOLD` bytes and `bytes` for smaller ones.
+
+    The map is only valid inside the `with` block. A file that is truncated while it
+    is mapped can't be read through the map anymore, callers only map files they
+    read once from start to end.
+    """
+    with open(filename, "rb", buffering=0) as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            yield file.readall()
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            yield mapped
+
+
+def hash_file(filename: PathLike[str] | str, hash: Any = None) -> str:
+    """
+    Hex digest of the contents of `filename`, sha256 unless a hash object is given as
+    `hash`, see `file_util.new_hasher`.
+
+    Large files are mapped and hashed in one call without copying them, medium ones
+    are read into a pooled buffer sized for the file and small ones in a single read.
+    """
+    hash = hash or hashlib.sha256()
+    with open(filename, "rb", buffering=0) as file:
+        size = os.fstat(file.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                hash.update(mapped)
+        elif size <= MIN_BUFFER:
+            # a single read, setting up a buffer costs more than it saves here
+            hash.update(file.readall())
+        else:
+            for view in iter_views(file, size):
+                hash.update(view)
+    return hash.hexdigest()
+
+
+def read_text(filename: PathLike[str] | str) -> str:
+    """
+    Decode the contents of `filename` as utf-8, straight from the map or buffer of
+    `open_view`. Line endings are kept as they are.
+    """
+    with open_view(filename) as data:
+        return str(data, "utf-8")
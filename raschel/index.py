@@ -0,0 +1,124 @@
+import logging
+import os
+from os import PathLike
+from pathlib import Path
+from typing import Any
+
+from raschel import file_util
+from raschel.db.db import DATABASE, FileState
+from raschel.walker import FileEntry
+
+log = logging.getLogger(__name__)
+
+
+def _key(filename: PathLike[str] | str) -> str:
+    return Path(filename).absolute().as_posix()
+
+
+def _state(st: os.stat_result | FileEntry) -> tuple[int, int, int]:
+    if isinstance(st, FileEntry):
+        return st.size, st.mtime_ns, st.inode
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class FileIndex:
+    """
+    Persistent cache of file hashes keyed by absolute path.
+
+    A cached hash is reused as long as size, mtime and inode of the file are the same
+    as when it was hashed, so an unchanged file costs a single `stat` call instead of
+    a full read. One hash per file is kept, asking for another algorithm than the
+    cached one counts as a miss. Updates are buffered and written in batches, call
+    `flush` (or use the index as a context manager) to persist them.
+
+    The tables have to exist, see `db.db.init_database`.
+    """
+
+    def __init__(self, flush_every: int = 1000) -> None:
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self._pending: dict[str, dict[str, Any]] = {}
+
+    def __enter__(self) -> "FileIndex":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.flush()
+
+    def lookup(
+        self,
+        filename: PathLike[str] | str,
+        st: os.stat_result | FileEntry,
+        algorithm: str = file_util.DEFAULT_HASH,
+    ) -> str | None:
+        """
+        Returns the cached `algorithm` hash of `filename` if its stat tuple did not
+        change.
+        """
+        key = _key(filename)
+        row = self._pending.get(key)
+        if row is None:
+            state = FileState.get_or_none(FileState.path == key)
+            if state is None:
+                return None
+            row = state.__data__
+        if (row["size"], row["mtime_ns"], row["inode"]) != _state(st):
+            return None
+        if row["algorithm"] != algorithm:
+            return None
+        return row["hash"]
+
+    def update(
+        self,
+        filename: PathLike[str] | str,
+        st: os.stat_result | FileEntry,
+        hash: str,
+        algorithm: str = file_util.DEFAULT_HASH,
+    ) -> None:
+        """
+        Remember the `algorithm` hash `hash` for `filename`, `st` has to be taken
+        before the file was read.
+        """
+        key = _key(filename)
+        size, mtime_ns, inode = _state(st)
+        self._pending[key] = {
+            "path": key,
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "inode": inode,
+            "hash": hash,
+            "algorithm": algorithm,
+        }
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def get_hash(
+        self,
+        filename: PathLike[str] | str,
+        st: os.stat_result | FileEntry | None = None,
+        algorithm: str = file_util.DEFAULT_HASH,
+    ) -> str:
+        """
+        Returns the `algorithm` hash of `filename`, only reading the file if it
+        changed since it was last hashed.
+        """
+        st = st or os.stat(filename)
+        if (hash := self.lookup(filename, st, algorithm)) is not None:
+            self.hits += 1
+            return hash
+        self.misses += 1
+        hash = file_util.get_file_hash(str(filename), algorithm)
+        self.update(filename, st, hash, algorithm)
+        return hash
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        rows = list(self._pending.values())
+        with DATABASE.atomic():
+            # stay below sqlite's limit of host parameters per statement
+            for i in range(0, len(rows), 100):
+                FileState.insert_many(rows[i : i + 100]).on_conflict_replace().execute()
+        log.debug(f"Flushed {len(rows)} file states")
+        self._pending.clear()
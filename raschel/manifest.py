@@ -0,0 +1,660 @@
+"""
+Binary manifest format of the `meta.info` member.
+
+Layout, all integers little endian:
+
+    magic "RSMF" | u8 version | u32 header length | header (json) | sections
+
+The small json header holds the backup attributes (id, parent, deleted files, ...)
+and the offset and length of every section relative to the end of the header.
+Records are sorted by root dir and filename and stored in columns:
+
+- `paths`: filenames, prefix compressed against the previous name. Every
+  `RESTART_INTERVAL` entries of a root dir the full name is stored
+- `restarts`: u32 entry index and u64 offset into `paths` of every full name
+- `hash`: fixed width raw digests
+- `last_modified`, `timestamp`: i64 microseconds since 1970-01-01 of the (naive)
+  iso timestamps of the records
+- `attrs`: u32 index into the header's `attrs` table, holding the remaining record
+  fields (like `compression`) of which there are only a few distinct combinations
+- `flags`: u8, which of the columns hold a value for the entry
+- `root_names`, `roots`: the sorted root dirs, with the u64 offset and u32 length of
+  their name, their u64 first entry, u32 entry count and u64 first restart point.
+  Version 1 kept them in the header
+
+A single file is found with a binary search over the restart points and a scan of
+at most `RESTART_INTERVAL` names, iterating decodes one entry at a time.
+"""
+
+import datetime
+import functools
+import heapq
+import io
+import json
+import mmap
+import operator
+import os
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+from typing import IO, Any, Iterable, Iterator, Optional
+
+from raschel import compress
+
+MAGIC = b"RSMF"
+VERSION = 2
+RESTART_INTERVAL = 16
+SPILL_RECORDS = 50_000
+"""Records a `ManifestWriter` holds in memory before spilling them to disk."""
+MAX_RUNS = 64
+"""Spilled runs a `ManifestWriter` keeps before merging them into one."""
+MEMBER = "meta.info"
+"""Name of the manifest member in backup archives."""
+
+_PREFIX = struct.Struct("<4sBI")
+_RESTART = struct.Struct("<IQ")
+_TIME = struct.Struct("<q")
+_ATTR = struct.Struct("<I")
+_ROOT = struct.Struct("<QIQIQ")
+_LENGTH = struct.Struct("<I")
+
+_SECTIONS = (
+    "paths",
+    "restarts",
+    "hash",
+    "last_modified",
+    "timestamp",
+    "attrs",
+    "flags",
+    "root_names",
+    "roots",
+)
+_SPOOL_SIZE = 1024 * 1024
+_sort_key = operator.itemgetter(0, 1)
+
+_HAS_HASH = 1
+_HAS_LAST_MODIFIED = 2
+_HAS_TIMESTAMP = 4
+
+_INTERNAL = ("count", "hash_size", "roots", "attrs", "sections")
+"""Header fields describing the layout, the others are backup attributes."""
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_TIME_COLUMNS = (("last_modified", _HAS_LAST_MODIFIED), ("timestamp", _HAS_TIMESTAMP))
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: memoryview | bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _parse_seconds(value: str) -> Optional[int]:
+    try:
+        dt = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if dt.tzinfo is not None or dt.microsecond or dt.isoformat() != value:
+        return None
+    return (dt - _EPOCH) // datetime.timedelta(seconds=1)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _format_seconds(seconds: int) -> str:
+    return (_EPOCH + datetime.timedelta(seconds=seconds)).isoformat()
+
+
+def _to_micros(value: Any) -> Optional[int]:
+    """
+    Microseconds of a naive `datetime.isoformat()` string, `None` if `value` would
+    not be reproduced exactly by `_from_micros`. Timestamps of a backup share few
+    distinct seconds, so parsing them is cached.
+    """
+    if not isinstance(value, str):
+        return None
+    head, dot, fraction = value.partition(".")
+    if (seconds := _parse_seconds(head)) is None:
+        return None
+    if not dot:
+        return seconds * 1_000_000
+    if len(fraction) != 6 or not fraction.isdigit() or fraction == "000000":
+        return None
+    return seconds * 1_000_000 + int(fraction)
+
+
+def _from_micros(micros: int) -> str:
+    seconds, fraction = divmod(micros, 1_000_000)
+    head = _format_seconds(seconds)
+    return f"{head}.{fraction:06d}" if fraction else head
+
+
+def _common_prefix(a: bytes, b: bytes) -> int:
+    n = min(len(a), len(b))
+    # the highest differing bit of the xor is in the first differing byte
+    diff = int.from_bytes(a[:n], "big") ^ int.from_bytes(b[:n], "big")
+    return n - (diff.bit_length() + 7) // 8
+
+
+class _Column:
+    """Append only byte buffer, spilled to a temporary file once it grows large."""
+
+    def __init__(self) -> None:
+        self.file = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE)
+        self.buffer = bytearray()
+        self.size = 0
+
+    def flush(self) -> None:
+        self.file.write(self.buffer)
+        self.size += len(self.buffer)
+        self.buffer.clear()
+
+    def copy_to(self, out: IO[bytes]) -> None:
+        self.flush()
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, out, _SPOOL_SIZE)
+        self.file.close()
+
+
+class ManifestWriter:
+    """
+    Builds a manifest from records added in any order with bounded memory.
+
+    Records are buffered and, every `spill_every` records (default `SPILL_RECORDS`),
+    sorted and spilled to a temporary file. `write_to` merges the sorted runs and encodes the columns into
+    temporary files, so neither the records nor the encoded manifest have to fit
+    into memory.
+    """
+
+    def __init__(self, spill_every: Optional[int] = None) -> None:
+        self.spill_every = spill_every or SPILL_RECORDS
+        self.count = 0
+        self.hash_size: Optional[int] = None
+        self._buffer: list[tuple[bytes, bytes, dict[str, Any]]] = []
+        self._runs: list[IO[bytes]] = []
+
+    def add(self, root_dir: str, record: dict[str, Any]) -> None:
+        if self.hash_size is None:
+            try:
+                self.hash_size = len(bytes.fromhex(record["hash"]))
+            except (KeyError, TypeError, ValueError):
+                pass
+        self._buffer.append((root_dir.encode(), record["filename"].encode(), record))
+        self.count += 1
+        if len(self._buffer) >= self.spill_every:
+            self._spill()
+
+    @staticmethod
+    def _write_run(
+        entries: Iterable[tuple[bytes, bytes, dict[str, Any]]]
+    ) -> IO[bytes]:
+        # length prefixed pickles, a single pickle stream would be read back as one
+        # frame and so end up in memory as a whole
+        run = tempfile.TemporaryFile()
+        for entry in entries:
+            data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+            run.write(_LENGTH.pack(len(data)))
+            run.write(data)
+        run.seek(0)
+        return run
+
+    def _spill(self) -> None:
+        self._buffer.sort(key=_sort_key)
+        self._runs.append(self._write_run(self._buffer))
+        self._buffer.clear()
+        if len(self._runs) >= MAX_RUNS:
+            # merge the runs into one, so the open files stay below the os limit
+            merged = heapq.merge(*map(self._read_run, self._runs), key=_sort_key)
+            self._runs = [self._write_run(merged)]
+
+    @staticmethod
+    def _read_run(run: IO[bytes]) -> Iterator[tuple[bytes, bytes, dict[str, Any]]]:
+        with run:
+            while header := run.read(_LENGTH.size):
+                (length,) = _LENGTH.unpack(header)
+                yield pickle.loads(run.read(length))
+
+    def _sorted(self) -> Iterator[tuple[bytes, bytes, dict[str, Any]]]:
+        if not self._runs:
+            self._buffer.sort(key=_sort_key)
+            yield from self._buffer
+            return
+        if self._buffer:
+            self._spill()
+        yield from heapq.merge(*map(self._read_run, self._runs), key=_sort_key)
+
+    def write_to(self, out: IO[bytes], attributes: dict[str, Any]) -> None:
+        """
+        Write the manifest with the backup `attributes` to `out`. The writer can't be
+        used afterwards.
+        """
+        hash_size = self.hash_size or 0
+        columns = {name: _Column() for name in _SECTIONS}
+        paths, restarts, hashes = columns["paths"], columns["restarts"], columns["hash"]
+        attrs_col, flags_col = columns["attrs"], columns["flags"]
+        root_names, roots = columns["root_names"], columns["roots"]
+        attr_table: dict[Any, int] = {}
+        attr_values: list[dict[str, Any]] = []
+        n_restarts = 0
+
+        count = 0
+        current_root: Optional[bytes] = None
+        root_start = 0
+        previous = b""
+
+        def _end_root() -> None:
+            if current_root is None:
+                return
+            roots.buffer += _ROOT.pack(
+                root_names.size + len(root_names.buffer),
+                len(current_root),
+                root_start,
+                count - root_start,
+                root_restart,
+            )
+            root_names.buffer += current_root
+
+        root_restart = 0
+        for root, name, record in self._sorted():
+            if root != current_root:
+                _end_root()
+                current_root, root_start, root_restart = root, count, n_restarts
+            if (count - root_start) % RESTART_INTERVAL == 0:
+                restarts.buffer += _RESTART.pack(count, paths.size + len(paths.buffer))
+                n_restarts += 1
+                shared = 0
+            else:
+                shared = _common_prefix(previous, name)
+            _write_varint(paths.buffer, shared)
+            _write_varint(paths.buffer, len(name) - shared)
+            paths.buffer += name[shared:]
+            previous = name
+
+            flags = 0
+            rest = {k: v for k, v in record.items() if k != "filename"}
+            digest = None
+            try:
+                digest = bytes.fromhex(rest["hash"])
+            except (KeyError, TypeError, ValueError):
+                pass
+            if digest is not None and len(digest) == hash_size:
+                hashes.buffer += digest
+                flags |= _HAS_HASH
+                del rest["hash"]
+            else:
+                hashes.buffer += bytes(hash_size)
+            for column, flag in _TIME_COLUMNS:
+                micros = _to_micros(rest.get(column))
+                if micros is None:
+                    columns[column].buffer += _TIME.pack(0)
+                else:
+                    columns[column].buffer += _TIME.pack(micros)
+                    flags |= flag
+                    del rest[column]
+            try:
+                key: Any = tuple(sorted(rest.items()))
+                hash(key)
+            except TypeError:
+                key = json.dumps(rest, sort_keys=True)
+            if (attr := attr_table.get(key)) is None:
+                attr = attr_table[key] = len(attr_values)
+                attr_values.append(rest)
+            attrs_col.buffer += _ATTR.pack(attr)
+            flags_col.buffer.append(flags)
+            count += 1
+            if len(paths.buffer) >= _SPOOL_SIZE:
+                for column in columns.values():
+                    column.flush()
+        _end_root()
+
+        sections: dict[str, list[int]] = {}
+        offset = 0
+        for name in _SECTIONS:
+            column = columns[name]
+            column.flush()
+            sections[name] = [offset, column.size]
+            offset += column.size
+        header = json.dumps(
+            {
+                **attributes,
+                "count": count,
+                "hash_size": hash_size,
+                "attrs": attr_values,
+                "sections": sections,
+            }
+        ).encode()
+        out.write(_PREFIX.pack(MAGIC, VERSION, len(header)) + header)
+        for name in _SECTIONS:
+            columns[name].copy_to(out)
+
+    def write(self, archive: zipfile.ZipFile, attributes: dict[str, Any]) -> None:
+        """
+        Store the manifest as `MEMBER` of `archive`. It is stored uncompressed, the
+        hash column wouldn't shrink and readers can map it without inflating it.
+        """
+        zinfo = zipfile.ZipInfo(MEMBER, datetime.datetime.now().timetuple()[:6])
+        zinfo.compress_type = zipfile.ZIP_STORED
+        with archive.open(zinfo, "w", force_zip64=True) as out:
+            self.write_to(out, attributes)
+
+
+def encode(
+    dirs: dict[str, list[dict[str, Any]]], attributes: dict[str, Any]
+) -> bytes:
+    """
+    Encode the file records of `dirs` and the backup `attributes` into a manifest.
+    """
+    writer = ManifestWriter(spill_every=sys.maxsize)
+    for root_dir, records in dirs.items():
+        for record in records:
+            writer.add(root_dir, record)
+    out = io.BytesIO()
+    writer.write_to(out, attributes)
+    return out.getvalue()
+
+
+def read_header(data: bytes | memoryview) -> tuple[dict[str, Any], int]:
+    """
+    Parse the header at the start of `data`, which only has to contain the header.
+
+    Returns the header and the offset of the sections.
+    """
+    magic, version, length = _PREFIX.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a manifest")
+    if version > VERSION:
+        raise ValueError(f"Manifest version {version} is not supported")
+    start = _PREFIX.size
+    return json.loads(bytes(data[start : start + length])), start + length
+
+
+def is_manifest(data: bytes | memoryview) -> bool:
+    return bytes(data[: len(MAGIC)]) == MAGIC
+
+
+class Manifest:
+    """
+    Read access to an encoded manifest without decoding all of it.
+
+    A manifest opened by `read` may be mapped from the archive, `close` it (or use it
+    as a context manager) once it isn't needed anymore, an open mapping keeps the
+    archive from being removed or replaced on Windows.
+    """
+
+    def __init__(
+        self, data: bytes | memoryview, mapped: Optional[mmap.mmap] = None
+    ) -> None:
+        """`mapped` is the mapping `data` points into, it is closed by `close`."""
+        self._mapped = mapped
+        self.data = memoryview(data)
+        self.header, base = read_header(self.data)
+        self.hash_size: int = self.header["hash_size"]
+        # version 1 kept the root dirs in the header
+        self._header_roots = {r[0]: r[1:] for r in self.header.get("roots", [])}
+        self._attrs: list[dict[str, Any]] = self.header["attrs"]
+        self._sections = {
+            name: self.data[base + offset : base + offset + length]
+            for name, (offset, length) in self.header["sections"].items()
+        }
+
+    def close(self) -> None:
+        """Release the data of the manifest, it can't be read afterwards."""
+        for section in self._sections.values():
+            section.release()
+        self.data.release()
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+    def __enter__(self) -> "Manifest":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    @staticmethod
+    def attributes_of(header: dict[str, Any]) -> dict[str, Any]:
+        return {k: v for k, v in header.items() if k not in _INTERNAL}
+
+    @property
+    def attributes(self) -> dict[str, Any]:
+        """The backup attributes stored in the header."""
+        return self.attributes_of(self.header)
+
+    def _root_entry(self, i: int) -> tuple[bytes, tuple[int, int, int]]:
+        offset, length, *entry = _ROOT.unpack_from(self._sections["roots"], i * _ROOT.size)
+        return bytes(self._sections["root_names"][offset : offset + length]), entry  # type: ignore
+
+    def _root(self, root_dir: str) -> Optional[tuple[int, int, int]]:
+        """`(first entry, entry count, first restart)` of `root_dir`."""
+        if "roots" not in self._sections:
+            return self._header_roots.get(root_dir)  # type: ignore
+        target = root_dir.encode()
+        lo, hi = 0, len(self._sections["roots"]) // _ROOT.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name, entry = self._root_entry(mid)
+            if name == target:
+                return entry
+            if name < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    @property
+    def roots(self) -> Iterator[str]:
+        if "roots" not in self._sections:
+            yield from self._header_roots
+            return
+        for i in range(len(self._sections["roots"]) // _ROOT.size):
+            yield self._root_entry(i)[0].decode()
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+    def _record(self, index: int, name: bytes) -> dict[str, Any]:
+        s = self._sections
+        record: dict[str, Any] = {"filename": name.decode()}
+        flags = s["flags"][index]
+        if flags & _HAS_HASH:
+            size = self.hash_size
+            record["hash"] = s["hash"][index * size : (index + 1) * size].hex()
+        for column, flag in _TIME_COLUMNS:
+            if flags & flag:
+                (micros,) = _TIME.unpack_from(s[column], index * _TIME.size)
+                record[column] = _from_micros(micros)
+        (attr,) = _ATTR.unpack_from(s["attrs"], index * _ATTR.size)
+        record.update(self._attrs[attr])
+        return record
+
+    def _names(self, offset: int, previous: bytes = b"") -> Iterator[tuple[bytes, int]]:
+        """Decode names starting at `offset`, yields each with the following offset."""
+        paths = self._sections["paths"]
+        while offset < len(paths):
+            shared, offset = _read_varint(paths, offset)
+            length, offset = _read_varint(paths, offset)
+            previous = previous[:shared] + bytes(paths[offset : offset + length])
+            offset += length
+            yield previous, offset
+
+    def _restart(self, restart: int) -> tuple[int, int]:
+        return _RESTART.unpack_from(self._sections["restarts"], restart * _RESTART.size)
+
+    def iter_dir(self, root_dir: str) -> Iterator[dict[str, Any]]:
+        """Yields the records of `root_dir` sorted by filename."""
+        if (root := self._root(root_dir)) is None or not root[1]:
+            return
+        start, count, first_restart = root
+        _, offset = self._restart(first_restart)
+        names = self._names(offset)
+        for index in range(start, start + count):
+            name, _ = next(names)
+            yield self._record(index, name)
+
+    def __iter__(self) -> Iterator[tuple[str, dict[str, Any]]]:
+        """Yields `(root dir, record)` for every file, one entry is decoded at a time."""
+        for root_dir in self.roots:
+            for record in self.iter_dir(root_dir):
+                yield root_dir, record
+
+    def lookup(self, root_dir: str, filename: str) -> Optional[dict[str, Any]]:
+        """
+        Find the record of `filename` in `root_dir` with a binary search.
+        """
+        if (root := self._root(root_dir)) is None or not root[1]:
+            return None
+        start, count, first_restart = root
+        target = filename.encode()
+        lo = first_restart
+        hi = first_restart + (count + RESTART_INTERVAL - 1) // RESTART_INTERVAL
+        # find the last restart point whose name is <= target
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            _, offset = self._restart(mid)
+            name, _ = next(self._names(offset))
+            if name <= target:
+                lo = mid
+            else:
+                hi = mid
+        index, offset = self._restart(lo)
+        end = start + count
+        for name, _ in self._names(offset):
+            if name == target:
+                return self._record(index, name)
+            index += 1
+            if name > target or index >= end:
+                return None
+        return None
+
+    def to_dirs(self) -> dict[str, list[dict[str, Any]]]:
+        return {root_dir: list(self.iter_dir(root_dir)) for root_dir in self.roots}
+
+    def check(self) -> list[str]:
+        """
+        Returns the structural problems of the manifest: sections whose size doesn't
+        match the number of entries, root dirs or names out of order and entries
+        that can't be decoded.
+        """
+        count = len(self)
+        problems = [
+            f"Section '{name}' has {len(self._sections[name])} bytes, expected {count * width}"
+            for name, width in (
+                ("hash", self.hash_size),
+                ("last_modified", _TIME.size),
+                ("timestamp", _TIME.size),
+                ("attrs", _ATTR.size),
+                ("flags", 1),
+            )
+            if name in self._sections and len(self._sections[name]) != count * width
+        ]
+        if problems:
+            return problems
+        seen = 0
+        previous_root: Optional[bytes] = None
+        try:
+            for root_dir in self.roots:
+                root = root_dir.encode()
+                if previous_root is not None and root <= previous_root:
+                    problems.append(f"Root dir '{root_dir}' is out of order")
+                previous_root = root
+                previous: Optional[bytes] = None
+                for record in self.iter_dir(root_dir):
+                    name = record["filename"].encode()
+                    if previous is not None and name <= previous:
+                        problems.append(f"'{record['filename']}' of '{root_dir}' is out of order")
+                    previous = name
+                    seen += 1
+        except (IndexError, RuntimeError, UnicodeDecodeError, struct.error) as e:
+            problems.append(f"Entry {seen} can't be decoded: {e!r}")
+            return problems
+        if seen != count:
+            problems.append(f"Found {seen} entries, the header lists {count}")
+        return problems
+
+
+def load(data: bytes | memoryview) -> Manifest:
+    """
+    Open the contents of a `meta.info` member, json meta infos written by older
+    versions are converted.
+    """
+    if is_manifest(data):
+        return Manifest(data)
+    attributes = json.loads(bytes(data))
+    dirs = attributes.pop("dirs", {})
+    return Manifest(encode(dirs, attributes))
+
+
+def read(archive: zipfile.ZipFile) -> Manifest:
+    """
+    Open the manifest of `archive`. An uncompressed manifest is mapped into memory
+    instead of read, so it costs page cache and not process memory. Only the pages
+    of the manifest are mapped, until the returned `Manifest` is closed.
+    """
+    zinfo = archive.getinfo(MEMBER)
+    if zinfo.compress_type == zipfile.ZIP_STORED and zinfo.file_size and archive.filename:
+        with compress.open_raw(archive, zinfo) as fp:
+            offset = fp.tell()
+            # mappings have to start at a multiple of the allocation granularity
+            start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            mapped = mmap.mmap(
+                fp.fileno(),
+                offset - start + zinfo.file_size,
+                access=mmap.ACCESS_READ,
+                offset=start,
+            )
+        data = memoryview(mapped)[offset - start :]
+        if is_manifest(data):
+            return Manifest(data, mapped)
+        data.release()
+        mapped.close()
+    return load(archive.read(MEMBER))
+
+
+def read_attributes(archive: zipfile.ZipFile) -> dict[str, Any]:
+    """
+    Read only the backup attributes of `archive`, the file records are not touched.
+    """
+    with archive.open(MEMBER) as member:
+        start = member.read(_PREFIX.size)
+        if not is_manifest(start):
+            attributes = json.loads(start + member.read())
+            attributes.pop("dirs", None)
+            return attributes
+        _, _, length = _PREFIX.unpack(start)
+        header, _ = read_header(start + member.read(length))
+    return Manifest.attributes_of(header)
+
+
+def read_file(path: str | os.PathLike[str]) -> Manifest:
+    """
+    Open a manifest stored as a file of its own (see `ManifestWriter.write_to`), it is
+    mapped like by `read`. Json meta infos are converted like by `load`.
+    """
+    with open(path, "rb") as file:
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return load(file.read())
+        data = memoryview(mapped)
+        if is_manifest(data):
+            return Manifest(data, mapped)
+        data.release()
+        mapped.close()
+        return load(file.read())
@@ -0,0 +1,239 @@
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+from raschel.config import Config
+
+log = logging.getLogger(__name__)
+
+_POLL = 0.1
+"""Seconds a blocked stage waits before checking whether the pipeline was stopped."""
+
+
+@dataclass
+class PipelineSettings:
+    """
+    Concurrency of the stages of a parallel backup: walk → read → hash/compress → write.
+
+    - `walk_workers`: threads listing directories, see `walker.walk`
+    - `read_workers`: threads opening files and reading small ones ahead
+    - `compress_workers`: threads hashing and compressing
+    - `max_in_flight`: files between the walk and the writer, this bounds the memory
+      used by the pipeline to about `max_in_flight * (read_ahead + compress.SPOOL_SIZE)`
+    - `read_ahead`: files up to this size are read completely by the read stage,
+      larger ones are streamed by the compress stage
+
+    There is a single writer, the archive is written in the order of the walk.
+    """
+
+    walk_workers: int = 1
+    read_workers: int = 1
+    compress_workers: int = 1
+    max_in_flight: int = 4
+    read_ahead: int = 1024 * 1024
+
+    @classmethod
+    def for_workers(cls, workers: int) -> "PipelineSettings":
+        """Settings for `workers` threads per stage."""
+        workers = max(1, workers)
+        return cls(workers, workers, workers, 4 * workers)
+
+    @classmethod
+    def from_config(cls, config: Config | None, workers: int = 1) -> "PipelineSettings":
+        """
+        Settings for `workers` threads per stage, overridden by the `pipeline` section
+        of `config`.
+        """
+        settings = cls.for_workers(workers)
+        for key, value in (getattr(config, "pipeline", None) or {}).items():
+            if not hasattr(settings, key):
+                raise ValueError(f"Unknown pipeline setting '{key}'")
+            setattr(settings, key, int(value))
+        return settings
+
+    @property
+    def parallel(self) -> bool:
+        return max(self.walk_workers, self.read_workers, self.compress_workers) > 1
+
+
+class Result(NamedTuple):
+    """
+    An item that went through the pipeline, `error` is the exception raised by the
+    first stage that failed on it, `value` is `None` in that case.
+    """
+
+    item: Any
+    value: Any
+    error: Optional[BaseException]
+
+
+class _End:
+    """Marks the end of the input of a stage."""
+
+
+_END = _End()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Pipeline:
+    """
+    Runs items through stages of worker threads connected by bounded queues.
+
+    Every stage is a function applied to the output of the previous stage. The
+    stages run concurrently, each with its own number of threads, and at most
+    `max_in_flight` items are inside the pipeline at once: the feeder blocks until
+    the consumer has taken an item out, so a slow stage throttles the ones before
+    it instead of letting the queues grow. The results are yielded in input order.
+    """
+
+    def __init__(
+        self,
+        stages: list[tuple[Callable[[Any], Any], int]],
+        max_in_flight: int,
+        discard: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        """
+        Parameters:
+        - `stages`: `(function, number of threads)` per stage
+        - `max_in_flight`: items between the input and the consumer
+        - `discard`: called with the values which are dropped when the pipeline is
+          stopped early, e.g. to close files
+        """
+        self.stages = stages
+        self.max_in_flight = max(1, max_in_flight)
+        self.discard = discard
+
+    def _discard(self, value: Any) -> None:
+        if self.discard is None:
+            return
+        try:
+            self.discard(value)
+        except Exception as e:
+            log.warning(f"Could not discard {value!r}: {e}")
+
+    def run(self, items: Iterable[Any]) -> Iterator[Result]:
+        """
+        Feed `items` through the stages from a separate thread and yield a `Result`
+        per item. An exception raised while iterating `items` is re-raised here.
+
+        Closing the returned generator early stops all threads, items still in the
+        pipeline are dropped.
+        """
+        stop = threading.Event()
+        slots = threading.Semaphore(self.max_in_flight)
+        queues: list[queue.Queue[Any]] = [
+            queue.Queue(self.max_in_flight) for _ in range(len(self.stages) + 1)
+        ]
+        failure: list[BaseException] = []
+
+        def put(q: queue.Queue[Any], value: Any) -> None:
+            while True:
+                if stop.is_set():
+                    raise _Stopped
+                try:
+                    q.put(value, timeout=_POLL)
+                    return
+                except queue.Full:
+                    pass
+
+        def get(q: queue.Queue[Any]) -> Any:
+            while True:
+                if stop.is_set():
+                    raise _Stopped
+                try:
+                    return q.get(timeout=_POLL)
+                except queue.Empty:
+                    pass
+
+        def feed() -> None:
+            try:
+                for seq, item in enumerate(items):
+                    while not slots.acquire(timeout=_POLL):
+                        if stop.is_set():
+                            return
+                    put(queues[0], (seq, item, item, None))
+            except _Stopped:
+                return
+            except BaseException as e:
+                failure.append(e)
+            try:
+                put(queues[0], _END)
+            except _Stopped:
+                pass
+
+        def work(
+            fn: Callable[[Any], Any],
+            inbox: queue.Queue[Any],
+            outbox: queue.Queue[Any],
+            done: list[int],
+            lock: threading.Lock,
+            workers: int,
+        ) -> None:
+            try:
+                while (entry := get(inbox)) is not _END:
+                    seq, item, value, error = entry
+                    if error is None:
+                        try:
+                            value = fn(value)
+                        except Exception as e:
+                            value, error = None, e
+                    try:
+                        put(outbox, (seq, item, value, error))
+                    except _Stopped:
+                        self._discard(value)
+                        raise
+                # let the other threads of the stage see the end too
+                put(inbox, _END)
+                with lock:
+                    done[0] += 1
+                    last = done[0] == workers
+                if last:
+                    put(outbox, _END)
+            except _Stopped:
+                pass
+
+        threads = [threading.Thread(target=feed, name="pipeline-feed", daemon=True)]
+        for i, (fn, workers) in enumerate(self.stages):
+            workers = max(1, workers)
+            done, lock = [0], threading.Lock()
+            threads.extend(
+                threading.Thread(
+                    target=work,
+                    args=(fn, queues[i], queues[i + 1], done, lock, workers),
+                    name=f"pipeline-{getattr(fn, '__name__', i)}-{n}",
+                    daemon=True,
+                )
+                for n in range(workers)
+            )
+        for thread in threads:
+            thread.start()
+
+        # results which overtook an earlier item, at most `max_in_flight` of them
+        ahead: dict[int, tuple[Any, Any, Optional[BaseException]]] = {}
+        next_seq = 0
+        try:
+            while (entry := queues[-1].get()) is not _END:
+                seq, item, value, error = entry
+                ahead[seq] = (item, value, error)
+                while next_seq in ahead:
+                    result = Result(*ahead.pop(next_seq))
+                    next_seq += 1
+                    slots.release()
+                    yield result
+            if failure:
+                raise failure[0]
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            for q in queues:
+                while not q.empty():
+                    if (entry := q.get()) is not _END:
+                        self._discard(entry[2])
+            for _, value, _ in ahead.values():
+                self._discard(value)
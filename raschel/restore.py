@@ -0,0 +1,301 @@
+import contextlib
+import datetime
+import fnmatch
+import heapq
+import io
+import itertools
+import logging
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from os import PathLike, path
+from pathlib import Path
+from typing import IO, Any, Iterator, Optional
+
+import peewee as pw
+
+from raschel import catalog, checkpoint, compress, diff, file_util, manifest
+from raschel.backup import PATCH_DELTA, PATCH_TEXT, MetaInfo, record_member
+from raschel.volumes import is_volume, record_volume, volume_path
+
+log = logging.getLogger(__name__)
+
+BUFFER_SIZE = 1024 * 1024
+
+
+@dataclass
+class Source:
+    """
+    Where the content of a restored file comes from, `archive` is the volume holding
+    the member. If `base` is set, the member is a patch which has to be applied to
+    the content of `base`.
+    """
+
+    archive: str
+    root_dir: str
+    record: dict[str, Any]
+    base: Optional["Source"] = None
+
+    @property
+    def member(self) -> str:
+        return record_member(self.root_dir, self.record)
+
+    @property
+    def original_path(self) -> str:
+        return (Path(self.root_dir) / self.record["filename"]).as_posix()
+
+
+@dataclass
+class RestoreReport:
+    restored: int = 0
+    bytes: int = 0
+    failed: list[str] = field(default_factory=list)
+
+
+def find_archive(backup_id: str, search_dir: PathLike[str] | str) -> str:
+    """
+    Locate the archive of the backup `backup_id`. Archives are named after the id of
+    their backup, so `search_dir` is checked first and the catalog second. Partial
+    archives of backups that didn't complete are never returned.
+
+    Raises `KeyError` if the archive can't be found.
+    """
+    for candidate in sorted(Path(search_dir).glob(f"{backup_id}_*.zip")):
+        if is_volume(candidate) or checkpoint.is_partial(candidate):
+            continue
+        if str(MetaInfo.from_path(candidate.as_posix(), False).id) == backup_id:
+            return candidate.as_posix()
+    try:
+        if (
+            (backup := catalog.get_backup(backup_id))
+            and path.exists(backup.path)  # type: ignore
+            and not checkpoint.is_partial(backup.path)  # type: ignore
+        ):
+            return backup.path  # type: ignore
+    except pw.DatabaseError as e:
+        log.debug(f"Catalog lookup of '{backup_id}' failed: {e}")
+    raise KeyError(f"Could not find the archive of backup '{backup_id}'")
+
+
+def _lineage(archive_path: str) -> list[tuple[str, MetaInfo]]:
+    """
+    The archives of the chain ending in `archive_path`, oldest first. Only the
+    attributes are read, the file records stay in the archives.
+    """
+    lineage: list[tuple[str, MetaInfo]] = []
+    current = Path(archive_path).absolute().as_posix()
+    meta = MetaInfo.from_path(current, False)
+    lineage.append((current, meta))
+    while meta.parent:
+        current = find_archive(meta.parent, Path(current).parent)
+        meta = MetaInfo.from_path(current, False)
+        if any(current == a for a, _ in lineage):
+            raise ValueError(f"Backup chain of '{archive_path}' contains a cycle")
+        lineage.append((current, meta))
+    lineage.reverse()
+    return lineage
+
+
+def _link_records(
+    link: int, records: manifest.Manifest
+) -> Iterator[tuple[bytes, bytes, int, str, dict[str, Any]]]:
+    for root_dir, record in records:
+        yield root_dir.encode(), record["filename"].encode(), link, root_dir, record
+
+
+def _merge(lineage: list[tuple[str, MetaInfo]]) -> Iterator[Source]:
+    deleted = [
+        {(root_dir, name) for root_dir, names in meta.deleted.items() for name in names}
+        for _, meta in lineage
+    ]
+    with contextlib.ExitStack() as stack:
+        streams = []
+        for link, (archive, _) in enumerate(lineage):
+            with zipfile.ZipFile(archive) as zf:
+                records = stack.enter_context(manifest.read(zf))
+            streams.append(_link_records(link, records))
+        # the manifests are sorted by root dir and filename, so all versions of a
+        # file come out next to each other, oldest first
+        entries = heapq.merge(*streams, key=lambda e: e[:3])
+        for _, group in itertools.groupby(entries, key=lambda e: e[:2]):
+            source: Optional[Source] = None
+            previous = -1
+            for _, _, link, root_dir, record in group:
+                key = (root_dir, record["filename"])
+                if any(key in deleted[i] for i in range(previous + 1, link + 1)):
+                    source = None
+                previous = link
+                archive, meta = lineage[link]
+                if meta.diff_backup and source is None:
+                    raise ValueError(
+                        f"'{archive}' patches '{key[1]}' which is not in its base "
+                        "backup"
+                    )
+                source = Source(
+                    volume_path(archive, record_volume(record)),
+                    root_dir,
+                    record,
+                    source if meta.diff_backup else None,
+                )
+            if source is not None and not any(
+                key in deleted[i] for i in range(previous + 1, len(lineage))
+            ):
+                yield source
+
+
+def resolve(archive_path: str) -> Iterator[Source]:
+    """
+    Resolve the files contained in the backup `archive_path`, following the parents
+    of incremental and diff backups.
+
+    Yields a `Source` for every file of the backup, sorted by root dir and filename.
+    The chain is looked up right away, the records are merged from the manifests of
+    its archives while iterating, so only the versions of one file are held at a
+    time. Close the iterator if it isn't exhausted, it keeps the manifests open.
+    """
+    return _merge(_lineage(archive_path))
+
+
+def destination(
+    root_dir: str, filename: str, target_dir: Optional[PathLike[str]]
+) -> Path:
+    """
+    Where a file is restored to: its original location or, with `target_dir`, the same
+    path below `target_dir` with the drive letter turned into a directory.
+    """
+    if target_dir is None:
+        return Path(root_dir) / filename
+    drive, rest = path.splitdrive(root_dir)
+    drive = drive.replace(":", "").lower()
+    return Path(target_dir) / drive / rest.lstrip("/\\") / filename
+
+
+class _HashingWriter:
+    def __init__(self, out: IO[bytes], algorithm: str = file_util.DEFAULT_HASH) -> None:
+        self.out = out
+        self.hash = file_util.new_hasher(algorithm)
+        self.size = 0
+
+    def write(self, data: bytes | bytearray) -> int:
+        self.hash.update(data)
+        self.size += len(data)
+        return self.out.write(data)
+
+
+def write_content(
+    source: Source,
+    out: IO[bytes] | _HashingWriter,
+    archives: dict[str, zipfile.ZipFile],
+) -> None:
+    """
+    Write the content of `source` to `out`, applying its patches. `archives` holds
+    the open archives of `source` and its bases by path.
+    """
+    archive = archives[source.archive]
+    if source.base is None:
+        # stream the member, only one buffer per worker is held in memory
+        with archive.open(source.member) as src:
+            while chunk := src.read(BUFFER_SIZE):
+                out.write(chunk)
+        return
+    patch = source.record.get("patch", PATCH_TEXT)
+    if patch == PATCH_DELTA:
+        # deltas copy blocks from anywhere in the base, so it is spilled to disk first
+        with tempfile.TemporaryFile() as base, archive.open(source.member) as delta:
+            write_content(source.base, base, archives)  # type: ignore
+            base.seek(0)
+            diff.apply_delta(base, delta, out)  # type: ignore
+    elif patch == PATCH_TEXT:
+        # text patches need the whole base version in memory
+        base = io.BytesIO()
+        write_content(source.base, base, archives)
+        patch_text = archive.read(source.member).decode()
+        out.write(diff.apply_patch_text(base.getvalue().decode(), patch_text).encode())
+    else:
+        raise ValueError(f"Unknown patch format '{patch}'")
+
+
+def _restore_file(
+    source: Source, dest: Path, archives: dict[str, zipfile.ZipFile]
+) -> int:
+    """
+    Write `source` to `dest`, verifying its hash while writing. The file is written
+    next to `dest` first and only moved into place once the hash matched.
+
+    Returns the number of bytes written.
+    """
+    os.makedirs(dest.parent, exist_ok=True)
+    tmp = dest.with_name(f"{dest.name}.raschel-tmp")
+    try:
+        with open(tmp, "wb") as file:
+            out = _HashingWriter(file, file_util.record_algorithm(source.record))
+            write_content(source, out, archives)
+        if out.hash.hexdigest() != source.record["hash"]:
+            raise ValueError(f"Hash mismatch for '{dest}'")
+        os.replace(tmp, dest)
+    finally:
+        if tmp.exists():
+            os.remove(tmp)
+    mtime = datetime.datetime.fromisoformat(source.record["last_modified"]).timestamp()
+    os.utime(dest, (mtime, mtime))
+    return out.size
+
+
+def restore(
+    archive_path: str,
+    target_dir: Optional[PathLike[str]] = None,
+    only: Optional[str] = None,
+    workers: int = 4,
+) -> RestoreReport:
+    """
+    Restore the files of a backup.
+
+    Parameters:
+    - `archive_path`: a full, incremental or diff backup, parents are looked up next to it or in the catalog
+    - `target_dir`: restore below this directory instead of the original locations
+    - `only`: glob pattern matched against the original paths of the files
+    - `workers`: number of files extracted in parallel
+
+    Members are streamed out of the zip and hashed while they are written, a file
+    whose hash doesn't match the meta info is not moved into place. Of a backup
+    split into volumes, only the volumes holding selected files are opened. The file
+    records are streamed from the manifests, see `resolve`, and at most `2 * workers`
+    files are in flight, so memory doesn't grow with the archive size.
+    """
+    report = RestoreReport()
+    with contextlib.ExitStack() as stack:
+        sources = stack.enter_context(contextlib.closing(resolve(archive_path)))
+        archives: dict[str, zipfile.ZipFile] = {}
+
+        def _selected() -> Iterator[Source]:
+            # archives are opened here, in the submitting thread, when first needed
+            for source in sources:
+                if only is not None and not fnmatch.fnmatch(source.original_path, only):
+                    continue
+                s: Optional[Source] = source
+                while s is not None:
+                    if s.archive not in archives:
+                        archives[s.archive] = stack.enter_context(
+                            zipfile.ZipFile(s.archive)
+                        )
+                    s = s.base
+                yield source
+
+        def _restore(source: Source) -> int:
+            dest = destination(source.root_dir, source.record["filename"], target_dir)
+            return _restore_file(source, dest, archives)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for source, result in compress.imap_ordered(
+                pool, _restore, _selected(), window=2 * max(1, workers)
+            ):
+                try:
+                    report.bytes += result.result()
+                    report.restored += 1
+                    log.info(f"Restored '{source.original_path}'")
+                except Exception as e:
+                    report.failed.append(source.original_path)
+                    log.error(e)
+    return report
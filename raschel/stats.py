@@ -0,0 +1,194 @@
+"""
+Per stage metrics of a backup, see `BackupStats`.
+"""
+
+import heapq
+import json
+import threading
+import time
+from os import PathLike
+from typing import Any, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+WALK = "walk"
+READ = "read"
+COMPRESS = "compress"
+"""Hashing and compressing, in a sequential backup also reading and writing."""
+WRITE = "write"
+MANIFEST = "manifest"
+CHANGESET = "changeset"
+"""Comparing the files with the previous backup of an incremental backup."""
+
+_BUCKETS = 40
+"""Histogram buckets, bucket `i` holds durations below `2**i` microseconds."""
+
+
+class Histogram:
+    """
+    Durations in power of two buckets of microseconds, so percentiles are upper
+    bounds within a factor of two.
+    """
+
+    def __init__(self) -> None:
+        self.buckets = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        bucket = min(int(seconds * 1e6).bit_length(), _BUCKETS - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the `p`th percentile in seconds."""
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(2**bucket / 1e6, self.max)
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "seconds": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class StageStats:
+    def __init__(self) -> None:
+        self.durations = Histogram()
+        self.bytes = 0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**self.durations.to_dict(), "bytes": self.bytes}
+
+
+class BackupStats:
+    """
+    Counters and duration histograms per stage of a backup, the bytes read and
+    written and the slowest files.
+
+    Recording a file costs a few clock reads and a lock, so the stats can stay on
+    for large backups. Stages running in parallel threads overlap, their seconds
+    add up to more than the wall time of the backup.
+    """
+
+    def __init__(self, slow_files: int = 20) -> None:
+        """
+        Parameters:
+        - `slow_files`: number of slowest files remembered
+        """
+        self.stages: dict[str, StageStats] = {}
+        self.files = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.slow_files = slow_files
+        self._slow: list[tuple[float, str, str]] = []
+        self._lock = threading.Lock()
+
+    def observe(
+        self, stage: str, seconds: float, nbytes: int = 0, filename: str | None = None
+    ) -> None:
+        """Record that `stage` took `seconds` for `nbytes` of the file `filename`."""
+        with self._lock:
+            if (stats := self.stages.get(stage)) is None:
+                stats = self.stages[stage] = StageStats()
+            stats.durations.add(seconds)
+            stats.bytes += nbytes
+            if filename is not None and self.slow_files:
+                item = (seconds, stage, filename)
+                if len(self._slow) < self.slow_files:
+                    heapq.heappush(self._slow, item)
+                elif item > self._slow[0]:
+                    heapq.heapreplace(self._slow, item)
+
+    def file_done(self, bytes_in: int, bytes_out: int) -> None:
+        with self._lock:
+            self.files += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def file_failed(self) -> None:
+        with self._lock:
+            self.failed += 1
+
+    def timed(self, stage: str, items: Iterable[T]) -> Iterator[T]:
+        """Yields from `items`, recording the time spent waiting for each as `stage`."""
+        it = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    def finish(self) -> None:
+        self.seconds = time.perf_counter() - self.started
+
+    @property
+    def ratio(self) -> float:
+        """Compressed size relative to the original size."""
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    @property
+    def slowest(self) -> list[tuple[float, str, str]]:
+        """`(seconds, stage, filename)` of the slowest files, slowest first."""
+        return sorted(self._slow, reverse=True)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "seconds": self.seconds,
+            "files": self.files,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": self.ratio,
+            "stages": {name: s.to_dict() for name, s in self.stages.items()},
+            "slowest": [
+                {"seconds": seconds, "stage": stage, "file": filename}
+                for seconds, stage, filename in self.slowest
+            ],
+        }
+
+    def dump(self, filename: PathLike[str] | str) -> None:
+        with open(filename, "w") as file:
+            json.dump(self.to_dict(), file, indent=4)
+
+    def summary(self) -> str:
+        mib = self.bytes_in / 2**20
+        lines = [
+            f"{self.files} files, {self.failed} failed, {mib:.1f} MiB"
+            f" -> {self.bytes_out / 2**20:.1f} MiB (ratio {self.ratio:.2f})"
+            f" in {self.seconds:.2f}s"
+            f" ({mib / self.seconds if self.seconds else 0:.1f} MiB/s)",
+            f"{'stage':<10} {'count':>9} {'seconds':>9} {'p50 ms':>8}"
+            f" {'p99 ms':>8} {'max ms':>8}",
+        ]
+        for name, stage in self.stages.items():
+            d = stage.durations
+            lines.append(
+                f"{name:<10} {d.count:>9} {d.total:>9.2f}"
+                f" {d.percentile(50) * 1e3:>8.2f} {d.percentile(99) * 1e3:>8.2f}"
+                f" {d.max * 1e3:>8.2f}"
+            )
+        if self._slow:
+            lines.append("slowest files:")
+            for seconds, stage, filename in self.slowest:
+                lines.append(f"  {seconds * 1e3:9.2f} ms  {stage:<10} {filename}")
+        return "\n".join(lines)
@@ -0,0 +1,336 @@
+import datetime
+import fnmatch
+import hashlib
+import logging
+import os
+import random
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from os import PathLike
+from pathlib import Path
+from typing import IO, Any, Iterator, Optional
+
+from raschel import compress, file_util, manifest
+from raschel.backup import MetaInfo, archive_names, backup_files, last_modified
+from raschel.config import Config
+from raschel.restore import RestoreReport, destination
+
+log = logging.getLogger(__name__)
+
+MIN_CHUNK_SIZE = 2 * 1024
+AVG_CHUNK_SIZE = 8 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+READ_SIZE = 1024 * 1024
+SNAPSHOT_SUFFIX = ".manifest"
+
+_rng = random.Random(0x7261736368656C)
+_BITS = bytes(_rng.getrandbits(1) for _ in range(256))
+"""A random bit per byte value, fixed so chunk boundaries are stable across runs."""
+_PATTERN = bytes(_rng.getrandbits(1) for _ in range(32))
+"""Bits a chunk ends with, it isn't constant so runs of one byte are never cut."""
+del _rng
+
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+
+def _cut_point(
+    bits: bytes, start: int, end: int, min_size: int, avg_size: int, max_size: int
+) -> int:
+    """
+    FastCDC style cut point of the data from `start` to `end`, returns the chunk size.
+
+    `bits` is the data translated with `_BITS`. A chunk ends after the first match
+    of a prefix of `_PATTERN`, so a boundary only depends on the bytes right before
+    it. The match is found with `bytes.find` instead of rolling a hash byte by byte
+    in Python. Up to `avg_size` a longer prefix has to match and a shorter one
+    after, which narrows the chunk size distribution.
+    """
+    if end - start <= min_size:
+        return end - start
+    order = avg_size.bit_length() - 1
+    stop = min(end, start + max_size)
+    normal = min(stop, start + avg_size)
+    # a prefix of `length` bits ends at a given byte with a probability of
+    # 2 ** -length
+    for lo, hi, length in (
+        (start + min_size, normal, order + 2),
+        (normal, stop, order - 2),
+    ):
+        if (found := bits.find(_PATTERN[:length], lo - length + 1, hi)) >= 0:
+            return found + length - start
+    return stop - start
+
+
+def iter_chunks(
+    file: IO[bytes],
+    min_size: int = MIN_CHUNK_SIZE,
+    avg_size: int = AVG_CHUNK_SIZE,
+    max_size: int = MAX_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Split the content of `file` into content defined chunks.
+
+    A cut is only searched once `max_size` bytes are buffered (or the file ended), so
+    the boundaries depend on the content alone and not on how the file was read.
+    """
+    buf = b""
+    start = 0
+    eof = False
+    while not eof:
+        data = file.read(READ_SIZE)
+        eof = not data
+        buf = buf[start:] + data
+        bits = buf.translate(_BITS)
+        start = 0
+        while len(buf) - start >= max_size or (eof and start < len(buf)):
+            n = _cut_point(bits, start, len(buf), min_size, avg_size, max_size)
+            yield buf[start : start + n]
+            start += n
+
+
+@dataclass
+class IngestStats:
+    files: int = 0
+    bytes: int = 0
+    chunks: int = 0
+    new_chunks: int = 0
+    new_bytes: int = 0
+    """Size of the chunks which were not in the vault yet, before compression."""
+    stored_bytes: int = 0
+    """Bytes written to the chunk store, after compression."""
+
+    @property
+    def dedup_ratio(self) -> float:
+        return self.bytes / self.new_bytes if self.new_bytes else float("inf")
+
+
+class Vault:
+    """
+    A content addressed chunk store.
+
+    Files are split into content defined chunks (see `iter_chunks`), every chunk is
+    stored once under its sha256 in `chunks/`. The chunk hashes of a file are stored
+    in `lists/`, under the algorithm and hash of the whole file, which uses
+    `hash_algorithm` (see `file_util.hashers`). Snapshots are manifests (see
+    `manifest.ManifestWriter`) in `snapshots/` whose records point to the chunk list
+    by their hash instead of to a zip member. Older snapshots were json meta infos
+    whose records listed the chunks themselves.
+    """
+
+    def __init__(
+        self,
+        vault_path: PathLike[str] | str,
+        hash_algorithm: str = file_util.DEFAULT_HASH,
+    ) -> None:
+        file_util.new_hasher(hash_algorithm)
+        self.hash_algorithm = hash_algorithm
+        self.path = Path(vault_path)
+        self.chunk_dir = self.path / "chunks"
+        self.list_dir = self.path / "lists"
+        self.snapshot_dir = self.path / "snapshots"
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.list_dir, exist_ok=True)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: Config) -> "Vault":
+        if not config.vault_path:
+            raise ValueError("The config does not define a vault_path")
+        return cls(config.vault_path, config.hash_algorithm)
+
+    def _chunk_path(self, chunk_hash: str) -> Path:
+        return self.chunk_dir / chunk_hash[:2] / chunk_hash
+
+    def _list_path(self, record: dict[str, Any]) -> Path:
+        file_hash = record["hash"]
+        algorithm = file_util.record_algorithm(record)
+        return self.list_dir / algorithm / file_hash[:2] / file_hash
+
+    @staticmethod
+    def _write(target: Path, data: bytes) -> None:
+        # written to a temporary file first, so a crash never leaves a partial file
+        os.makedirs(target.parent, exist_ok=True)
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as file:
+            file.write(data)
+        os.replace(tmp, target)
+
+    def has_chunk(self, chunk_hash: str) -> bool:
+        return self._chunk_path(chunk_hash).exists()
+
+    def put_chunk(self, chunk: bytes, chunk_hash: Optional[str] = None) -> tuple[str, int]:
+        """
+        Store `chunk` unless it is already in the vault.
+
+        Returns its hash and the number of bytes written (0 if it was known).
+        """
+        chunk_hash = chunk_hash or hashlib.sha256(chunk).hexdigest()
+        target = self._chunk_path(chunk_hash)
+        if target.exists():
+            return chunk_hash, 0
+        packed = zlib.compress(chunk, 6)
+        data = _ZLIB + packed if len(packed) < len(chunk) else _RAW + chunk
+        self._write(target, data)
+        return chunk_hash, len(data)
+
+    def get_chunk(self, chunk_hash: str) -> bytes:
+        with open(self._chunk_path(chunk_hash), "rb") as file:
+            data = file.read()
+        chunk = zlib.decompress(data[1:]) if data[:1] == _ZLIB else data[1:]
+        if hashlib.sha256(chunk).hexdigest() != chunk_hash:
+            raise ValueError(f"Chunk '{chunk_hash}' is corrupted")
+        return chunk
+
+    def put_file(self, filename: str, stats: IngestStats) -> dict[str, Any]:
+        """
+        Chunk `filename` into the vault and return its file record.
+
+        The chunk list is stored under the hash of the file, files with the same
+        content share it.
+        """
+        file_hash = file_util.new_hasher(self.hash_algorithm)
+        chunks: list[str] = []
+        size = 0
+        with open(filename, "rb") as file:
+            for chunk in iter_chunks(file):
+                file_hash.update(chunk)
+                size += len(chunk)
+                chunk_hash, written = self.put_chunk(chunk)
+                chunks.append(chunk_hash)
+                stats.chunks += 1
+                if written:
+                    stats.new_chunks += 1
+                    stats.new_bytes += len(chunk)
+                    stats.stored_bytes += written
+        stats.files += 1
+        stats.bytes += size
+        # the size stays out of the record, it would give every record its own
+        # entry in the attrs table of the manifest
+        record = {
+            "hash": file_hash.hexdigest(),
+            file_util.HASH_KEY: self.hash_algorithm,
+        }
+        target = self._list_path(record)
+        if not target.exists():
+            data = b"".join(map(bytes.fromhex, chunks))
+            self._write(target, data)
+            stats.stored_bytes += len(data)
+        return record
+
+    def chunk_list(self, record: dict[str, Any]) -> list[str]:
+        """The chunk hashes of the file of `record`."""
+        if "chunks" in record:
+            # json snapshots of older versions
+            return record["chunks"]
+        with open(self._list_path(record), "rb") as file:
+            data = file.read()
+        size = hashlib.sha256().digest_size
+        return [data[i : i + size].hex() for i in range(0, len(data), size)]
+
+    def read_file(self, record: dict[str, Any]) -> Iterator[bytes]:
+        for chunk_hash in self.chunk_list(record):
+            yield self.get_chunk(chunk_hash)
+
+    def backup(
+        self,
+        paths_to_backup: list[PathLike[str]],
+        excluded_paths: Optional[list[PathLike[str]]] = None,
+    ) -> tuple[str, IngestStats]:
+        """
+        Store a snapshot of `paths_to_backup` in the vault.
+
+        Returns the path of the snapshot and the ingest statistics.
+        """
+        if not isinstance(paths_to_backup, list):  # type: ignore
+            paths_to_backup = [paths_to_backup]
+        stats = IngestStats()
+        meta_info = MetaInfo()
+        writer = manifest.ManifestWriter()
+        for file in backup_files(paths_to_backup, excluded_paths):
+            filename = file.path
+            log.info(f"{filename}")
+            root_dir, _, file_archive_path = archive_names(filename)
+            record = self.put_file(filename, stats)
+            record.update(
+                {
+                    "filename": file_archive_path.as_posix(),
+                    "timestamp": datetime.datetime.now().isoformat(),
+                    "last_modified": last_modified(file.mtime_ns),
+                }
+            )
+            writer.add(root_dir, record)
+        time = datetime.datetime.now().isoformat("_", "seconds")
+        time = time.replace("-", "_").replace(":", "_")
+        snapshot = self.snapshot_dir / f"{meta_info.id}_{time}{SNAPSHOT_SUFFIX}"
+        tmp = snapshot.with_name(f"{snapshot.name}.tmp")
+        with open(tmp, "wb") as file:
+            writer.write_to(file, meta_info.attributes())
+        os.replace(tmp, snapshot)
+        snapshot = snapshot.as_posix()
+        log.info(
+            f"Snapshot written to '{snapshot}', {stats.bytes} bytes in {stats.files}"
+            f" files, {stats.new_bytes} new bytes (dedup ratio {stats.dedup_ratio:.2f})"
+        )
+        return snapshot, stats
+
+    def restore(
+        self,
+        snapshot: str,
+        target_dir: Optional[PathLike[str]] = None,
+        only: Optional[str] = None,
+        workers: int = 4,
+    ) -> RestoreReport:
+        """
+        Restore the files of a snapshot, see `restore.restore` for the parameters.
+
+        The records are read from the mapped snapshot one at a time, json snapshots of
+        older versions are converted first.
+        """
+        def _restore(item: tuple[str, dict[str, Any]]) -> int:
+            root_dir, record = item
+            dest = destination(root_dir, record["filename"], target_dir)
+            os.makedirs(dest.parent, exist_ok=True)
+            tmp = dest.with_name(f"{dest.name}.raschel-tmp")
+            file_hash = file_util.new_hasher(file_util.record_algorithm(record))
+            size = 0
+            try:
+                with open(tmp, "wb") as out:
+                    for chunk in self.read_file(record):
+                        file_hash.update(chunk)
+                        out.write(chunk)
+                        size += len(chunk)
+                if file_hash.hexdigest() != record["hash"]:
+                    raise ValueError(f"Hash mismatch for '{dest}'")
+                os.replace(tmp, dest)
+            finally:
+                if tmp.exists():
+                    os.remove(tmp)
+            mtime = datetime.datetime.fromisoformat(record["last_modified"]).timestamp()
+            os.utime(dest, (mtime, mtime))
+            return size
+
+        report = RestoreReport()
+        with manifest.read_file(snapshot) as snap, ThreadPoolExecutor(
+            max_workers=max(1, workers)
+        ) as pool:
+            files = (
+                (root_dir, record)
+                for root_dir, record in snap
+                if only is None
+                or fnmatch.fnmatch(
+                    (Path(root_dir) / record["filename"]).as_posix(), only
+                )
+            )
+            for (root_dir, record), result in compress.imap_ordered(
+                pool, _restore, files, window=2 * max(1, workers)
+            ):
+                original = (Path(root_dir) / record["filename"]).as_posix()
+                try:
+                    report.bytes += result.result()
+                    report.restored += 1
+                except Exception as e:
+                    report.failed.append(original)
+                    log.error(e)
+        return report
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from os import PathLike
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from raschel import compress, file_util, manifest
+from raschel.backup import record_member
+from raschel.volumes import is_volume, record_volume, volume_path
+
+log = logging.getLogger(__name__)
+
+BUFFER_SIZE = 1024 * 1024
+
+
+@dataclass
+class Problem:
+    member: str
+    error: str
+
+
+@dataclass
+class VerifyReport:
+    """
+    Result of verifying one archive.
+
+    `members` and `bytes` count the checked members and their uncompressed size,
+    `skipped` the members of a deep verification whose hash can't be checked on its
+    own because they hold a patch. The archive is intact if `problems` is empty.
+    """
+
+    archive: str
+    deep: bool
+    members: int = 0
+    bytes: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+    problems: list[Problem] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    @property
+    def throughput(self) -> float:
+        """Checked bytes per second."""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "ok": self.ok, "throughput": self.throughput}
+
+
+class _Archives:
+    """
+    One open `ZipFile` per volume and thread, so workers don't share a file
+    position.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._opened: list[zipfile.ZipFile] = []
+        self._lock = threading.Lock()
+
+    def get(self, archive_path: str) -> zipfile.ZipFile:
+        if not hasattr(self._local, "archives"):
+            self._local.archives = {}
+        archive = self._local.archives.get(archive_path)
+        if archive is None:
+            archive = self._local.archives[archive_path] = zipfile.ZipFile(archive_path)
+            with self._lock:
+                self._opened.append(archive)
+        return archive
+
+    def close(self) -> None:
+        for archive in self._opened:
+            archive.close()
+
+
+def _check_member(
+    archives: _Archives, archive_path: str, name: str, record: Optional[dict[str, Any]]
+) -> tuple[int, bool]:
+    """
+    Stream the member `name` of the volume `archive_path` and compare its hash with `record` if one is given,
+    the CRC is checked by `zipfile` when the end of the member is reached.
+
+    Returns the number of bytes read and whether the hash was checked.
+    """
+    hash = file_util.new_hasher(file_util.record_algorithm(record)) if record else None
+    size = 0
+    with archives.get(archive_path).open(name) as member:
+        while chunk := member.read(BUFFER_SIZE):
+            size += len(chunk)
+            if hash is not None:
+                hash.update(chunk)
+    if hash is not None and hash.hexdigest() != record["hash"]:  # type: ignore
+        raise ValueError(f"Hash mismatch, recorded {record['hash']}")  # type: ignore
+    return size, hash is not None
+
+
+def verify_archive(
+    archive_path: PathLike[str] | str, deep: bool = False, workers: int = 4
+) -> VerifyReport:
+    """
+    Check that the archive at `archive_path` is intact.
+
+    Every member is streamed out of the zip in `workers` threads, nothing is written
+    to disk, and `zipfile` checks its CRC. The manifest has to be readable and
+    consistent (see `manifest.Manifest.check`) and every file record needs a member
+    and the other way round. With `deep`, the members are also hashed with the
+    algorithm of their record and compared with the recorded hash, members holding
+    a patch of a diff backup are skipped as their hash belongs to the patched file.
+    Of a backup split into volumes, the numbered volumes next to `archive_path` are
+    checked too and each record's member has to be in the volume it names.
+    """
+    archive_path = Path(archive_path).as_posix()
+    report = VerifyReport(archive_path, deep)
+    start = time.perf_counter()
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except (OSError, zipfile.BadZipFile) as e:
+        report.problems.append(Problem("", f"Can't open archive: {e}"))
+        return report
+
+    # members are keyed by (volume, name), volume 0 is `archive_path`
+    records: dict[tuple[int, str], dict[str, Any]] = {}
+    with archive:
+        try:
+            with manifest.read(archive) as meta:
+                report.problems.extend(
+                    Problem(manifest.MEMBER, p) for p in meta.check()
+                )
+                if report.ok:
+                    for root_dir, record in meta:
+                        name = record_member(root_dir, record)
+                        records[(record_volume(record), name)] = record
+        except Exception as e:
+            report.problems.append(Problem(manifest.MEMBER, f"Unreadable manifest: {e}"))
+        members = [(0, info.filename) for info in archive.infolist()]
+
+    volume = 1
+    while Path(volume_path(archive_path, volume)).exists():
+        try:
+            with zipfile.ZipFile(volume_path(archive_path, volume)) as archive:
+                members.extend((volume, info.filename) for info in archive.infolist())
+        except (OSError, zipfile.BadZipFile) as e:
+            report.problems.append(
+                Problem(volume_path(archive_path, volume), f"Can't open volume: {e}")
+            )
+        volume += 1
+
+    for _, name in sorted(records.keys() - set(members)):
+        report.problems.append(Problem(name, "Recorded file has no member"))
+    if report.ok:
+        for key in members:
+            if key != (0, manifest.MEMBER) and key not in records:
+                report.problems.append(Problem(key[1], "Member is not in the manifest"))
+
+    archives = _Archives()
+
+    def _check(key: tuple[int, str]) -> tuple[int, bool]:
+        record = records.get(key) if deep else None
+        if record is not None and ("patch" in record or "hash" not in record):
+            record = None
+        return _check_member(archives, volume_path(archive_path, key[0]), key[1], record)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for (_, name), result in compress.imap_ordered(
+                pool, _check, members, window=2 * max(1, workers)
+            ):
+                try:
+                    size, hashed = result.result()
+                except Exception as e:
+                    report.problems.append(Problem(name, str(e)))
+                    continue
+                report.members += 1
+                report.bytes += size
+                if deep and not hashed and name != manifest.MEMBER:
+                    report.skipped += 1
+    finally:
+        archives.close()
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def find_archives(path: PathLike[str] | str) -> list[str]:
+    """
+    The archive at `path` or the `.zip` files below the directory `path`, numbered
+    volumes are checked with their first volume.
+    """
+    if Path(path).is_dir():
+        return [
+            p.as_posix() for p in sorted(Path(path).rglob("*.zip")) if not is_volume(p)
+        ]
+    return [Path(path).as_posix()]
+
+
+def verify(
+    archive_paths: Iterable[PathLike[str] | str], deep: bool = False, workers: int = 4
+) -> list[VerifyReport]:
+    """Verify the archives one after another, see `verify_archive`."""
+    reports: list[VerifyReport] = []
+    for archive_path in archive_paths:
+        report = verify_archive(archive_path, deep, workers)
+        for problem in report.problems:
+            log.error(f"{report.archive}: {problem.member}: {problem.error}")
+        log.info(
+            f"Verified '{report.archive}': {report.members} members,"
+            f" {report.bytes / 2**20:.1f} MiB in {report.seconds:.2f}s"
+            f" ({report.throughput / 2**20:.1f} MiB/s), {len(report.problems)} problems"
+        )
+        reports.append(report)
+    return reports
@@ -0,0 +1,188 @@
+"""
+Backups split into size capped volumes.
+
+The archive named by the backup (`<id>_<time>.zip`) is volume 0. When a size cap is
+set, members that would push a volume past it go into the next volume,
+`<id>_<time>.v001.zip`, `.v002.zip` and so on. Every volume is a complete zip file
+on its own. The manifest stays in volume 0 and the records of members stored in
+another volume carry its number as `volume`, so readers only open the volumes
+holding the members they need.
+"""
+
+import logging
+import os
+import re
+import zipfile
+from os import PathLike
+from pathlib import Path
+from typing import Any, Optional
+
+from raschel import compress
+
+log = logging.getLogger(__name__)
+
+VOLUME_KEY = "volume"
+"""File record field holding the volume of the member, missing for volume 0."""
+
+_VOLUME_RE = re.compile(r"\.v(\d{3,})\.zip$")
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(value: str) -> int:
+    """
+    Parse a size like `700M`, `4G` or `1048576`, the units are powers of 1024.
+
+    Raises `ValueError` for anything else.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([KMGT]?)i?B?\s*", value, re.IGNORECASE)
+    if not match or not int(match[1]):
+        raise ValueError(f"Invalid size '{value}'")
+    return int(match[1]) * _UNITS[match[2].upper()]
+
+
+def volume_path(archive_path: PathLike[str] | str, volume: Optional[int]) -> str:
+    """Path of the `volume` of the backup archive at `archive_path`."""
+    archive_path = Path(archive_path).as_posix()
+    if not volume:
+        return archive_path
+    return f"{archive_path.removesuffix('.zip')}.v{volume:03d}.zip"
+
+
+def is_volume(path: PathLike[str] | str) -> bool:
+    """Whether `path` is a numbered volume, which has no manifest of its own."""
+    return _VOLUME_RE.search(Path(path).name) is not None
+
+
+def record_volume(record: dict[str, Any]) -> int:
+    return record.get(VOLUME_KEY) or 0
+
+
+class VolumeWriter:
+    """
+    Hands out the archive the next member is written to, rolling over to a new
+    volume when the member would push the current one past `max_size`.
+
+    A member larger than `max_size` gets a volume of its own, members are never
+    split. Without `max_size` every member goes to `main`.
+    """
+
+    def __init__(self, main: zipfile.ZipFile, max_size: Optional[int] = None) -> None:
+        """
+        Parameters:
+        - `main`: volume 0, the archive which also gets the manifest
+        - `max_size`: size cap of a volume in bytes
+        """
+        self.main = main
+        self.max_size = max_size
+        self.volume = 0
+        self.paths: list[str] = []
+        """The numbered volumes written so far."""
+        self._current = main
+        self._members = 0
+
+    def archive_for(self, size: int) -> tuple[zipfile.ZipFile, int]:
+        """
+        The archive and volume number for a member of about `size` bytes, the
+        compressed size if it's known and the size of the file otherwise.
+        """
+        if (
+            self.max_size
+            and self._members
+            and self._current.start_dir + size > self.max_size  # type: ignore
+        ):
+            self._roll_over()
+        self._members += 1
+        return self._current, self.volume
+
+    def resume(self, volume: int, archive: zipfile.ZipFile) -> None:
+        """
+        Continue writing to `archive`, the reopened `volume` of a resumed backup. The
+        volumes before it are complete.
+        """
+        if volume:
+            self._current = archive
+            self.volume = volume
+            main = self.main.filename  # type: ignore
+            self.paths = [volume_path(main, v) for v in range(1, volume + 1)]
+        self._members = len(archive.filelist)
+
+    def sync(self) -> None:
+        """Flush what was written to the open volumes to disk."""
+        archives = [self.main]
+        if self._current is not self.main:
+            archives.append(self._current)
+        for archive in archives:
+            if archive.fp is not None:
+                archive.fp.flush()
+                os.fsync(archive.fp.fileno())
+
+    def discard(self, archive: zipfile.ZipFile, zinfo: zipfile.ZipInfo) -> None:
+        """Take the member `zinfo` written last to `archive` out again."""
+        compress.discard_last(archive, zinfo)
+        if archive is self._current:
+            self._members -= 1
+
+    def _roll_over(self) -> None:
+        if self._current is not self.main:
+            self._current.close()
+        self.volume += 1
+        path = volume_path(self.main.filename, self.volume)  # type: ignore
+        log.info(f"Starting volume '{path}'")
+        self._current = zipfile.ZipFile(
+            path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9
+        )
+        self.paths.append(path)
+        self._members = 0
+
+    def close(self) -> None:
+        """Close the numbered volumes, `main` stays open for the manifest."""
+        if self._current is not self.main:
+            self._current.close()
+            self._current = self.main
+
+    def remove(self) -> None:
+        """Delete the numbered volumes, after a failed backup."""
+        self.close()
+        for path in self.paths:
+            Path(path).unlink(missing_ok=True)
+
+    def __enter__(self) -> "VolumeWriter":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+
+class VolumeReader:
+    """
+    Opens the volumes of a backup on demand, volume 0 is the archive it is created
+    with and isn't closed by `close`.
+    """
+
+    def __init__(self, main: zipfile.ZipFile) -> None:
+        self.main = main
+        self._open: dict[int, zipfile.ZipFile] = {}
+
+    def archive(self, volume: int) -> zipfile.ZipFile:
+        if not volume:
+            return self.main
+        if (archive := self._open.get(volume)) is None:
+            archive = self._open[volume] = zipfile.ZipFile(
+                volume_path(self.main.filename, volume)  # type: ignore
+            )
+        return archive
+
+    def archive_of(self, record: dict[str, Any]) -> zipfile.ZipFile:
+        """The archive holding the member of the file `record`."""
+        return self.archive(record_volume(record))
+
+    def close(self) -> None:
+        for archive in self._open.values():
+            archive.close()
+        self._open.clear()
+
+    def __enter__(self) -> "VolumeReader":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
@@ -0,0 +1,120 @@
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import PathLike
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from raschel.exclude import ExclusionMatcher
+
+log = logging.getLogger(__name__)
+
+
+class FileEntry(NamedTuple):
+    """A file found by `walk`, `path` is absolute and uses `/` as separator."""
+
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+_Scan = tuple[list[FileEntry], list[tuple[str, str]]]
+
+
+def _scan(dir: str, rel: str, matcher: Optional[ExclusionMatcher]) -> _Scan:
+    """
+    List one directory. Returns its files and its `(path, relative path)`
+    subdirectories, excluded entries are left out.
+    """
+    files: list[FileEntry] = []
+    subdirs: list[tuple[str, str]] = []
+    prefix = f"{rel}/" if rel else ""
+    base = dir.rstrip("/")
+    try:
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                full = f"{base}/{entry.name}"
+                rel_name = prefix + entry.name
+                try:
+                    if entry.is_dir():
+                        # like os.walk, symlinked directories are not followed
+                        if entry.is_symlink():
+                            continue
+                        if not (matcher and matcher.excludes_entry(full, rel_name, True)):
+                            subdirs.append((full, rel_name))
+                    elif entry.is_file():
+                        if matcher and matcher.excludes_entry(full, rel_name):
+                            continue
+                        # the stat result is cached on the entry, on Windows it even
+                        # comes with the directory listing
+                        st = entry.stat()
+                        files.append(
+                            FileEntry(full, st.st_size, st.st_mtime_ns, st.st_ino)
+                        )
+                except OSError as e:
+                    log.warning(f"Skipping '{full}': {e}")
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    except OSError as e:
+        log.warning(f"Could not list '{dir}': {e}")
+    return files, subdirs
+
+
+def walk(
+    paths: Iterable[PathLike[str] | str],
+    matcher: Optional[ExclusionMatcher] = None,
+    workers: int = 1,
+    recursive: bool = True,
+    base: Optional[str] = None,
+) -> Iterator[FileEntry]:
+    """
+    Yields the files below `paths` using `os.scandir`.
+
+    Parameters:
+    - `matcher`: excluded files are skipped and excluded directories are not entered
+    - `workers`: number of threads listing directories ahead of the consumer, this pays
+      off on network filesystems and fast SSDs where a single thread waits on latency
+    - `recursive`: if `False`, only the files directly inside of `paths` are listed
+    - `base`: backed up directory containing `paths`, the paths the `matcher` sees are
+      relative to it instead of to `paths`
+
+    The order is the same for any number of workers: the files of a directory come
+    before the ones of its subdirectories, which are visited depth first. Missing
+    directories are skipped.
+    """
+    roots: list[tuple[str, str]] = []
+    for p in paths:
+        root = Path(os.path.abspath(p)).as_posix()
+        rel = Path(os.path.relpath(root, base)).as_posix() if base else "."
+        rel = "" if rel == "." else rel
+        if matcher and matcher.is_excluded(root, rel or Path(root).name, is_dir=True):
+            continue
+        roots.append((root, rel))
+
+    if workers <= 1:
+        stack = list(reversed(roots))
+        while stack:
+            dir, rel = stack.pop()
+            files, subdirs = _scan(dir, rel, matcher)
+            yield from files
+            if recursive:
+                stack.extend(reversed(subdirs))
+        return
+
+    window = 4 * workers
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # directories still to visit, the top `window` of them are scanned ahead
+        pending: list[tuple[str, str, Optional[Future[_Scan]]]] = [
+            (dir, rel, None) for dir, rel in reversed(roots)
+        ]
+        while pending:
+            for i in range(max(0, len(pending) - window), len(pending)):
+                dir, rel, future = pending[i]
+                if future is None:
+                    pending[i] = (dir, rel, pool.submit(_scan, dir, rel, matcher))
+            _, _, future = pending.pop()
+            files, subdirs = future.result()  # type: ignore
+            yield from files
+            if recursive:
+                pending.extend((dir, rel, None) for dir, rel in reversed(subdirs))
@@ -0,0 +1,487 @@
+"""
+Continuous backups of mostly idle directories.
+
+Instead of walking the backed up directories on a schedule, they are watched for
+changes: with inotify on Linux, by comparing the stat results of periodic walks
+where it isn't available. Every touched path is appended to a durable
+`ChangeJournal`, and when an incremental backup is due only the paths that stopped
+changing are compared with the previous backup, see `watch`.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import glob
+import hashlib
+import json
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from os import PathLike, path
+from pathlib import Path
+from typing import IO, Any, Iterable, Optional
+
+from raschel import backup, catalog, walker
+from raschel.config import Config
+from raschel.exclude import ExclusionMatcher
+
+log = logging.getLogger(__name__)
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+)
+_EVENT = struct.Struct("iIII")
+"""`struct inotify_event` without its name: wd, mask, cookie and name length."""
+_READ_SIZE = 64 * 1024
+_WAKEUP = 1.0
+"""Longest time the watch waits before checking whether it was stopped."""
+
+
+@dataclass
+class WatchSettings:
+    """
+    Timing of a watch, the `watch` section of the config overrides the defaults.
+
+    - `interval`: seconds between incremental backups
+    - `debounce`: seconds a path has to stay unchanged before it is backed up
+    - `max_delay`: seconds after which a path that keeps changing is backed up anyway
+    - `poll`: find changes by walking the directories instead of using inotify
+    - `poll_interval`: seconds between the walks when polling
+    """
+
+    interval: float = 60.0
+    debounce: float = 2.0
+    max_delay: float = 600.0
+    poll: bool = False
+    poll_interval: float = 10.0
+
+    @classmethod
+    def from_config(cls, config: Config | None) -> "WatchSettings":
+        settings = cls()
+        for key, value in (getattr(config, "watch", None) or {}).items():
+            if not hasattr(settings, key):
+                raise ValueError(f"Unknown watch setting '{key}'")
+            setattr(settings, key, type(getattr(settings, key))(value))
+        return settings
+
+
+def watched_roots(patterns: Iterable[str]) -> list[str]:
+    """
+    The directories matched by the glob `patterns`, e.g. `Config.backup_from_patterns`,
+    as absolute posix paths. Directories inside of another match are left out.
+    """
+    roots: set[str] = set()
+    for pattern in patterns:
+        matches = glob.glob(path.expanduser(pattern), recursive=True)
+        if not matches:
+            log.warning(f"'{pattern}' doesn't match anything")
+        for match in matches:
+            if path.isdir(match):
+                roots.add(Path(path.abspath(match)).as_posix())
+            else:
+                log.warning(f"Not watching '{match}', only directories are backed up")
+    return sorted(
+        root
+        for root in roots
+        if not any(root.startswith(f"{other.rstrip('/')}/") for other in roots)
+    )
+
+
+def _excluded(
+    matcher: Optional[ExclusionMatcher], filename: str, root: str, is_dir: bool
+) -> bool:
+    if not matcher or filename == root:
+        return False
+    return matcher.is_excluded(filename, filename[len(root.rstrip("/")) + 1 :], is_dir)
+
+
+def _libc() -> ctypes.CDLL:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+class InotifyWatcher:
+    """
+    Watches directory trees with inotify through ctypes, only on Linux.
+
+    Every directory gets a watch of its own, directories created or moved into a
+    tree are watched as they appear. If the kernel's event queue overflows, the
+    roots are reported as touched, so they are compared completely.
+    """
+
+    def __init__(
+        self, roots: list[str], matcher: Optional[ExclusionMatcher] = None
+    ) -> None:
+        """
+        Raises `OSError` if inotify isn't available or the watch limit
+        (`/proc/sys/fs/inotify/max_user_watches`) is reached.
+        """
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.roots = roots
+        self.matcher = matcher
+        self._libc = _libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"inotify_init1: {os.strerror(code)}")
+        # watch descriptor -> (directory, root)
+        self._dirs: dict[int, tuple[str, str]] = {}
+        try:
+            for root in roots:
+                self._watch_tree(root, root)
+        except BaseException:
+            self.close()
+            raise
+
+    def _watch_tree(self, dir: str, root: str) -> None:
+        """Watch `dir` and the directories below it which are not excluded."""
+        stack = [dir]
+        while stack:
+            dir = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir), _MASK)
+            if wd < 0:
+                code = ctypes.get_errno()
+                if code in (errno.ENOENT, errno.ENOTDIR):
+                    # removed again before it was watched
+                    continue
+                raise OSError(code, f"inotify_add_watch: {os.strerror(code)}", dir)
+            self._dirs[wd] = (dir, root)
+            try:
+                with os.scandir(dir) as entries:
+                    for entry in entries:
+                        sub = f"{dir.rstrip('/')}/{entry.name}"
+                        if entry.is_dir(follow_symlinks=False) and not _excluded(
+                            self.matcher, sub, root, True
+                        ):
+                            stack.append(sub)
+            except OSError as e:
+                log.warning(f"Could not list '{dir}': {e}")
+
+    def _unwatch_tree(self, dir: str) -> None:
+        """Stop watching `dir` and the directories below it, after it was moved away."""
+        for wd, (watched, _) in list(self._dirs.items()):
+            if watched == dir or watched.startswith(f"{dir}/"):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._dirs[wd]
+
+    def changes(self, timeout: float) -> set[str]:
+        """
+        The paths touched since the last call, waits up to `timeout` seconds for the
+        first change.
+        """
+        touched: set[str] = set()
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        while ready:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            self._handle(data, touched)
+        return touched
+
+    def _handle(self, data: bytes, touched: set[str]) -> None:
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                log.warning("Missed changes, the watched directories are compared")
+                touched.update(self.roots)
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if wd not in self._dirs or not name:
+                # events of the watched directory itself are reported by its parent
+                continue
+            dir, root = self._dirs[wd]
+            filename = f"{dir.rstrip('/')}/{name}"
+            is_dir = bool(mask & IN_ISDIR)
+            if _excluded(self.matcher, filename, root, is_dir):
+                continue
+            touched.add(filename)
+            if is_dir and mask & IN_MOVED_FROM:
+                self._unwatch_tree(filename)
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                # files created before the watch was added are found by walking it
+                self._watch_tree(filename, root)
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._dirs = {}
+
+
+class PollingWatcher:
+    """
+    Watches directory trees by walking them every `interval` seconds and comparing
+    the stat results, where inotify isn't available or its watch limit is too low.
+    """
+
+    def __init__(
+        self,
+        roots: list[str],
+        matcher: Optional[ExclusionMatcher] = None,
+        interval: float = 10.0,
+    ) -> None:
+        self.roots = roots
+        self.matcher = matcher
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next = time.monotonic() + interval
+
+    def _scan(self) -> dict[str, tuple[int, int, int]]:
+        return {
+            file.path: (file.size, file.mtime_ns, file.inode)
+            for file in walker.walk(self.roots, self.matcher)
+        }
+
+    def changes(self, timeout: float) -> set[str]:
+        """
+        The paths touched since the last walk, waits up to `timeout` seconds for
+        the next one.
+        """
+        wait = self._next - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(0.0, wait))
+        snapshot = self._scan()
+        self._next = time.monotonic() + self.interval
+        touched = {p for p, st in snapshot.items() if self._snapshot.get(p) != st}
+        touched.update(self._snapshot.keys() - snapshot.keys())
+        self._snapshot = snapshot
+        return touched
+
+    def close(self) -> None:
+        self._snapshot = {}
+
+
+def open_watcher(
+    roots: list[str],
+    matcher: Optional[ExclusionMatcher] = None,
+    settings: Optional[WatchSettings] = None,
+) -> InotifyWatcher | PollingWatcher:
+    """An `InotifyWatcher` for `roots`, or a `PollingWatcher` if that fails."""
+    settings = settings or WatchSettings()
+    if not settings.poll:
+        try:
+            return InotifyWatcher(roots, matcher)
+        except (OSError, AttributeError) as e:
+            log.warning(f"Can't use inotify, polling for changes instead: {e}")
+    return PollingWatcher(roots, matcher, settings.poll_interval)
+
+
+def journal_path(target_dir: PathLike[str] | str, roots: list[str]) -> str:
+    """The journal of the watch of `roots` backing up to `target_dir`."""
+    key = hashlib.sha1(catalog.roots_key(roots).encode()).hexdigest()[:12]
+    return f"{Path(target_dir).as_posix()}/watch-{key}.journal"
+
+
+class ChangeJournal:
+    """
+    The paths touched since they were last backed up, one json string per line.
+
+    New paths are synced to disk as soon as they are seen, so after a crash or a
+    restart they are still backed up. A line cut off by a crash is ignored.
+    """
+
+    def __init__(self, filename: PathLike[str] | str) -> None:
+        self.path = Path(filename).as_posix()
+        self.paths: set[str] = set()
+        torn = False
+        if path.exists(self.path):
+            with open(self.path, encoding="utf-8") as file:
+                *lines, tail = file.read().split("\n")
+            self.paths.update(json.loads(line) for line in lines)
+            if torn := bool(tail):
+                log.warning(f"Ignoring the incomplete last line of '{self.path}'")
+        os.makedirs(Path(self.path).parent, exist_ok=True)
+        self._file: IO[str] = open(self.path, "a", encoding="utf-8")
+        if torn:
+            # the next path must not be appended to the cut off line
+            self._rewrite()
+
+    def add(self, paths: Iterable[str]) -> None:
+        new = sorted(set(paths) - self.paths)
+        if not new:
+            return
+        self.paths.update(new)
+        self._file.write("".join(f"{json.dumps(p)}\n" for p in new))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def done(self, paths: Iterable[str]) -> None:
+        """Drop the backed up `paths`, the journal is rewritten with the others."""
+        self.paths.difference_update(paths)
+        self._rewrite()
+
+    def _rewrite(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            file.write("".join(f"{json.dumps(p)}\n" for p in sorted(self.paths)))
+            file.flush()
+            os.fsync(file.fileno())
+        self._file.close()
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class Debouncer:
+    """
+    Holds back touched paths until they stopped changing for `debounce` seconds,
+    or were first touched more than `max_delay` seconds ago.
+    """
+
+    def __init__(self, debounce: float, max_delay: float) -> None:
+        self.debounce = debounce
+        self.max_delay = max_delay
+        # path -> (first touched, last touched)
+        self._times: dict[str, tuple[float, float]] = {}
+
+    def touch(self, paths: Iterable[str], now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        for p in paths:
+            first, _ = self._times.get(p, (now, now))
+            self._times[p] = (first, now)
+
+    def ready(self, now: Optional[float] = None) -> set[str]:
+        """The paths due for a backup."""
+        now = time.monotonic() if now is None else now
+        return {
+            p
+            for p, (first, last) in self._times.items()
+            if now - last >= self.debounce or now - first >= self.max_delay
+        }
+
+    def remove(self, paths: Iterable[str]) -> None:
+        for p in paths:
+            self._times.pop(p, None)
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+
+def watch(
+    paths_to_backup: list[PathLike[str]],
+    target_dir: PathLike[str],
+    excluded_paths: Optional[list[PathLike[str]]] = None,
+    settings: Optional[WatchSettings] = None,
+    stop: Optional[threading.Event] = None,
+    **backup_args: Any,
+) -> list[str]:
+    """
+    Keep backing up `paths_to_backup` to `target_dir` with incremental backups of
+    the files touched since the previous one, until `stop` is set.
+
+    The first backup compares all files, to catch the changes made while nothing
+    was watching. After that, a backup is made every `settings.interval` seconds if
+    a touched path is due, see `Debouncer`. A failed backup is retried with the
+    next one, of a backup that only failed for some files just these files are
+    kept in the journal and retried. The catalog has to be opened, see
+    `db.db.init_database`.
+
+    Parameters:
+    - `excluded_paths`: see `backup.do_backup`, excluded paths aren't watched
+    - `settings`: defaults to `WatchSettings()`
+    - `stop`: ends the watch once set, without it the watch runs until interrupted
+    - `backup_args`: passed on to `backup.do_incremental_backup`, e.g. `workers`
+
+    Returns:
+        The archives written
+    """
+    settings = settings or WatchSettings()
+    stop = stop or threading.Event()
+    roots = [Path(path.abspath(p)).as_posix() for p in paths_to_backup]
+    matcher = ExclusionMatcher(excluded_paths or [])
+    journal = ChangeJournal(journal_path(target_dir, roots))
+    debouncer = Debouncer(settings.debounce, settings.max_delay)
+    archives: list[str] = []
+    # started before the first backup, so no change between the two is missed
+    watcher = open_watcher(roots, matcher or None, settings)
+    log.info(f"Watching {', '.join(roots)} with {type(watcher).__name__}")
+    try:
+        complete = True
+        next_backup = time.monotonic()
+        while not stop.is_set():
+            timeout = min(max(0.0, next_backup - time.monotonic()), _WAKEUP)
+            if touched := watcher.changes(timeout):
+                journal.add(touched)
+                debouncer.touch(touched)
+            now = time.monotonic()
+            if now < next_backup:
+                continue
+            next_backup = now + settings.interval
+            due = set(journal.paths) if complete else debouncer.ready(now)
+            if not complete and not due:
+                continue
+            failed: list[str] = []
+            try:
+                out = backup.do_incremental_backup(
+                    roots,  # type: ignore
+                    target_dir,
+                    excluded_paths=excluded_paths,
+                    touched=None if complete else due,
+                    failed=failed,
+                    **backup_args,
+                )
+            except Exception as e:
+                log.exception(f"Backup of the watched directories failed: {e}")
+                out = None
+            if out is None:
+                continue
+            archives.append(out)
+            complete = False
+            retry = {Path(path.abspath(f)).as_posix() for f in failed}
+            # the files that failed are touched again, the rest of `due` is done
+            journal.add(retry)
+            journal.done(due - retry)
+            debouncer.remove(due)
+            debouncer.touch(retry)
+            log.info(
+                f"Backed up {len(due - retry)} touched paths, {len(retry)} failed,"
+                f" {len(debouncer)} pending"
+            )
+    finally:
+        watcher.close()
+        journal.close()
+    return archives
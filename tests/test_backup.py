@@ -1,5 +1,4 @@
 import io
-import json
 from os import path
 import os
 from pathlib import Path
@@ -12,7 +11,9 @@ import itertools
 
 
 from .context import raschel  # type: ignore
-from raschel import backup
+from raschel import backup, file_util, manifest
+from raschel import diff as diff_mod
+from raschel.pipeline import PipelineSettings
 from diff_match_patch import diff_match_patch  # type: ignore
 
 
@@ -65,7 +66,7 @@ def test_full_backup() -> None:
     out = backup.do_backup([TEST_DIR_IN], TEST_DIR_OUT)  # type: ignore
     backup_files = []
     with zipfile.ZipFile(out, "r") as archive:  # type: ignore
-        meta = backup.MetaInfo.from_dict(json.load(archive.open("meta.info")))
+        meta = backup.MetaInfo.from_manifest(manifest.read(archive))
 
         for root, dirs in meta.dirs.items():
             backup_files.extend([(Path(root) / dir["filename"]).as_posix() for dir in dirs])  # type: ignore
@@ -172,7 +173,7 @@ def test_excluded_file():
 
     # backup should still work
     with zipfile.ZipFile(out, "r") as archive:  # type: ignore
-        meta = backup.MetaInfo.from_dict(json.load(archive.open("meta.info")))
+        meta = backup.MetaInfo.from_manifest(manifest.read(archive))
 
         for root, dirs in meta.dirs.items():
             backup_files.extend([(Path(root) / dir["filename"]).as_posix() for dir in dirs])  # type: ignore
@@ -201,7 +202,7 @@ def test_excluded_multiple_files():
 
     # backup should still work
     with zipfile.ZipFile(out, "r") as archive:  # type: ignore
-        meta = backup.MetaInfo.from_dict(json.load(archive.open("meta.info")))
+        meta = backup.MetaInfo.from_manifest(manifest.read(archive))
 
         for root, dirs in meta.dirs.items():
             backup_files.extend([(Path(root) / dir["filename"]).as_posix() for dir in dirs])  # type: ignore
@@ -210,3 +211,200 @@ def test_excluded_multiple_files():
         assert file in original_files
         # file must not have been the excluded file
         assert file not in excluded
+
+
+def test_backup_hash_matches_content():
+    """"""
+
+    """Fixture"""
+    out = backup.do_backup([TEST_DIR_IN], TEST_DIR_OUT)  # type: ignore
+
+    """Check"""
+    with zipfile.ZipFile(out, "r") as archive:  # type: ignore
+        meta = backup.MetaInfo.from_manifest(manifest.read(archive))
+        for root, dirs in meta.dirs.items():
+            for dir in dirs:
+                original = (Path(root) / dir["filename"]).as_posix()
+                content = archive.read((Path(Path(root).name) / dir["filename"]).as_posix())
+                with open(original, "rb") as file:
+                    assert content == file.read()
+                assert dir["hash"] == file_util.get_file_hash(original)
+
+
+def test_parallel_backup_matches_sequential():
+    """"""
+
+    """Fixture"""
+    sequential = backup.do_backup([TEST_DIR_IN], TEST_DIR_OUT)  # type: ignore
+    parallel = backup.do_backup([TEST_DIR_IN], TEST_DIR_OUT, workers=4)  # type: ignore
+    # everything but the smallest files is streamed by the compress stage
+    settings = PipelineSettings(2, 1, 3, max_in_flight=2, read_ahead=16)
+    staged = backup.do_backup([TEST_DIR_IN], TEST_DIR_OUT, workers=settings)  # type: ignore
+
+    """Check"""
+    for other in (parallel, staged):
+        with zipfile.ZipFile(sequential) as a, zipfile.ZipFile(other) as b:  # type: ignore
+            assert b.testzip() is None
+            members = [info.filename for info in a.infolist() if info.filename != "meta.info"]
+            assert members == [info.filename for info in b.infolist() if info.filename != "meta.info"]
+            for member in members:
+                assert a.read(member) == b.read(member)
+            meta_a = backup.MetaInfo.from_manifest(manifest.read(a))
+            meta_b = backup.MetaInfo.from_manifest(manifest.read(b))
+            for root, dirs in meta_a.dirs.items():
+                assert [d["hash"] for d in dirs] == [d["hash"] for d in meta_b.dirs[root]]
+
+
+def test_binary_delta_roundtrip():
+    base = random.Random(0).randbytes(100_000)
+    new = base[:5000] + b"inserted" + base[5000:90_000] + random.Random(1).randbytes(3000)
+
+    block_size = diff_mod.delta_block_size(len(base))
+    signature = diff_mod.delta_signature(io.BytesIO(base), block_size)
+    delta = io.BytesIO()
+    diff_mod.make_delta(signature, io.BytesIO(new), delta)
+    delta.seek(0)
+    out = io.BytesIO()
+    diff_mod.apply_delta(io.BytesIO(base), delta, out)
+
+    assert out.getvalue() == new
+    assert len(delta.getvalue()) < 10_000
+
+
+def test_binary_delta_after_long_literal():
+    base = random.Random(0).randbytes(1_000_000)
+    # the literal run is long enough for the strided search
+    new = random.Random(1).randbytes(300_001) + base + b"tail"
+
+    block_size = diff_mod.delta_block_size(len(base))
+    signature = diff_mod.delta_signature(io.BytesIO(base), block_size)
+    delta = io.BytesIO()
+    diff_mod.make_delta(signature, io.BytesIO(new), delta)
+    delta.seek(0)
+    out = io.BytesIO()
+    diff_mod.apply_delta(io.BytesIO(base), delta, out)
+
+    assert out.getvalue() == new
+    # the skipped blocks at the start of the match were recovered
+    assert len(delta.getvalue()) < 300_001 + signature.block_size
+
+
+def test_archive_changeset():
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    src = f"{root}/in"
+    os.makedirs(src)
+    for name in ("keep", "change", "delete"):
+        with open(f"{src}/{name}.txt", "w") as file:
+            file.write(name)
+    out = backup.do_backup([src], f"{root}/out")  # type: ignore
+
+    with open(f"{src}/change.txt", "a") as file:
+        file.write(" changed")
+    st = os.stat(f"{src}/change.txt")
+    os.utime(f"{src}/change.txt", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    # touched, but the content is the same
+    st = os.stat(f"{src}/keep.txt")
+    os.utime(f"{src}/keep.txt", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    os.remove(f"{src}/delete.txt")
+    with open(f"{src}/add.txt", "w") as file:
+        file.write("add")
+    os.makedirs(f"{src}/new/sub")
+    with open(f"{src}/new/sub/add.txt", "w") as file:
+        file.write("add")
+
+    """Test"""
+    with zipfile.ZipFile(out) as archive:  # type: ignore
+        changes = backup.get_archive_changeset(archive)
+
+    """Check"""
+    base = Path(src).absolute().as_posix()
+    assert changes.added == [f"{base}/add.txt", f"{base}/new/sub/add.txt"]
+    assert changes.modified == [f"{base}/change.txt"]
+    assert changes.deleted == [f"{base}/delete.txt"]
+    assert changes.unchanged == [f"{base}/keep.txt"]
+
+
+def test_diff_backup_only_diffs_below_dir_path(monkeypatch):
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    src = f"{root}/in"
+    for d in ("a", "b"):
+        os.makedirs(f"{src}/{d}")
+        with open(f"{src}/{d}/file.txt", "w") as file:
+            file.write(d)
+    full = backup.do_backup([src], f"{root}/out")  # type: ignore
+    for d in ("a", "b"):
+        with open(f"{src}/{d}/file.txt", "a") as file:
+            file.write(" changed")
+        st = os.stat(f"{src}/{d}/file.txt")
+        os.utime(f"{src}/{d}/file.txt", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    diffed: list[str] = []
+    write_diff = backup._write_diff
+
+    def _write_diff(filename, *args):
+        diffed.append(filename)
+        return write_diff(filename, *args)
+
+    monkeypatch.setattr(backup, "_write_diff", _write_diff)
+
+    """Test"""
+    out = backup.do_diff_backup(full, f"{src}/a", f"{root}/out")  # type: ignore
+
+    """Check"""
+    assert diffed == [Path(f"{src}/a/file.txt").absolute().as_posix()]
+    with zipfile.ZipFile(out) as archive:
+        assert [n for n in archive.namelist() if n != "meta.info"] == ["a/file.txt"]
+
+
+@pytest.mark.parametrize("workers", [1, PipelineSettings(1, 2, 2, read_ahead=1024)])
+def test_changed_files_are_retried_or_flagged(monkeypatch, workers):
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    src = f"{root}/in"
+    os.makedirs(src)
+    for name, size in (("settles", 100), ("busy", 5000), ("quiet", 5000)):
+        with open(f"{src}/{name}.txt", "w") as file:
+            file.write(name[0] * size)
+    inodes = {name: os.stat(f"{src}/{name}.txt").st_ino for name in ("settles", "busy")}
+    reads = {inode: 0 for inode in inodes.values()}
+    changed = backup._changed
+
+    def fake_changed(before, after):
+        # "settles" changes during its first read only, "busy" during every read
+        if before.st_ino in reads:
+            reads[before.st_ino] += 1
+            return before.st_ino == inodes["busy"] or reads[before.st_ino] == 1
+        return changed(before, after)
+
+    monkeypatch.setattr(backup, "_changed", fake_changed)
+
+    """Test"""
+    out = backup.do_backup([src], f"{root}/out", workers=workers)  # type: ignore
+
+    """Check"""
+    assert reads == {inodes["settles"]: 2, inodes["busy"]: backup.CHANGE_RETRIES + 1}
+    with zipfile.ZipFile(out) as archive:  # type: ignore
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == [
+            "in/busy.txt",
+            "in/quiet.txt",
+            "in/settles.txt",
+            manifest.MEMBER,
+        ]
+        records = {r["filename"]: r for _, r in manifest.read(archive)}
+        for name in ("settles", "busy", "quiet"):
+            content = archive.read(f"in/{name}.txt")
+            assert content == Path(f"{src}/{name}.txt").read_bytes()
+            assert records[f"{name}.txt"]["hash"] == file_util.get_file_hash(
+                f"{src}/{name}.txt"
+            )
+    assert records["busy.txt"][backup.UNSTABLE_KEY] is True
+    assert backup.UNSTABLE_KEY not in records["settles.txt"]
+    assert backup.UNSTABLE_KEY not in records["quiet.txt"]
@@ -0,0 +1,113 @@
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from .context import raschel  # type: ignore
+from raschel import backup, catalog, file_util
+from raschel.db import db
+
+
+@pytest.fixture()
+def tree():
+    root = tempfile.mkdtemp(prefix="raschel_")
+    db.init_database(f"{root}/backup.db")
+    src = f"{root}/in"
+    os.makedirs(src)
+    for i in range(3):
+        with open(f"{src}/file{i}.txt", "w") as file:
+            file.write(f"file {i}\n" * 100)
+    yield root
+    db.DATABASE.close()
+
+
+def test_file_history(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out = f"{tree}/in", f"{tree}/out"
+    filename = Path(f"{src}/file0.txt").as_posix()
+    full = backup.do_backup([src], out)  # type: ignore
+    first_hash = file_util.get_file_hash(filename)
+    with open(filename, "a") as file:
+        file.write("changed\n")
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    diff = backup.do_diff_backup(full, src, out)  # type: ignore
+    second_hash = file_util.get_file_hash(filename)
+
+    """Test"""
+    history = catalog.file_history(filename)
+    found = catalog.find_hash(first_hash)
+
+    """Check"""
+    assert [(v.backup.path, v.backup.kind, v.hash.value) for v in history] == [
+        (full, catalog.FULL, first_hash),
+        (diff, catalog.DIFF, second_hash),
+    ]
+    assert history[1].patch == backup.PATCH_TEXT
+    assert history[1].backup.parent_id == history[0].backup.id
+    assert [(v.file.path, v.backup.path) for v in found] == [(filename, full)]
+    assert catalog.find_hash("0" * 64) == []
+    # diff backups are not a base for incremental backups
+    assert catalog.latest_backup(catalog.roots_key([src])).path == full  # type: ignore
+
+
+def test_backup_without_catalog():
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    os.makedirs(f"{root}/in")
+    with open(f"{root}/in/file.txt", "w") as file:
+        file.write("raschel")
+
+    """Test"""
+    out = backup.do_backup([f"{root}/in"], f"{root}/out")  # type: ignore
+
+    """Check"""
+    assert db.is_open() is False
+    assert os.path.exists(out)  # type: ignore
+
+
+def test_backfill(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out = f"{tree}/in", f"{tree}/out"
+    db.DATABASE.close()
+    full = backup.do_backup([src], out)  # type: ignore
+    db.init_database(f"{tree}/backup.db")
+
+    """Test"""
+    added = catalog.backfill(out)
+    again = catalog.backfill(out)
+
+    """Check"""
+    assert (added, again) == (1, 0)
+    assert catalog.latest_backup(catalog.roots_key([src])).path == full  # type: ignore
+    assert len(catalog.file_history(f"{src}/file1.txt")) == 1
+
+
+def test_database_next_to_the_backups(tree: str, monkeypatch):
+    """"""
+
+    """Fixture"""
+    src, out = f"{tree}/in", f"{tree}/out"
+    db.init_database(db.database_path(out))
+    full = backup.do_backup([src], out)  # type: ignore
+    db.DATABASE.close()
+    # a later run from another working directory finds the same catalog
+    monkeypatch.chdir(src)
+
+    """Test"""
+    db.init_database(db.database_path(out))
+    head = backup.do_incremental_backup([src], out)  # type: ignore
+
+    """Check"""
+    assert os.path.isfile(f"{out}/backup.db")
+    assert not os.path.exists(f"{src}/backup.db")
+    assert str(backup.MetaInfo.from_path(head).parent) == str(  # type: ignore
+        backup.MetaInfo.from_path(full).id  # type: ignore
+    )
@@ -0,0 +1,167 @@
+import os
+import random
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from .context import raschel  # type: ignore
+from raschel import (
+    backup,
+    catalog,
+    checkpoint,
+    compress,
+    manifest,
+    restore,
+    verify,
+    volumes,
+)
+from raschel.db import db
+
+
+def _tree(sizes: list[int]) -> str:
+    root = tempfile.mkdtemp(prefix="raschel_")
+    rng = random.Random(len(sizes))
+    os.makedirs(f"{root}/in")
+    for i, size in enumerate(sizes):
+        with open(f"{root}/in/file{i}.bin", "wb") as file:
+            file.write(rng.randbytes(size))
+    return root
+
+
+def _check_restore(root: str, out: str) -> None:
+    report = restore.restore(out, f"{root}/restored")
+    assert not report.failed
+    for original in Path(f"{root}/in").iterdir():
+        (restored,) = Path(f"{root}/restored").rglob(original.name)
+        assert restored.read_bytes() == original.read_bytes()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failed_backup_is_resumed(monkeypatch, workers: int):
+    """"""
+
+    """Fixture"""
+    root = _tree([1000] * 6)
+    open_source = compress.open_source
+    opened: list[str] = []
+
+    def failing(filename, policy):
+        if filename.endswith("file3.bin"):
+            raise OSError("disk on fire")
+        return open_source(filename, policy)
+
+    def counting(filename, policy):
+        opened.append(Path(filename).name)
+        return open_source(filename, policy)
+
+    monkeypatch.setattr(compress, "open_source", failing)
+    failed = backup.do_backup(
+        [f"{root}/in"], f"{root}/out", workers=workers, checkpoint_every=2  # type: ignore
+    )
+    (out,) = [p.as_posix() for p in Path(f"{root}/out").glob("*.zip")]
+    _, written = checkpoint.load(out)
+    monkeypatch.setattr(compress, "open_source", counting)
+
+    """Test"""
+    resumed = backup.do_backup(
+        [f"{root}/in"], f"{root}/out", workers=workers, resume=out  # type: ignore
+    )
+
+    """Check"""
+    assert failed is None
+    assert len(written) == 5
+    assert resumed == out
+    assert opened == ["file3.bin"]
+    assert not Path(checkpoint.checkpoint_path(out)).exists()  # type: ignore
+    report = verify.verify_archive(out, deep=True)  # type: ignore
+    assert report.ok and report.members == 7
+    _check_restore(root, out)  # type: ignore
+
+
+def test_killed_split_backup_is_resumed(monkeypatch):
+    """"""
+
+    """Fixture"""
+    root = _tree([20 * 1024] * 8)
+    open_source = compress.open_source
+    calls = []
+
+    def killed(filename, policy):
+        calls.append(filename)
+        if len(calls) == 6:
+            raise KeyboardInterrupt
+        return open_source(filename, policy)
+
+    monkeypatch.setattr(compress, "open_source", killed)
+    with pytest.raises(KeyboardInterrupt):
+        backup.do_backup(
+            [f"{root}/in"],
+            f"{root}/out",
+            volume_size=50 * 1024,
+            checkpoint_every=1,
+        )
+    monkeypatch.setattr(compress, "open_source", open_source)
+    (out,) = [
+        p.as_posix() for p in Path(f"{root}/out").glob("*.zip") if not volumes.is_volume(p)
+    ]
+    _, written = checkpoint.load(out)
+    last = volumes.volume_path(out, max(e["member"]["volume"] for e in written))
+    # a member cut off by the crash and a checkpoint line that was being written
+    with open(last, "ab") as file:
+        file.write(b"PK\x03\x04 partial member")
+    with open(checkpoint.checkpoint_path(out), "a") as file:
+        file.write('{"root_dir": "/x", "rec')
+
+    """Test"""
+    backup.do_backup(
+        [f"{root}/in"], f"{root}/out", volume_size=50 * 1024, resume=out
+    )
+
+    """Check"""
+    assert len(written) == 5
+    assert last != out
+    report = verify.verify_archive(out, deep=True)
+    assert report.ok and report.members == 9
+    _check_restore(root, out)
+
+
+def test_partial_backup_is_not_used(monkeypatch):
+    """"""
+
+    """Fixture"""
+    root = _tree([1000] * 3)
+    db.init_database(f"{root}/backup.db")
+    full = backup.do_backup([f"{root}/in"], f"{root}/out")  # type: ignore
+    open_source = compress.open_source
+
+    def failing(filename, policy):
+        if filename.endswith("file1.bin"):
+            raise OSError("disk on fire")
+        return open_source(filename, policy)
+
+    monkeypatch.setattr(compress, "open_source", failing)
+
+    """Test"""
+    failed = backup.do_backup(
+        [f"{root}/in"], f"{root}/out", checkpoint_every=1  # type: ignore
+    )
+    (partial,) = [
+        p for p in Path(f"{root}/out").glob("*.zip") if p.as_posix() != full
+    ]
+
+    """Check"""
+    assert failed is None
+    assert checkpoint.is_partial(partial)
+    with zipfile.ZipFile(partial) as archive:
+        assert manifest.MEMBER not in archive.namelist()
+    assert catalog.backfill(f"{root}/out") == 0
+    # as if it had been added to the catalog by an older version
+    roots = catalog.roots_key([f"{root}/in"])
+    partial_id = partial.name.partition("_")[0]
+    catalog.register_backup(partial_id, partial.as_posix(), roots, catalog.FULL)
+    assert catalog.latest_backup(roots).path == full  # type: ignore
+    with pytest.raises(KeyError):
+        restore.find_archive(partial_id, partial.parent)
+    db.DATABASE.close()
@@ -0,0 +1,55 @@
+import os
+import random
+import tempfile
+import zipfile
+from pathlib import Path
+
+from .context import raschel  # type: ignore
+from raschel import backup, compress, config, manifest
+
+
+def test_policy_extension_and_entropy():
+    policy = compress.CompressionPolicy()
+    rng = random.Random(0)
+
+    assert policy.choose("photo.JPG") == compress.STORED
+    assert policy.choose("archive.tar.gz") == compress.STORED
+    assert policy.choose("noise.bin", rng.randbytes(4096)) == compress.STORED
+    assert policy.choose("notes.txt", b"hello world\n" * 400) == compress.MAX
+    # tiny samples fall back to the default
+    assert policy.choose("noise.bin", rng.randbytes(100)) == compress.MAX
+
+
+def test_policy_from_config():
+    cfg = config.Config(compression={"stored_extensions": [".iso"], "default": "fast"})
+    policy = compress.CompressionPolicy.from_config(cfg)
+
+    assert policy.choose("disk.iso") == compress.STORED
+    assert policy.choose("notes.txt") == compress.FAST
+    assert compress.CompressionPolicy.from_config(None).default == compress.MAX
+
+
+def test_backup_records_compression():
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    src = f"{root}/in"
+    os.makedirs(src)
+    with open(f"{src}/noise.bin", "wb") as file:
+        file.write(random.Random(0).randbytes(64 * 1024))
+    with open(f"{src}/text.txt", "w") as file:
+        file.write("raschel " * 8192)
+
+    """Test"""
+    for workers in (1, 2):
+        out = backup.do_backup([src], f"{root}/out", workers=workers)  # type: ignore
+
+        """Check"""
+        with zipfile.ZipFile(out) as archive:  # type: ignore
+            meta = backup.MetaInfo.from_manifest(manifest.read(archive))
+            methods = {f["filename"]: f["compression"] for f in meta.dirs[Path(src).as_posix()]}
+            assert methods == {"noise.bin": compress.STORED, "text.txt": compress.MAX}
+            assert archive.getinfo("in/noise.bin").compress_type == zipfile.ZIP_STORED
+            assert archive.getinfo("in/text.txt").compress_type == zipfile.ZIP_DEFLATED
+            assert archive.testzip() is None
@@ -0,0 +1,50 @@
+import os
+import tempfile
+from pathlib import Path
+
+from .context import raschel  # type: ignore
+from raschel import backup
+from raschel.exclude import ExclusionMatcher
+
+
+def test_exclusion_patterns():
+    """"""
+
+    """Fixture"""
+    matcher = ExclusionMatcher(
+        ["/data/secret", "*.log", "node_modules", "build/", "docs/**/*.md", "/srv/*/cache"]
+    )
+
+    """Check"""
+    assert matcher.is_excluded("/data/secret")
+    assert matcher.is_excluded("/data/secret/key.pem", "key.pem")
+    assert not matcher.is_excluded("/data/secrets", "secrets")
+    assert matcher.is_excluded("/x/app.log", "app.log")
+    assert matcher.is_excluded("/x/a/b/app.log", "a/b/app.log")
+    assert not matcher.is_excluded("/x/app.log.txt", "app.log.txt")
+    assert matcher.is_excluded("/x/node_modules/left-pad/index.js", "node_modules/left-pad/index.js")
+    assert matcher.is_excluded("/x/a/build", "a/build", is_dir=True)
+    assert not matcher.is_excluded("/x/a/build", "a/build")
+    assert matcher.is_excluded("/x/docs/readme.md", "docs/readme.md")
+    assert matcher.is_excluded("/x/docs/a/b/readme.md", "docs/a/b/readme.md")
+    assert not matcher.is_excluded("/x/src/docs/readme.md", "src/docs/readme.md")
+    assert matcher.is_excluded("/srv/www/cache/index.html")
+    assert not matcher.is_excluded("/srv/www/data/cache")
+
+
+def test_excluded_directories_are_pruned():
+    """"""
+
+    """Fixture"""
+    root = Path(tempfile.mkdtemp(prefix="raschel_")) / "in"
+    for name in ["keep.txt", "skip.log", "cache/a.txt", "sub/cache/b.txt", "sub/c.txt", "sub/d.txt"]:
+        os.makedirs((root / name).parent, exist_ok=True)
+        (root / name).write_text(name)
+    excluded = ["*.log", "cache/", (root / "sub" / "d.txt").as_posix()]
+
+    """Test"""
+    files = backup.backup_files([root], excluded)
+
+    """Check"""
+    names = sorted(Path(f.path).relative_to(root).as_posix() for f in files)
+    assert names == ["keep.txt", "sub/c.txt"]
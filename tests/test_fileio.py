@@ -0,0 +1,60 @@
+import hashlib
+import io
+import random
+import tempfile
+
+from .context import raschel  # type: ignore
+from raschel import diff, fileio
+
+
+def test_hash_and_views_match_contents(monkeypatch):
+    """"""
+
+    """Fixture"""
+    # map everything from 64 KiB on
+    monkeypatch.setattr(fileio, "MMAP_THRESHOLD", 64 * 1024)
+    root = tempfile.mkdtemp(prefix="raschel_")
+    rng = random.Random(0)
+    files = {}
+    for size in (0, 1, 4096, 64 * 1024 - 1, 64 * 1024, 300_000):
+        data = rng.randbytes(size)
+        filename = f"{root}/file{size}"
+        with open(filename, "wb") as file:
+            file.write(data)
+        files[filename] = data
+
+    """Test"""
+    hashes = {filename: fileio.hash_file(filename) for filename in files}
+    outer = fileio.iter_views(io.BytesIO(b"a" * 100_000), 100_000)
+    first = bytes(next(outer))
+    # a nested read gets a buffer of its own
+    inner = b"".join(bytes(v) for v in fileio.iter_views(io.BytesIO(b"b" * 70_000)))
+    rest = b"".join(bytes(v) for v in outer)
+
+    """Check"""
+    for filename, data in files.items():
+        assert hashes[filename] == hashlib.sha256(data).hexdigest()
+        with fileio.open_view(filename) as view:
+            assert bytes(view) == data
+    assert first + rest == b"a" * 100_000
+    assert inner == b"b" * 70_000
+    assert fileio.buffer_size(0) == fileio.MIN_BUFFER
+    assert fileio.buffer_size(300_000) == 512 * 1024
+    assert fileio.buffer_size(2**40) == fileio.MAX_BUFFER
+
+
+def test_text_diff_keeps_line_endings():
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    old = "first line\r\nsecond line\r\nthird line\r\n".encode()
+    new = "first line\r\nchanged line\r\nthird line\r\nüber\r\n"
+    with open(f"{root}/file.txt", "wb") as file:
+        file.write(new.encode())
+
+    """Test"""
+    patch = diff.diff_text1(f"{root}/file.txt", old)
+
+    """Check"""
+    assert diff.apply_patch_text(old.decode(), str(patch)) == new
@@ -0,0 +1,168 @@
+import os
+import random
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from .context import raschel  # type: ignore
+from raschel import backup, catalog, restore
+from raschel.db import db
+
+
+@pytest.fixture()
+def tree():
+    root = tempfile.mkdtemp(prefix="raschel_")
+    db.init_database(f"{root}/backup.db")
+    src = f"{root}/in"
+    for d in ("a", "b"):
+        os.makedirs(f"{src}/{d}")
+        for i in range(3):
+            with open(f"{src}/{d}/file{i}.txt", "w") as file:
+                file.write(f"{d} {i}\n" * 100)
+    yield root
+    db.DATABASE.close()
+
+
+def _touch(filename: str, text: str) -> None:
+    with open(filename, "a") as file:
+        file.write(text)
+    # make sure the modification time differs from the recorded one
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def _members(archive_path: str) -> set[str]:
+    with zipfile.ZipFile(archive_path) as archive:
+        return {name for name in archive.namelist() if name != "meta.info"}
+
+
+def test_incremental_chain(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out = f"{tree}/in", f"{tree}/out"
+    full = backup.do_incremental_backup([src], out)  # type: ignore
+    assert full is not None
+    assert len(_members(full)) == 6
+
+    """Test"""
+    _touch(f"{src}/a/file0.txt", "changed")
+    with open(f"{src}/b/new.txt", "w") as file:
+        file.write("new")
+    os.remove(f"{src}/b/file1.txt")
+    first = backup.do_incremental_backup([src], out)  # type: ignore
+    assert first is not None
+
+    _touch(f"{src}/b/new.txt", " again")
+    second = backup.do_incremental_backup([src], out)  # type: ignore
+    assert second is not None
+
+    """Check"""
+    assert _members(first) == {"a/file0.txt", "b/new.txt"}
+    assert _members(second) == {"b/new.txt"}
+    first_meta = backup.MetaInfo.from_path(first)
+    second_meta = backup.MetaInfo.from_path(second)
+    assert first_meta.parent == str(backup.MetaInfo.from_path(full).id)
+    assert second_meta.parent == str(first_meta.id)
+    assert first_meta.deleted == {Path(f"{src}/b").as_posix(): ["file1.txt"]}
+
+    chain = catalog.resolve_chain(second_meta.id)
+    assert [b.path for b in chain] == [full, first, second]
+    state = backup.chain_files(chain)
+    assert len(state) == 6
+    assert state[(Path(f"{src}/b").as_posix(), "new.txt")][0] == second
+    assert state[(Path(f"{src}/a").as_posix(), "file1.txt")][0] == full
+
+
+def test_consolidate_chain(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out = f"{tree}/in", f"{tree}/out"
+    backup.do_incremental_backup([src], out)  # type: ignore
+    _touch(f"{src}/a/file2.txt", "changed")
+    os.remove(f"{src}/a/file1.txt")
+    head = backup.do_incremental_backup([src], out)  # type: ignore
+    assert head is not None
+
+    """Test"""
+    consolidated = backup.consolidate_chain(str(backup.MetaInfo.from_path(head).id), out)  # type: ignore
+
+    """Check"""
+    with zipfile.ZipFile(consolidated) as archive:
+        assert archive.testzip() is None
+        meta = backup.MetaInfo.from_path(consolidated)
+        files = 0
+        for root, records in meta.dirs.items():
+            for record in records:
+                files += 1
+                with open(Path(root) / record["filename"], "rb") as file:
+                    assert archive.read(backup.member_name(root, record["filename"])) == file.read()
+        assert files == 5
+    assert catalog.latest_backup(catalog.roots_key([src])).path == consolidated  # type: ignore
+    # nothing changed since, the next incremental backup is empty
+    assert _members(backup.do_incremental_backup([src], out)) == set()  # type: ignore
+
+
+def test_consolidate_diff_chain(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out, target = f"{tree}/in", f"{tree}/out", f"{tree}/restored"
+    blob = random.Random(0).randbytes(64 * 1024)
+    with open(f"{src}/b/image.bin", "wb") as file:
+        file.write(blob)
+    full = backup.do_backup([src], out)  # type: ignore
+    _touch(f"{src}/a/file0.txt", "changed")
+    with open(f"{src}/b/image.bin", "wb") as file:
+        file.write(blob[:1000] + b"changed" + blob[1000:])
+    st = os.stat(f"{src}/b/image.bin")
+    os.utime(f"{src}/b/image.bin", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    head = backup.do_diff_backup(full, src, out)  # type: ignore
+
+    """Test"""
+    consolidated = backup.consolidate_chain(str(backup.MetaInfo.from_path(head).id), out)  # type: ignore
+    report = restore.restore(consolidated, target)
+
+    """Check"""
+    meta = backup.MetaInfo.from_path(consolidated)
+    assert not meta.diff_backup and meta.parent is None
+    assert all("patch" not in r for records in meta.dirs.values() for r in records)
+    assert (report.restored, report.failed) == (7, [])
+    for dir, _, files in os.walk(src):
+        for file in files:
+            original = Path(dir) / file
+            restored = Path(target) / original.absolute().as_posix().lstrip("/")
+            assert restored.read_bytes() == original.read_bytes()
+
+
+def test_incremental_backup_of_touched_paths(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out = f"{tree}/in", f"{tree}/out"
+    backup.do_incremental_backup([src], out)  # type: ignore
+    _touch(f"{src}/a/file0.txt", "changed")
+    # changed but not reported as touched, so it isn't looked at
+    _touch(f"{src}/a/file1.txt", "changed")
+    os.makedirs(f"{src}/b/sub")
+    with open(f"{src}/b/sub/new.txt", "w") as file:
+        file.write("new")
+    os.remove(f"{src}/b/file2.txt")
+
+    """Test"""
+    head = backup.do_incremental_backup(
+        [src],  # type: ignore
+        out,  # type: ignore
+        touched=[f"{src}/a/file0.txt", f"{src}/b/sub", f"{src}/b/file2.txt"],
+    )
+
+    """Check"""
+    assert head is not None
+    assert _members(head) == {"a/file0.txt", "sub/new.txt"}
+    meta = backup.MetaInfo.from_path(head)
+    assert meta.deleted == {Path(f"{src}/b").as_posix(): ["file2.txt"]}
+    state = backup.chain_files(catalog.resolve_chain(meta.id))
+    assert len(state) == 6
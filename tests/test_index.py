@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from .context import raschel  # type: ignore
+from raschel import backup, file_util
+from raschel.db import db
+from raschel.index import FileIndex
+
+
+@pytest.fixture()
+def index_dir():
+    root = tempfile.mkdtemp(prefix="raschel_")
+    db.init_database(f"{root}/backup.db")
+    yield root
+    db.DATABASE.close()
+
+
+def test_index_reuses_unchanged_hash(index_dir: str):
+    """"""
+
+    """Fixture"""
+    filename = f"{index_dir}/file.txt"
+    with open(filename, "w") as file:
+        file.write("raschel")
+
+    """Test"""
+    with FileIndex() as index:
+        assert index.get_hash(filename) == file_util.get_file_hash(filename)
+    index = FileIndex()
+    assert index.get_hash(filename) == file_util.get_file_hash(filename)
+
+    """Check"""
+    assert (index.hits, index.misses) == (1, 0)
+
+    with open(filename, "a") as file:
+        file.write(" backup")
+    assert index.get_hash(filename) == file_util.get_file_hash(filename)
+    assert (index.hits, index.misses) == (1, 1)
+
+
+def test_backup_fills_index(index_dir: str):
+    """"""
+
+    """Fixture"""
+    src = f"{index_dir}/in"
+    os.makedirs(src)
+    for i in range(3):
+        with open(f"{src}/file{i}.txt", "w") as file:
+            file.write(f"content {i}")
+
+    """Test"""
+    index = FileIndex()
+    out = backup.do_backup([src], f"{index_dir}/out", index=index)  # type: ignore
+    with zipfile.ZipFile(out) as archive:  # type: ignore
+        assert backup.get_archive_file_diffs(archive, index) == []
+
+    """Check"""
+    assert index.misses == 0
+    assert db.FileState.select().count() == 3
+
+
+def test_index_adds_algorithm_column():
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    filename = f"{root}/file.txt"
+    with open(filename, "w") as file:
+        file.write("raschel")
+    st = os.stat(filename)
+    # a database from before file hashes could use other algorithms
+    old = sqlite3.connect(f"{root}/backup.db")
+    old.execute(
+        "CREATE TABLE filestate (path TEXT PRIMARY KEY, size INTEGER,"
+        " mtime_ns INTEGER, inode INTEGER, hash VARCHAR(128))"
+    )
+    old.execute(
+        "INSERT INTO filestate VALUES (?, ?, ?, ?, ?)",
+        (Path(filename).as_posix(), st.st_size, st.st_mtime_ns, st.st_ino, "cached"),
+    )
+    old.commit()
+    old.close()
+
+    """Test"""
+    db.init_database(f"{root}/backup.db")
+    index = FileIndex()
+    cached = index.get_hash(filename)
+    blake = index.get_hash(filename, algorithm="blake2b")
+    db.DATABASE.close()
+
+    """Check"""
+    assert cached == "cached"
+    assert blake == file_util.get_file_hash(filename, "blake2b")
+    assert (index.hits, index.misses) == (1, 1)
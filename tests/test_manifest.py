@@ -0,0 +1,133 @@
+import json
+import mmap
+import operator
+import os
+import random
+import zipfile
+import tempfile
+
+import pytest
+
+from .context import raschel  # type: ignore
+from raschel import backup, manifest
+
+
+def _records(n: int) -> dict[str, list[dict]]:
+    rng = random.Random(0)
+    dirs: dict[str, list[dict]] = {}
+    for i in range(n):
+        root = f"/data/root{i % 3}"
+        dirs.setdefault(root, []).append(
+            {
+                "filename": f"dir{rng.randrange(10)}/file{i}.txt",
+                "hash": rng.randbytes(32).hex(),
+                "timestamp": "2024-05-01T12:00:00.123456",
+                "last_modified": f"2024-04-{1 + i % 28:02d}T08:30:{i % 60:02d}",
+                "compression": rng.choice(["stored", "max"]),
+            }
+        )
+    return dirs
+
+
+def test_manifest_roundtrip_and_lookup():
+    """"""
+
+    """Fixture"""
+    dirs = _records(500)
+    dirs["/data/odd"] = [{"filename": "weird", "hash": "not hex", "last_modified": 1}]
+    attributes = {"id": "abc", "parent": None, "diff_backup": False, "deleted": {}}
+
+    """Test"""
+    data = manifest.Manifest(manifest.encode(dirs, attributes))
+
+    """Check"""
+    assert data.attributes == attributes
+    assert len(data) == 501
+    decoded = data.to_dirs()
+    for root_dir, records in dirs.items():
+        key = operator.itemgetter("filename")
+        assert sorted(records, key=key) == decoded[root_dir]
+        for record in records:
+            assert data.lookup(root_dir, record["filename"]) == record
+        assert data.lookup(root_dir, "dir0/missing") is None
+        assert data.lookup(root_dir, "") is None
+        assert data.lookup(root_dir, "zzz") is None
+    assert data.lookup("/elsewhere", "dir0/file0.txt") is None
+
+
+def test_reads_json_meta_info():
+    """"""
+
+    """Fixture"""
+    meta = backup.MetaInfo(_records(20), parent="parent-id")
+    out = f"{tempfile.mkdtemp(prefix='raschel_')}/old.zip"
+    with zipfile.ZipFile(out, "w") as archive:
+        archive.writestr("meta.info", meta.to_json())
+
+    """Test"""
+    read = backup.MetaInfo.from_path(out)
+    attributes = backup.MetaInfo.from_path(out, with_files=False)
+
+    """Check"""
+    assert str(read.id) == str(meta.id) == attributes.id
+    assert read.parent == attributes.parent == "parent-id"
+    assert attributes.dirs == {}
+    assert json.loads(read.to_json())["dirs"] == {
+        root: sorted(records, key=lambda r: r["filename"])
+        for root, records in meta.dirs.items()
+    }
+
+
+def test_spilling_writer_matches_in_memory_encode():
+    """"""
+
+    """Fixture"""
+    dirs = _records(300)
+    attributes = {"id": "abc"}
+    writer = manifest.ManifestWriter(spill_every=7)
+    # add the records interleaved and unsorted, like a walk would
+    for i in range(300):
+        root = f"/data/root{i % 3}"
+        writer.add(root, dirs[root][i // 3])
+    out = f"{tempfile.mkdtemp(prefix='raschel_')}/spilled.zip"
+
+    """Test"""
+    with zipfile.ZipFile(out, "w") as archive:
+        writer.write(archive, attributes)
+
+    """Check"""
+    with zipfile.ZipFile(out) as archive:
+        assert archive.read("meta.info") == manifest.encode(dirs, attributes)
+        assert manifest.read(archive).to_dirs() == manifest.Manifest(
+            manifest.encode(dirs, attributes)
+        ).to_dirs()
+
+
+def test_read_maps_only_the_manifest():
+    """"""
+
+    """Fixture"""
+    dirs = _records(50)
+    out = f"{tempfile.mkdtemp(prefix='raschel_')}/mapped.zip"
+    with zipfile.ZipFile(out, "w") as archive:
+        # pushes the manifest past the start of the file and off the page boundary
+        archive.writestr("big.bin", os.urandom(3 * 1024 * 1024 + 123))
+        writer = manifest.ManifestWriter()
+        for root_dir, records in dirs.items():
+            for record in records:
+                writer.add(root_dir, record)
+        writer.write(archive, {"id": "abc"})
+
+    """Test"""
+    with zipfile.ZipFile(out) as archive:
+        with manifest.read(archive) as data:
+            mapped = len(data._mapped)  # type: ignore
+            records = data.to_dirs()
+
+    """Check"""
+    assert records == manifest.Manifest(manifest.encode(dirs, {"id": "abc"})).to_dirs()
+    assert mapped < mmap.ALLOCATIONGRANULARITY + len(manifest.encode(dirs, {"id": "abc"}))
+    with pytest.raises(ValueError):
+        data.lookup("/data/root0", dirs["/data/root0"][0]["filename"])
+    # nothing holds on to the archive anymore
+    os.replace(out, f"{out}.moved")
@@ -0,0 +1,74 @@
+import random
+import threading
+import time
+
+from .context import raschel  # type: ignore
+from raschel import pipeline
+
+
+def test_pipeline_order_errors_and_backpressure():
+    """"""
+
+    """Fixture"""
+    lock = threading.Lock()
+    in_flight = [0, 0]  # current, highest
+
+    def enter(item: int) -> int:
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(random.random() / 1000)
+        if item % 7 == 3:
+            raise ValueError(item)
+        return item * 2
+
+    def square(value: int) -> int:
+        time.sleep(random.random() / 1000)
+        return value * value
+
+    stages = pipeline.Pipeline([(enter, 3), (square, 2)], max_in_flight=5)
+
+    """Test"""
+    results = []
+    for result in stages.run(range(100)):
+        with lock:
+            in_flight[0] -= 1
+        results.append(result)
+
+    """Check"""
+    assert [r.item for r in results] == list(range(100))
+    for r in results:
+        if r.item % 7 == 3:
+            assert isinstance(r.error, ValueError) and r.value is None
+        else:
+            assert r.error is None and r.value == (r.item * 2) ** 2
+    assert in_flight[1] <= 5
+
+
+def test_pipeline_stops_early():
+    """"""
+
+    """Fixture"""
+    discarded = []
+
+    def items():
+        yield from range(3)
+        raise OSError("walk failed")
+
+    stages = pipeline.Pipeline([(str, 2)], max_in_flight=2, discard=discarded.append)
+
+    """Test"""
+    first = stages.run(range(1000))
+    assert next(first).value == "0"
+    first.close()
+    failing = stages.run(items())
+
+    """Check"""
+    assert all(isinstance(value, (int, str)) for value in discarded)
+    assert len(discarded) <= 4
+    assert not [t for t in threading.enumerate() if t.name.startswith("pipeline-")]
+    try:
+        list(failing)
+        assert False
+    except OSError as e:
+        assert str(e) == "walk failed"
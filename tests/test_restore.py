@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import random
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from .context import raschel  # type: ignore
+from raschel import backup, manifest, restore
+from raschel.db import db
+
+
+@pytest.fixture()
+def tree():
+    root = tempfile.mkdtemp(prefix="raschel_")
+    src = f"{root}/in"
+    for d in ("a", "b"):
+        os.makedirs(f"{src}/{d}")
+        for i in range(3):
+            with open(f"{src}/{d}/file{i}.txt", "w") as file:
+                file.write(f"{d} {i}\n" * 100)
+    yield root
+
+
+def _append(filename: str, text: str) -> None:
+    with open(filename, "a") as file:
+        file.write(text)
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def _restored(target: str, original: str) -> Path:
+    return Path(target) / Path(original).absolute().as_posix().lstrip("/")
+
+
+def _assert_restored(target: str, src: str) -> None:
+    for dir, _, files in os.walk(src):
+        for file in files:
+            original = Path(dir) / file
+            with open(original, "rb") as a, open(_restored(target, original), "rb") as b:
+                assert a.read() == b.read()
+
+
+def test_restore_full(tree: str):
+    """"""
+
+    """Fixture"""
+    src, target = f"{tree}/in", f"{tree}/restored"
+    out = backup.do_backup([src], f"{tree}/out")  # type: ignore
+
+    """Test"""
+    report = restore.restore(out, target, workers=2)  # type: ignore
+
+    """Check"""
+    assert (report.restored, report.failed) == (6, [])
+    _assert_restored(target, src)
+    assert os.path.getmtime(_restored(target, f"{src}/a/file0.txt")) == pytest.approx(
+        os.path.getmtime(f"{src}/a/file0.txt"), abs=1e-5
+    )
+
+
+def test_restore_only(tree: str):
+    src, target = f"{tree}/in", f"{tree}/restored"
+    out = backup.do_backup([src], f"{tree}/out")  # type: ignore
+
+    report = restore.restore(out, target, only="*/b/*")  # type: ignore
+
+    assert report.restored == 3
+    assert not _restored(target, f"{src}/a").exists()
+
+
+def test_restore_incremental_chain(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out, target = f"{tree}/in", f"{tree}/out", f"{tree}/restored"
+    db.init_database(f"{tree}/backup.db")
+    backup.do_incremental_backup([src], out)  # type: ignore
+    _append(f"{src}/a/file0.txt", "changed")
+    os.remove(f"{src}/b/file2.txt")
+    head = backup.do_incremental_backup([src], out)  # type: ignore
+    db.DATABASE.close()
+
+    """Test"""
+    report = restore.restore(head, target)  # type: ignore
+
+    """Check"""
+    assert (report.restored, report.failed) == (5, [])
+    _assert_restored(target, src)
+    assert not _restored(target, f"{src}/b/file2.txt").exists()
+
+
+def test_restore_mixed_hash_algorithms(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out, target = f"{tree}/in", f"{tree}/out", f"{tree}/restored"
+    db.init_database(f"{tree}/backup.db")
+    backup.do_incremental_backup([src], out)  # type: ignore
+    _append(f"{src}/a/file0.txt", "changed")
+    # unchanged files are compared with the sha256 of their records
+    head = backup.do_incremental_backup([src], out, hash_algorithm="blake2b")  # type: ignore
+    db.DATABASE.close()
+
+    """Test"""
+    report = restore.restore(head, target)  # type: ignore
+
+    """Check"""
+    assert (report.restored, report.failed) == (6, [])
+    _assert_restored(target, src)
+    with zipfile.ZipFile(head) as archive:  # type: ignore
+        records = list(manifest.read(archive))
+    assert len(records) == 1
+    _, record = records[0]
+    assert record["hash_algorithm"] == "blake2b"
+    assert record["hash"] == hashlib.blake2b(
+        Path(f"{src}/a/file0.txt").read_bytes()
+    ).hexdigest()
+    with pytest.raises(ValueError):
+        backup.do_backup([src], out, hash_algorithm="md4")  # type: ignore
+
+
+def test_restore_diff_backup(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out, target = f"{tree}/in", f"{tree}/out", f"{tree}/restored"
+    full = backup.do_backup([src], out)  # type: ignore
+    _append(f"{src}/b/file1.txt", "patched\n")
+    diff_archive = backup.do_diff_backup(full, src, out)  # type: ignore
+
+    """Test"""
+    report = restore.restore(diff_archive, target)
+
+    """Check"""
+    assert (report.restored, report.failed) == (6, [])
+    _assert_restored(target, src)
+
+
+def test_restore_detects_corruption(tree: str):
+    """"""
+
+    """Fixture"""
+    src, target = f"{tree}/in", f"{tree}/restored"
+    out = backup.do_backup([src], f"{tree}/out")  # type: ignore
+    meta = backup.MetaInfo.from_path(out)  # type: ignore
+    meta.dirs[Path(f"{src}/a").as_posix()][0]["hash"] = "0" * 64
+    with zipfile.ZipFile(out, "a") as archive, pytest.warns(UserWarning):  # type: ignore
+        archive.writestr("meta.info", meta.to_json())
+
+    """Test"""
+    report = restore.restore(out, target)  # type: ignore
+
+    """Check"""
+    assert report.restored == 5
+    assert len(report.failed) == 1
+    assert not _restored(target, report.failed[0]).exists()
+
+
+def test_restore_binary_diff_backup(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out, target = f"{tree}/in", f"{tree}/out", f"{tree}/restored"
+    blob = random.Random(0).randbytes(256 * 1024)
+    with open(f"{src}/a/image.bin", "wb") as file:
+        file.write(blob)
+    full = backup.do_backup([src], out)  # type: ignore
+    with open(f"{src}/a/image.bin", "wb") as file:
+        file.write(blob[:1000] + b"\0changed\0" + blob[1000:])
+    st = os.stat(f"{src}/a/image.bin")
+    os.utime(f"{src}/a/image.bin", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    """Test"""
+    diff_archive = backup.do_diff_backup(full, src, out)  # type: ignore
+    report = restore.restore(diff_archive, target)
+
+    """Check"""
+    meta = backup.MetaInfo.from_path(diff_archive)
+    (record,) = meta.dirs[Path(f"{src}/a").as_posix()]
+    assert record["patch"] == backup.PATCH_DELTA
+    with zipfile.ZipFile(diff_archive) as archive:
+        assert archive.getinfo("a/image.bin").file_size < 32 * 1024
+    assert (report.restored, report.failed) == (7, [])
+    _assert_restored(target, src)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_restore_same_directory_names(tree: str, workers: int):
+    """"""
+
+    """Fixture"""
+    src, out, target = f"{tree}/in", f"{tree}/out", f"{tree}/restored"
+    for d in ("a", "b"):
+        os.makedirs(f"{src}/{d}/x")
+        with open(f"{src}/{d}/x/f.txt", "w") as file:
+            file.write(f"{d}/x\n")
+    db.init_database(f"{tree}/backup.db")
+    backup.do_incremental_backup([src], out, workers=workers)  # type: ignore
+    os.makedirs(f"{src}/c/x")
+    with open(f"{src}/c/x/f.txt", "w") as file:
+        file.write("c/x\n")
+    head = backup.do_incremental_backup([src], out, workers=workers)  # type: ignore
+
+    """Test"""
+    consolidated = backup.consolidate_chain(str(backup.MetaInfo.from_path(head).id), out)  # type: ignore
+    db.DATABASE.close()
+    report = restore.restore(consolidated, target)
+
+    """Check"""
+    with zipfile.ZipFile(consolidated) as archive:
+        names = archive.namelist()
+    assert len(names) == len(set(names))
+    assert (report.restored, report.failed) == (9, [])
+    _assert_restored(target, src)
+
+
+def test_resolve_chain(tree: str):
+    """"""
+
+    """Fixture"""
+    src, out = f"{tree}/in", f"{tree}/out"
+    db.init_database(f"{tree}/backup.db")
+    backup.do_incremental_backup([src], out)  # type: ignore
+    os.remove(f"{src}/b/file2.txt")
+    os.remove(f"{src}/a/file1.txt")
+    backup.do_incremental_backup([src], out)  # type: ignore
+    with open(f"{src}/b/file2.txt", "w") as file:
+        file.write("back again\n")
+    head = backup.do_incremental_backup([src], out)  # type: ignore
+    db.DATABASE.close()
+
+    """Test"""
+    sources = list(restore.resolve(head))  # type: ignore
+
+    """Check"""
+    keys = [(s.root_dir, s.record["filename"]) for s in sources]
+    assert keys == sorted(keys)
+    assert [Path(s.original_path).relative_to(src).as_posix() for s in sources] == [
+        "a/file0.txt",
+        "a/file2.txt",
+        "b/file0.txt",
+        "b/file1.txt",
+        "b/file2.txt",
+    ]
+    assert sources[-1].archive == Path(head).absolute().as_posix()  # type: ignore
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+from .context import raschel  # type: ignore
+from raschel import backup, stats
+from raschel.pipeline import PipelineSettings
+from raschel.stats import BackupStats, Histogram
+
+
+@pytest.mark.parametrize("workers", [1, PipelineSettings(1, 2, 2)])
+def test_backup_records_stats(workers: int | PipelineSettings):
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    os.makedirs(f"{root}/in")
+    total = 0
+    for i in range(5):
+        with open(f"{root}/in/file{i}.txt", "w") as file:
+            total += file.write("raschel " * 1000 * (i + 1))
+    recorded = BackupStats(slow_files=3)
+
+    """Test"""
+    backup.do_backup(
+        [f"{root}/in"], f"{root}/out", workers=workers, stats=recorded  # type: ignore
+    )
+    recorded.dump(f"{root}/stats.json")
+
+    """Check"""
+    assert recorded.files == 5 and recorded.failed == 0
+    assert recorded.bytes_in == total
+    assert 0 < recorded.ratio < 0.1
+    expected = {stats.WALK, stats.COMPRESS, stats.MANIFEST}
+    if isinstance(workers, PipelineSettings):
+        expected |= {stats.READ, stats.WRITE}
+    assert set(recorded.stages) == expected
+    assert recorded.stages[stats.COMPRESS].durations.count == 5
+    assert recorded.stages[stats.WALK].durations.count == 5
+    assert len(recorded.slowest) == 3
+    assert recorded.slowest[0][0] >= recorded.slowest[-1][0]
+    with open(f"{root}/stats.json") as file:
+        assert json.load(file)["files"] == 5
+    assert "slowest files:" in recorded.summary()
+
+
+def test_histogram_percentiles():
+    """"""
+
+    """Fixture"""
+    histogram = Histogram()
+
+    """Test"""
+    for _ in range(98):
+        histogram.add(0.000_1)
+    histogram.add(0.01)
+    histogram.add(0.5)
+
+    """Check"""
+    assert histogram.count == 100
+    # upper bounds within a factor of two
+    assert 0.000_1 <= histogram.percentile(50) < 0.000_2
+    assert 0.01 <= histogram.percentile(99) < 0.02
+    assert histogram.percentile(100) == histogram.max == 0.5
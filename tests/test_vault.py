@@ -0,0 +1,99 @@
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+from pathlib import Path
+
+from .context import raschel  # type: ignore
+from raschel import manifest, vault
+
+
+def test_chunks_survive_insertion():
+    """"""
+
+    """Fixture"""
+    data = random.Random(0).randbytes(512 * 1024)
+    shifted = data[:1000] + b"inserted" + data[1000:]
+
+    """Test"""
+    chunks = list(vault.iter_chunks(io.BytesIO(data)))
+    shifted_chunks = list(vault.iter_chunks(io.BytesIO(shifted)))
+
+    """Check"""
+    assert b"".join(chunks) == data
+    assert all(len(c) <= vault.MAX_CHUNK_SIZE for c in chunks)
+    # only the chunk containing the insertion changes
+    assert len(set(chunks) - set(shifted_chunks)) == 1
+
+
+def test_chunk_sizes():
+    data = random.Random(2).randbytes(2 * 1024 * 1024)
+
+    chunks = list(vault.iter_chunks(io.BytesIO(data)))
+    # runs of a single byte value have no content to cut at
+    runs = list(vault.iter_chunks(io.BytesIO(b" " * 1024 * 1024)))
+
+    assert all(len(c) >= vault.MIN_CHUNK_SIZE for c in chunks[:-1])
+    assert vault.AVG_CHUNK_SIZE / 2 < len(data) / len(chunks) < vault.AVG_CHUNK_SIZE * 2
+    assert all(len(c) == vault.MAX_CHUNK_SIZE for c in runs)
+
+
+def test_vault_dedup_and_restore():
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    src = f"{root}/in"
+    os.makedirs(src)
+    base = random.Random(1).randbytes(256 * 1024)
+    for i in range(4):
+        with open(f"{src}/image{i}.bin", "wb") as file:
+            file.write(base[: i * 1000] + bytes([i]) + base[i * 1000 :])
+
+    """Test"""
+    store = vault.Vault(f"{root}/vault")
+    snapshot, stats = store.backup([src])  # type: ignore
+    report = store.restore(snapshot, f"{root}/restored")
+
+    """Check"""
+    assert stats.files == 4
+    assert stats.dedup_ratio > 2
+    assert (report.restored, report.failed) == (4, [])
+    assert manifest.is_manifest(Path(snapshot).read_bytes())
+    for i in range(4):
+        original = Path(src).absolute() / f"image{i}.bin"
+        restored = Path(f"{root}/restored") / original.as_posix().lstrip("/")
+        assert original.read_bytes() == restored.read_bytes()
+    # a second snapshot of the same data doesn't store anything new
+    _, stats = store.backup([src])  # type: ignore
+    assert stats.new_chunks == 0
+
+
+def test_restore_json_snapshot():
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    store = vault.Vault(f"{root}/vault")
+    data = random.Random(2).randbytes(100 * 1024)
+    chunks = [store.put_chunk(chunk)[0] for chunk in vault.iter_chunks(io.BytesIO(data))]
+    snapshot = f"{root}/vault/snapshots/old.json"
+    record = {
+        "filename": "old.bin",
+        "hash": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+        "chunks": chunks,
+        "timestamp": "2020-01-01T00:00:00",
+        "last_modified": "2020-01-01T00:00:00",
+    }
+    with open(snapshot, "w") as file:
+        json.dump({"id": "old", "dirs": {"/data": [record]}}, file, indent=4)
+
+    """Test"""
+    report = store.restore(snapshot, f"{root}/restored")
+
+    """Check"""
+    assert (report.restored, report.bytes, report.failed) == (1, len(data), [])
+    assert Path(f"{root}/restored/data/old.bin").read_bytes() == data
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import zipfile
+
+from .context import raschel  # type: ignore
+from raschel import backup, compress, manifest, verify
+
+
+def _tree() -> str:
+    root = tempfile.mkdtemp(prefix="raschel_")
+    for i in range(6):
+        os.makedirs(f"{root}/in/dir{i % 2}", exist_ok=True)
+        with open(f"{root}/in/dir{i % 2}/file{i}.txt", "w") as file:
+            file.write(f"content {i}\n" * (i * 100 + 1))
+    return root
+
+
+def test_verify_intact_and_corrupted_archives():
+    """"""
+
+    """Fixture"""
+    root = _tree()
+    out = backup.do_backup([f"{root}/in"], f"{root}/out")  # type: ignore
+    corrupted = f"{root}/corrupted.zip"
+    with open(out, "rb") as src, open(corrupted, "wb") as dst:  # type: ignore
+        dst.write(src.read())
+    with zipfile.ZipFile(corrupted) as archive:
+        zinfo = archive.getinfo("dir1/file5.txt")
+        with compress.open_raw(archive, zinfo) as raw:
+            offset = raw.tell()
+    with open(corrupted, "r+b") as file:
+        file.seek(offset + 10)
+        byte = file.read(1)
+        file.seek(offset + 10)
+        file.write(bytes([byte[0] ^ 0xFF]))
+
+    """Test"""
+    (shallow,) = verify.verify([out], workers=2)  # type: ignore
+    deep = verify.verify_archive(out, deep=True, workers=2)  # type: ignore
+    broken = verify.verify_archive(corrupted, deep=False)
+
+    """Check"""
+    assert shallow.ok and deep.ok
+    assert deep.skipped == 0
+    assert shallow.members == deep.members == 7
+    with zipfile.ZipFile(out) as archive:  # type: ignore
+        assert deep.bytes == sum(info.file_size for info in archive.infolist())
+    assert not broken.ok
+    assert [p.member for p in broken.problems] == ["dir1/file5.txt"]
+    assert broken.to_dict()["ok"] is False
+
+
+def test_verify_deep_detects_hash_mismatch():
+    """"""
+
+    """Fixture"""
+    root = _tree()
+    out = backup.do_backup([f"{root}/in"], f"{root}/out")  # type: ignore
+    with zipfile.ZipFile(out) as archive:  # type: ignore
+        meta = backup.MetaInfo.from_manifest(manifest.read(archive))
+    # same members, the manifest claims other content for one file and lists a
+    # file that is missing
+    records = meta.dirs[f"{root}/in/dir0"]
+    records[0]["hash"] = "00" * 32
+    records.append(dict(records[1], filename="gone.txt"))
+    tampered = f"{root}/tampered.zip"
+    with zipfile.ZipFile(out) as src, zipfile.ZipFile(tampered, "w") as dst:  # type: ignore
+        for info in src.infolist():
+            if info.filename != manifest.MEMBER:
+                compress.copy_member(src, dst, info.filename)
+        meta.write(dst)
+
+    """Test"""
+    shallow = verify.verify_archive(tampered)
+    deep = verify.verify_archive(tampered, deep=True)
+
+    """Check"""
+    assert [p.member for p in shallow.problems] == ["dir0/gone.txt"]
+    assert sorted(p.member for p in deep.problems) == ["dir0/file0.txt", "dir0/gone.txt"]
+    assert [p.error[:13] for p in deep.problems if p.member == "dir0/file0.txt"] == [
+        "Hash mismatch"
+    ]
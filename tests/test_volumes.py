@@ -0,0 +1,81 @@
+import os
+import random
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from .context import raschel  # type: ignore
+from raschel import backup, manifest, restore, verify, volumes
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_split_backup_restores_and_verifies(workers: int):
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    rng = random.Random(workers)
+    os.makedirs(f"{root}/in")
+    contents: dict[str, bytes] = {}
+    for i in range(8):
+        # random bytes barely compress, so the volume sizes are predictable
+        contents[f"file{i}.bin"] = rng.randbytes(20 * 1024)
+        with open(f"{root}/in/file{i}.bin", "wb") as file:
+            file.write(contents[f"file{i}.bin"])
+
+    """Test"""
+    out = backup.do_backup(
+        [f"{root}/in"], f"{root}/out", workers=workers, volume_size=50 * 1024  # type: ignore
+    )
+    report = verify.verify_archive(out, deep=True)  # type: ignore
+    restored = restore.restore(out, f"{root}/restored")  # type: ignore
+
+    with open(f"{root}/in/file3.bin", "r+b") as file:
+        file.write(b"changed")
+    contents["file3.bin"] = b"changed" + contents["file3.bin"][7:]
+    diff_out = backup.do_diff_backup(out, f"{root}/in", f"{root}/out")  # type: ignore
+    patched = restore.restore(diff_out, f"{root}/patched", only="*/file3.bin")
+
+    """Check"""
+    paths = sorted(Path(f"{root}/out").glob("*.v*.zip"))
+    assert len(paths) >= 2
+    assert all(volumes.is_volume(p) for p in paths)
+    for p in paths:
+        with zipfile.ZipFile(p) as archive:
+            assert manifest.MEMBER not in archive.namelist()
+            assert p.stat().st_size < 60 * 1024
+    with zipfile.ZipFile(out) as archive:  # type: ignore
+        numbers = {volumes.record_volume(r) for _, r in manifest.read(archive)}
+    assert numbers == set(range(len(paths) + 1))
+
+    assert report.ok and report.members == 9
+    assert restored.restored == 8 and not restored.failed
+    assert patched.restored == 1 and not patched.failed
+    for name, data in contents.items():
+        restored_files = list(Path(f"{root}/restored").rglob(name))
+        assert len(restored_files) == 1
+        if name != "file3.bin":
+            assert restored_files[0].read_bytes() == data
+    (patched_file,) = Path(f"{root}/patched").rglob("file3.bin")
+    assert patched_file.read_bytes() == contents["file3.bin"]
+
+
+def test_volume_names_and_sizes():
+    """"""
+
+    """Test"""
+    first = volumes.volume_path("out/1_2.zip", 0)
+    third = volumes.volume_path("out/1_2.zip", 3)
+
+    """Check"""
+    assert first == "out/1_2.zip"
+    assert third == "out/1_2.v003.zip"
+    assert volumes.is_volume(third) and not volumes.is_volume(first)
+    assert volumes.parse_size("700M") == 700 * 2**20
+    assert volumes.parse_size("4gib") == 4 * 2**30
+    assert volumes.parse_size("1024") == 1024
+    for invalid in ["", "0", "1.5G", "ten"]:
+        with pytest.raises(ValueError):
+            volumes.parse_size(invalid)
@@ -0,0 +1,35 @@
+import os
+import tempfile
+from pathlib import Path
+
+from .context import raschel  # type: ignore
+from raschel import walker
+
+
+def test_walk_records_match_stat():
+    """"""
+
+    """Fixture"""
+    root = Path(tempfile.mkdtemp(prefix="raschel_"))
+    for i in range(40):
+        file = root / f"dir{i % 4}" / f"sub{i % 3}" / f"file{i}.txt"
+        os.makedirs(file.parent, exist_ok=True)
+        file.write_text("x" * i)
+
+    """Test"""
+    sequential = list(walker.walk([root]))
+    parallel = list(walker.walk([root], workers=4))
+    top = list(walker.walk([root / "dir0"], recursive=False))
+
+    """Check"""
+    assert sequential == parallel
+    assert len(sequential) == 40
+    for entry in sequential:
+        st = os.stat(entry.path)
+        assert (entry.size, entry.mtime_ns, entry.inode) == (
+            st.st_size,
+            st.st_mtime_ns,
+            st.st_ino,
+        )
+    assert top == []
+    assert list(walker.walk([root / "missing"])) == []
@@ -0,0 +1,205 @@
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from .context import raschel  # type: ignore
+from raschel import backup, catalog, compress, restore, watch
+from raschel.db import db
+from raschel.exclude import ExclusionMatcher
+
+
+def _write(filename: str, text: str) -> None:
+    os.makedirs(Path(filename).parent, exist_ok=True)
+    with open(filename, "w") as file:
+        file.write(text)
+
+
+@pytest.mark.parametrize("kind", ["inotify", "poll"])
+def test_watcher_reports_touched_paths(kind: str):
+    """"""
+
+    """Fixture"""
+    src = Path(tempfile.mkdtemp(prefix="raschel_")).as_posix()
+    _write(f"{src}/a/file.txt", "a")
+    _write(f"{src}/a/gone.txt", "gone")
+    matcher = ExclusionMatcher(["*.tmp"])
+    if kind == "inotify":
+        try:
+            watcher = watch.InotifyWatcher([src], matcher)
+        except OSError as e:
+            pytest.skip(f"inotify is not available: {e}")
+    else:
+        watcher = watch.PollingWatcher([src], matcher, interval=0)  # type: ignore
+
+    """Test"""
+    _write(f"{src}/a/file.txt", "changed")
+    os.remove(f"{src}/a/gone.txt")
+    _write(f"{src}/a/scratch.tmp", "excluded")
+    os.makedirs(f"{src}/new")
+    touched = watcher.changes(1.0)
+    # a file in a directory that only appeared since the last call, it is reported
+    # itself or through the new directory, which the backup walks
+    _write(f"{src}/new/deep/file.txt", "new")
+    covering = {f"{src}/new/deep", f"{src}/new/deep/file.txt"}
+    later: set[str] = set()
+    deadline = time.monotonic() + 5
+    while not (later & covering) and time.monotonic() < deadline:
+        later |= watcher.changes(0.2)
+    watcher.close()
+
+    """Check"""
+    assert {f"{src}/a/file.txt", f"{src}/a/gone.txt"} <= touched
+    assert later & covering
+    assert f"{src}/a/scratch.tmp" not in touched
+
+
+def test_journal_and_debouncer():
+    """"""
+
+    """Fixture"""
+    root = tempfile.mkdtemp(prefix="raschel_")
+    journal = watch.ChangeJournal(f"{root}/watch.journal")
+    journal.add(["/data/a", "/data/b"])
+    journal.close()
+    # a line cut off by a crash
+    with open(f"{root}/watch.journal", "a") as file:
+        file.write('"/data/c')
+    debouncer = watch.Debouncer(debounce=2, max_delay=10)
+
+    """Test"""
+    reopened = watch.ChangeJournal(f"{root}/watch.journal")
+    reopened.add(["/data/b", "/data/d"])
+    reopened.done(["/data/a"])
+    reopened.close()
+    debouncer.touch(["/data/a", "/data/b"], now=0)
+    debouncer.touch(["/data/b"], now=1)
+    debouncer.touch(["/data/c"], now=0)
+    for now in range(1, 11):
+        debouncer.touch(["/data/c"], now=now)
+
+    """Check"""
+    assert watch.ChangeJournal(f"{root}/watch.journal").paths == {"/data/b", "/data/d"}
+    assert debouncer.ready(now=2.5) == {"/data/a"}
+    assert debouncer.ready(now=3) == {"/data/a", "/data/b"}
+    # keeps changing, backed up after `max_delay`
+    assert "/data/c" not in debouncer.ready(now=9.5)
+    assert "/data/c" in debouncer.ready(now=10)
+
+
+def test_watch_backs_up_touched_files():
+    """"""
+
+    """Fixture"""
+    root = Path(tempfile.mkdtemp(prefix="raschel_")).as_posix()
+    db.init_database(f"{root}/backup.db")
+    src, out = f"{root}/in", f"{root}/out"
+    for i in range(4):
+        _write(f"{src}/dir/file{i}.txt", f"file {i}\n" * 100)
+    settings = watch.WatchSettings(interval=0.2, debounce=0.1, poll_interval=0.1)
+    stop = threading.Event()
+    archives: list[str] = []
+
+    def run():
+        archives.extend(watch.watch([src], out, settings=settings, stop=stop))  # type: ignore
+
+    def wait_for_backups(n: int) -> None:
+        deadline = time.monotonic() + 10
+        while len(list(Path(out).glob("*.zip"))) < n and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    """Test"""
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        wait_for_backups(1)
+        _write(f"{src}/dir/file0.txt", "changed")
+        os.remove(f"{src}/dir/file3.txt")
+        _write(f"{src}/dir/new/file.txt", "new")
+        wait_for_backups(2)
+    finally:
+        stop.set()
+        thread.join()
+
+    """Check"""
+    assert len(archives) == 2
+    meta = backup.MetaInfo.from_path(archives[1])
+    assert {r["filename"] for records in meta.dirs.values() for r in records} == {
+        "file0.txt",
+        "file.txt",
+    }
+    assert meta.deleted == {f"{src}/dir": ["file3.txt"]}
+    assert not watch.ChangeJournal(watch.journal_path(out, [src])).paths
+    report = restore.restore(archives[1], f"{root}/restored")
+    assert not report.failed
+    (restored,) = Path(f"{root}/restored").rglob("file0.txt")
+    assert restored.read_text() == "changed"
+    assert catalog.latest_backup(catalog.roots_key([src])).path == archives[1]  # type: ignore
+    db.DATABASE.close()
+
+
+def test_watch_retries_only_failed_files(monkeypatch):
+    """"""
+
+    """Fixture"""
+    root = Path(tempfile.mkdtemp(prefix="raschel_")).as_posix()
+    db.init_database(f"{root}/backup.db")
+    src, out = f"{root}/in", f"{root}/out"
+    for i in range(3):
+        _write(f"{src}/dir/file{i}.txt", f"file {i}\n" * 100)
+    _write(f"{src}/dir/bad.txt", "bad")
+    settings = watch.WatchSettings(interval=0.2, debounce=0.1, poll_interval=0.1)
+    stop = threading.Event()
+    broken = threading.Event()
+    broken.set()
+    archives: list[str] = []
+    calls: list[object] = []
+    open_source = compress.open_source
+    do_incremental_backup = backup.do_incremental_backup
+
+    def failing(filename, policy):
+        if broken.is_set() and filename.endswith("bad.txt"):
+            raise OSError("unreadable")
+        return open_source(filename, policy)
+
+    def recording(*args, **kwargs):
+        calls.append(kwargs["touched"])
+        return do_incremental_backup(*args, **kwargs)
+
+    monkeypatch.setattr(compress, "open_source", failing)
+    monkeypatch.setattr(backup, "do_incremental_backup", recording)
+
+    def run():
+        archives.extend(watch.watch([src], out, settings=settings, stop=stop))  # type: ignore
+
+    """Test"""
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while len(calls) < 4 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        broken.clear()
+        # the journal is emptied once the failed file is backed up
+        journal = Path(watch.journal_path(out, [src]))
+        deadline = time.monotonic() + 10
+        while journal.read_text() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        thread.join()
+
+    """Check"""
+    bad = f"{src}/dir/bad.txt"
+    assert len(archives) == 2
+    assert calls[0] is None
+    assert all(touched == {bad} for touched in calls[1:])
+    first = backup.MetaInfo.from_path(archives[0])
+    assert len(first.dirs[f"{src}/dir"]) == 3
+    second = backup.MetaInfo.from_path(archives[1])
+    assert [r["filename"] for r in second.dirs[f"{src}/dir"]] == ["bad.txt"]
+    assert not watch.ChangeJournal(watch.journal_path(out, [src])).paths
+    db.DATABASE.close()